@@ -0,0 +1,266 @@
+""" Benchmarks the condansis build pipeline on synthetic environments
+
+conda and makensis are replaced by local stand-ins (fake_conda.py and fake_makensis.py), so the
+benchmark runs without network access or NSIS. conda-pack is the real one.
+
+Examples
+---------
+Run the default sizes and store the results as a baseline::
+
+    python benchmarks/bench_build.py --output baseline.json
+
+Compare against the baseline, failing if any stage got slower than the tolerance::
+
+    python benchmarks/bench_build.py --compare baseline.json
+
+Benchmark an installer option::
+
+    python benchmarks/bench_build.py --size small --option pack_mode='"tar"'
+
+Compare the installer size and build time of payload orderings with solid lzma::
+
+    python benchmarks/bench_build.py --orderings walk,type --option solid_compression=true
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import tarfile
+import argparse
+import tempfile
+import functools
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+SIZES = {"tiny": 200, "small": 2000, "medium": 20000, "large": 200000}
+RESULTS_FORMAT = 1
+
+
+def _make_executable(bin_dir: Path, name: str, script: Path) -> Path:
+    # Wraps a stand-in script, so that it can be called as an executable
+    if sys.platform == "win32":
+        path = bin_dir / f"{name}.bat"
+        path.write_text(f'@"{sys.executable}" "{script}" %*\n')
+    else:
+        path = bin_dir / name
+        path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        path.chmod(0o755)
+    return path
+
+
+def _patch_conda_pack() -> None:
+    """ Lays out the unpack script of conda-pack as on Windows, when running elsewhere
+
+    Outside Windows, conda-pack writes the script to bin/conda-unpack, while condansis reads it
+    from Scripts/conda-unpack-script.py. The script is copied there after packing.
+    """
+    if sys.platform == "win32":
+        return
+    import conda_pack
+
+    pack = conda_pack.CondaEnv.pack
+
+    @functools.wraps(pack)
+    def pack_posix(self, output=None, format="infer", **kwargs):
+        result = pack(self, output=output, format=format, **kwargs)
+        script = "Scripts/conda-unpack-script.py"
+        if format == "no-archive":
+            os.makedirs(os.path.join(output, "Scripts"), exist_ok=True)
+            shutil.copyfile(os.path.join(output, "bin/conda-unpack"), os.path.join(output, script))
+        else:
+            with tarfile.open(output) as archive:
+                data = archive.extractfile("bin/conda-unpack").read()
+            with tarfile.open(output, "a") as archive:
+                info = tarfile.TarInfo(script)
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = int(time.time())
+                archive.addfile(info, io.BytesIO(data))
+        return result
+
+    conda_pack.CondaEnv.pack = pack_posix
+
+
+def _make_package(package_root: Path, n_files: int, seed: int) -> None:
+    (package_root / "app").mkdir(parents=True)
+    for i in range(max(n_files // 20, 1)):
+        (package_root / "app" / f"module{i}.py").write_text(f"VALUE = {i}\n" * 50)
+    spec = json.dumps({"n_files": n_files, "seed": seed})
+    (package_root / "environment.yml").write_text(
+        f"name: benchmark\n# condansis-benchmark: {spec}\ndependencies: []\n"
+    )
+
+
+def run_size(name: str, n_files: int, repeat: int, options: dict, seed: int) -> dict:
+    """ Builds an installer for a synthetic environment, repeat times
+
+    Returns the fastest time of each stage and of the full build
+    """
+    import condansis
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        _make_package(root / "package", n_files, seed)
+        makensis = _make_executable(root, "makensis", BENCHMARKS_DIR / "fake_makensis.py")
+        for _ in range(repeat):
+            trace = condansis.BuildTrace()
+            installer = condansis.Installer(
+                "benchmark",
+                root / "package",
+                installer_name=root / "install_benchmark.exe",
+                include=["app"],
+                install_root_package=False,
+                makensis_exe=makensis,
+                trace=trace,
+                **options,
+            )
+            start = time.perf_counter()
+            installer.create()
+            run = {"create": time.perf_counter() - start}
+            for span in trace.spans:
+                key = span.name if span.category == "stage" else f"subprocess:{span.name}"
+                run[key] = run.get(key, 0.0) + span.duration
+            for key, value in run.items():
+                timings[key] = min(timings.get(key, value), value)
+        installer_size = (root / "install_benchmark.exe").stat().st_size
+    return {"files": n_files, "installer_bytes": installer_size, "timings": timings}
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list:
+    """ Lists the timings which are slower than the baseline by more than the tolerance """
+    regressions = []
+    for size, result in results["results"].items():
+        base_timings = baseline["results"].get(size, {}).get("timings", {})
+        for key, value in sorted(result["timings"].items()):
+            if key not in base_timings:
+                continue
+            base = base_timings[key]
+            status = "ok"
+            if value > base * (1 + tolerance) and value - base > min_delta:
+                status = "REGRESSION"
+                regressions.append((size, key, base, value))
+            ratio = value / max(base, 1e-9)
+            print(f"{size:8s} {key:32s} {base:9.3f}s {value:9.3f}s {ratio:6.2f}x {status}")
+    return regressions
+
+
+def print_orderings(results: dict, sizes: dict, orderings: list) -> None:
+    """ Prints the installer size and build time of each payload ordering """
+    print(f"{'size':8s} {'ordering':12s} {'installer':>12s} {'vs first':>9s} {'makensis':>9s}")
+    for name in sizes:
+        first = results[f"{name}:{orderings[0]}"]
+        for ordering in orderings:
+            result = results[f"{name}:{ordering}"]
+            ratio = result["installer_bytes"] / max(first["installer_bytes"], 1)
+            nsis_time = result["timings"].get("run_nsis", 0.0)
+            print(
+                f"{name:8s} {ordering:12s} {result['installer_bytes']:12d} "
+                f"{ratio:8.3f}x {nsis_time:8.3f}s"
+            )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--size", action="append", choices=sorted(SIZES), help="Presets (default: tiny, small)"
+    )
+    parser.add_argument(
+        "--files", type=int, action="append", default=[], help="Custom number of files"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Builds per size, keeps the fastest")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--option", action="append", default=[], help="Installer option as NAME=JSON_VALUE"
+    )
+    parser.add_argument(
+        "--orderings",
+        help="Comma separated payload orderings to compare, implies --faithful",
+    )
+    parser.add_argument(
+        "--faithful",
+        action="store_true",
+        help="Compress with the algorithm in the NSIS script instead of fast zlib",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown")
+    parser.add_argument(
+        "--min-delta", type=float, default=0.05, help="Ignore slowdowns below this (s)"
+    )
+    args = parser.parse_args(argv)
+
+    bin_dir = Path(tempfile.mkdtemp())
+    try:
+        # must be set before importing condansis
+        os.environ["CONDA_EXE"] = str(
+            _make_executable(bin_dir, "conda", BENCHMARKS_DIR / "fake_conda.py")
+        )
+        if args.faithful or args.orderings:
+            os.environ["CONDANSIS_BENCH_FAITHFUL"] = "1"
+        sys.path.insert(0, str(BENCHMARKS_DIR.parent))
+        import condansis  # noqa: F401
+
+        _patch_conda_pack()
+        logging.getLogger().setLevel(logging.WARNING)
+
+        options = {}
+        for option in args.option:
+            key, value = option.split("=", 1)
+            options[key] = json.loads(value)
+        presets = args.size or ([] if args.files else ["tiny", "small"])
+        sizes = {name: SIZES[name] for name in presets}
+        sizes.update({str(n): n for n in args.files})
+
+        results = {
+            "format": RESULTS_FORMAT,
+            "machine": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+            },
+            "options": options,
+            "results": {},
+        }
+        orderings = args.orderings.split(",") if args.orderings else [None]
+        for name, n_files in sizes.items():
+            for ordering in orderings:
+                key = name if ordering is None else f"{name}:{ordering}"
+                run_options = dict(options)
+                if ordering is not None:
+                    run_options["payload_order"] = ordering
+                print(f"Benchmarking {key} ({n_files} files)")
+                result = run_size(name, n_files, args.repeat, run_options, args.seed)
+                results["results"][key] = result
+                for stage, value in sorted(result["timings"].items()):
+                    print(f"    {stage:32s} {value:9.3f}s")
+        if args.orderings:
+            print_orderings(results["results"], sizes, orderings)
+    finally:
+        shutil.rmtree(bin_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("format") != RESULTS_FORMAT:
+            print(f"Unsupported baseline format: {baseline.get('format')}")
+            return 2
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print(f"{len(regressions)} timings regressed")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+""" Size and load time of the prefix records, as a list in conda-pack's unpack script and as the
+records file of condansis-unpack.py
+
+The list is what conda-pack writes in its unpack script: a tuple per file, repeating the
+placeholder. Loading it means compiling and running the whole literal, as Python does when
+starting the script without a cached .pyc. The records file lists each placeholder once and is
+read line by line.
+
+Examples
+---------
+::
+
+    python benchmarks/bench_prefix_records.py --records 20000 --placeholders 2
+"""
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from condansis.prefix_records import unpack_engine, write_records_file  # noqa: E402
+
+PLACEHOLDER = "C:\\ci\\benchmark_1600000000000\\_h_env_placehold_placehold_placehold_placehold"
+
+
+def make_records(n_records: int, n_placeholders: int, seed: int) -> list:
+    """ Records with paths like the ones of a conda environment """
+    rng = random.Random(seed)
+    placeholders = [f"{PLACEHOLDER}{i}" for i in range(n_placeholders)]
+    packages = [f"package{i}" for i in range(n_records // 50 + 1)]
+    records = []
+    for i in range(n_records):
+        path = f"Lib\\site-packages\\{rng.choice(packages)}\\module{i}.py"
+        mode = "binary" if rng.random() < 0.2 else "text"
+        records.append((path, rng.choice(placeholders), mode))
+    return records
+
+
+def embedded_list(records: list) -> str:
+    """ The records as written in conda-pack's unpack script """
+    return "_prefix_records = [\n" + "".join(f"    {record!r},\n" for record in records) + "]\n"
+
+
+def best_time(function, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--records", type=int, default=20000, help="Number of records")
+    parser.add_argument("--placeholders", type=int, default=2, help="Distinct placeholders")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs, keeps the fastest")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    engine = unpack_engine()
+    records = make_records(args.records, args.placeholders, args.seed)
+    source = embedded_list(records)
+
+    def load_list():
+        namespace = {}
+        exec(compile(source, "condansis-unpack.py", "exec"), namespace)
+        return namespace["_prefix_records"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        records_file = Path(tmp_dir, "records.txt")
+        write_records_file(records_file, records)
+        assert load_list() == list(engine.load_records(str(records_file))) == records
+        timings = {
+            "list": best_time(load_list, args.repeat),
+            "records file": best_time(
+                lambda: list(engine.load_records(str(records_file))), args.repeat
+            ),
+        }
+        sizes = {"list": len(source.encode()), "records file": records_file.stat().st_size}
+
+    print(f"{len(records)} records, {args.placeholders} placeholders")
+    for name in ("list", "records file"):
+        print(f"{name:12s} {sizes[name] / 1024:9.1f} kB  {timings[name] * 1000:8.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+""" Micro-benchmark of the relocation plan of condansis-unpack.py against the per-file path
+
+The per-file path is update_prefix called for each record, as conda-pack's unpack script does,
+which encodes the placeholder and compiles the binary pattern for every file. The plan groups
+the records by placeholder and mode and prepares each matcher once. Both run on one thread,
+so that only the matching differs.
+
+Examples
+---------
+::
+
+    python benchmarks/bench_relocation.py --files 5000 --placeholders 3
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from condansis.prefix_records import unpack_engine  # noqa: E402
+
+PLACEHOLDER = "C:\\ci\\benchmark_1600000000000\\_h_env_placehold_placehold_placehold_placehold"
+
+
+def make_records(n_files: int, n_placeholders: int, binary_fraction: float, seed: int) -> list:
+    """ Random contents and records. Each file contains one of the placeholders
+
+    Returns
+    --------
+    files: list of (path, placeholder, mode, data)
+    """
+    rng = random.Random(seed)
+    placeholders = [f"{PLACEHOLDER}{i}" for i in range(n_placeholders)]
+    files = []
+    for i in range(n_files):
+        placeholder = rng.choice(placeholders)
+        size = int(rng.lognormvariate(8, 1))
+        if rng.random() < binary_fraction:
+            # a pyc-like file: the placeholder is in a path, padded with a null byte
+            filler = bytes(rng.getrandbits(8) | 1 for _ in range(size))
+            data = filler[: size // 2] + placeholder.encode() + b"\\lib\0" + filler[size // 2 :]
+            files.append((f"lib/file{i}.pyc", placeholder, "binary", data))
+        else:
+            words = b"import os\nprefix = '" + placeholder.encode() + b"\\lib'\n"
+            data = words * max(size // len(words), 1)
+            files.append((f"lib/file{i}.py", placeholder, "text", data))
+    return files
+
+
+def bench_memory(engine, files: list, new_prefix: str, repeat: int) -> dict:
+    """ Replacement of the file contents in memory, without I/O """
+    timings = {}
+    for name in ("per-file", "plan"):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if name == "per-file":
+                for _, placeholder, mode, data in files:
+                    engine.replace_prefix(data, mode, placeholder, new_prefix)
+            else:
+                records = [(path, placeholder, mode) for path, placeholder, mode, _ in files]
+                plan = engine.RelocationPlan(records, new_prefix)
+                for (_, _, matchers), (_, _, _, data) in zip(plan.files, files):
+                    for matcher in matchers:
+                        data = matcher.replace(data)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    return timings
+
+
+def bench_files(engine, files: list, repeat: int) -> dict:
+    """ Relocation of files on disk, rewritten before each run """
+    records = [(path, placeholder, mode) for path, placeholder, mode, _ in files]
+    with tempfile.TemporaryDirectory() as prefix:
+        for path, _, _, _ in files:
+            Path(prefix, path).parent.mkdir(parents=True, exist_ok=True)
+        names = ["per-file", "plan"]
+        timings = {name: float("inf") for name in names}
+        for i in range(repeat):
+            # alternate the order, so that writeback of the previous run slows both alike
+            for name in names[:: 1 if i % 2 == 0 else -1]:
+                for path, _, _, data in files:
+                    Path(prefix, path).write_bytes(data)
+                start = time.perf_counter()
+                if name == "per-file":
+                    for path, placeholder, mode in records:
+                        engine.update_prefix(os.path.join(prefix, path), prefix, placeholder, mode)
+                else:
+                    assert engine.relocate(records, prefix, workers=1) == []
+                timings[name] = min(timings[name], time.perf_counter() - start)
+    return timings
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--files", type=int, default=5000, help="Number of records")
+    parser.add_argument("--placeholders", type=int, default=2, help="Distinct placeholders")
+    parser.add_argument(
+        "--binary-fraction", type=float, default=0.5, help="Fraction of binary records"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs, keeps the fastest")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    engine = unpack_engine()
+    files = make_records(args.files, args.placeholders, args.binary_fraction, args.seed)
+    total_bytes = sum(len(f[3]) for f in files)
+    print(f"{len(files)} records, {total_bytes / 1024 ** 2:.1f} MB, on_win={engine.on_win}")
+    new_prefix = "/opt/installed/env" if not engine.on_win else "C:\\Users\\user\\app\\env"
+    for title, timings in [
+        ("in memory", bench_memory(engine, files, new_prefix, args.repeat)),
+        ("files", bench_files(engine, files, args.repeat)),
+    ]:
+        speedup = timings["per-file"] / max(timings["plan"], 1e-9)
+        print(
+            f"{title:10s} per-file {timings['per-file']:8.3f}s  plan {timings['plan']:8.3f}s  "
+            f"{speedup:5.2f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
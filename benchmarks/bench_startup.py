@@ -0,0 +1,130 @@
+""" Startup time of Python with the sitecustomize.py of condansis, and growth of PATH
+
+Runs ``python -c pass`` with no hook, with the previous hook, which prepended the Library
+directories to PATH at every start, and with the current one, which imports the module listing
+the directories that condansis-unpack.py writes when installing. The runs of the three variants
+are interleaved, and the median is reported, along with the time spent importing the hook, from
+-X importtime, which is less noisy than the time of the whole process. Then a chain of interpreters, each started by the
+previous one, shows how PATH grows.
+
+Without a hook, the sitecustomize module of the interpreter is imported, if it has one.
+os.add_dll_directory only exists on Windows, so elsewhere the current hook only updates PATH.
+
+Examples
+---------
+::
+
+    python benchmarks/bench_startup.py --runs 50 --depth 5
+"""
+from typing import Optional
+import os
+import sys
+import time
+import shutil
+import argparse
+import compileall
+import statistics
+import tempfile
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from condansis.installer import SITECUSTOMIZE  # noqa: E402
+from condansis.prefix_records import unpack_engine  # noqa: E402
+
+# sitecustomize.py of condansis 0.4
+PATH_HOOK = """import os
+
+prefix = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+os.environ["PATH"] = os.pathsep.join([
+    os.path.join(prefix, 'Library', 'mingw-w64'),
+    os.path.join(prefix, 'Library', 'usr', 'bin'),
+    os.path.join(prefix, 'Library', 'bin')
+]) + os.pathsep + os.environ["PATH"]
+"""
+
+# starts the next interpreter of the chain, the last one prints the number of PATH entries
+CHAIN = """import os, sys, subprocess
+depth = int(sys.argv[1])
+if depth > 1:
+    subprocess.run([sys.executable, "-c", sys.argv[2], str(depth - 1), sys.argv[2]], check=True)
+else:
+    print(len(os.environ["PATH"].split(os.pathsep)))
+"""
+
+
+def make_env(root: Path, hook: Optional[str]) -> Path:
+    """ An environment prefix with the Library directories, returns its site-packages """
+    site_packages = root / "Lib" / "site-packages"
+    site_packages.mkdir(parents=True)
+    for parts in [("mingw-w64",), ("usr", "bin"), ("bin",)]:
+        root.joinpath("Library", *parts).mkdir(parents=True)
+    if hook == "path":
+        (site_packages / "sitecustomize.py").write_text(PATH_HOOK)
+    elif hook == "current":
+        shutil.copy(SITECUSTOMIZE, site_packages)
+        unpack_engine().write_dll_directories(str(root))
+    # as in an installed environment, the hook is not compiled at each start
+    compileall.compile_dir(str(site_packages), quiet=1)
+    return site_packages
+
+
+def hook_import_time(env: dict) -> int:
+    """ Microseconds spent importing sitecustomize, as reported by -X importtime """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "pass"],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.split(":", 1)[-1].split("|")]
+        if len(fields) == 3 and fields[2] == "sitecustomize":
+            return int(fields[1])
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=30, help="Runs of each variant")
+    parser.add_argument("--depth", type=int, default=5, help="Length of the interpreter chain")
+    args = parser.parse_args(argv)
+
+    variants = {"no hook": None, "PATH hook": "path", "current": "current"}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        envs = {}
+        for i, (name, hook) in enumerate(variants.items()):
+            site_packages = make_env(Path(tmp_dir, f"env{i}"), hook)
+            envs[name] = dict(os.environ, PYTHONPATH=str(site_packages))
+
+        timings = {name: [] for name in variants}
+        import_times = {name: [] for name in variants}
+        for _ in range(args.runs):
+            for name, env in envs.items():
+                start = time.perf_counter()
+                subprocess.run([sys.executable, "-c", "pass"], env=env, check=True)
+                timings[name].append(time.perf_counter() - start)
+                import_times[name].append(hook_import_time(env))
+
+        base_entries = len(os.environ["PATH"].split(os.pathsep))
+        print(f"python -c pass, median of {args.runs} runs. PATH entries after {args.depth} starts")
+        for name, env in envs.items():
+            output = subprocess.check_output(
+                [sys.executable, "-c", CHAIN, str(args.depth), CHAIN], env=env, text=True
+            )
+            entries = int(output)
+            print(
+                f"{name:10s} {statistics.median(timings[name]) * 1000:7.1f} ms  "
+                f"hook {statistics.median(import_times[name]):6.0f} us  "
+                f"{entries:4d} PATH entries (+{entries - base_entries})"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
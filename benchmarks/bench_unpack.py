@@ -0,0 +1,244 @@
+""" Throughput of condansis-unpack.py relocating a synthetic environment
+
+The environment has a mix of text files, binary files with the placeholder in null-terminated
+strings, and distlib launchers, with a records file matching them. The unpack script then runs
+in a child process, as the installer runs it, once with the POSIX rules and once with the
+Windows rules (on_win forced to True). Each run starts from freshly written files.
+
+Reported are the files and MB relocated per second, timed around main() of the script, and the
+peak resident memory of the child process (Linux and macOS only). With --profile, the runs are
+profiled with cProfile, so that the time spent in each function of the script can be compared
+between revisions.
+
+Examples
+---------
+::
+
+    python benchmarks/bench_unpack.py --files 20000 --binary-fraction 0.3
+    python benchmarks/bench_unpack.py --large-files 4 --large-size 64 --profile prof
+    python -m pstats prof/unpack-win.prof
+"""
+from typing import List, Optional, Tuple
+import io
+import os
+import sys
+import json
+import random
+import shutil
+import zipfile
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from condansis.prefix_records import (  # noqa: E402
+    RECORDS_FILE_NAME,
+    UNPACK_SCRIPT,
+    write_records_file,
+)
+
+PLACEHOLDER = "C:\\ci\\benchmark_1600000000000\\_h_env_placehold_placehold_placehold_placehold"
+
+# Runs the unpack script in the child process, and prints the measures as JSON
+DRIVER = """
+import sys, time, json, importlib.util
+script, on_win, profile = sys.argv[1], sys.argv[2] == "1", sys.argv[3]
+spec = importlib.util.spec_from_file_location("condansis_unpack", script)
+engine = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(engine)
+engine.on_win = on_win
+start = time.perf_counter()
+if profile:
+    import cProfile
+    profiler = cProfile.Profile()
+    code = profiler.runcall(engine.main, sys.argv[4:])
+    profiler.dump_stats(profile)
+else:
+    code = engine.main(sys.argv[4:])
+duration = time.perf_counter() - start
+rss = None
+try:
+    # peak of this process image. ru_maxrss on Linux also counts the parent before exec
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                rss = int(line.split()[1]) * 1024
+except OSError:
+    try:
+        import resource
+        # bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+print(json.dumps({"code": code, "duration": duration, "rss": rss}))
+"""
+
+
+def _launcher(placeholder: str, rng: random.Random, size: int) -> bytes:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as f:
+        f.writestr("__main__.py", "import sys\nsys.exit(0)\n")
+    launcher = b"MZ" + bytes(rng.getrandbits(8) for _ in range(size))
+    return launcher + f"#!{placeholder}\\python.exe\r\n".encode() + archive.getvalue()
+
+
+def make_files(
+    n_files: int,
+    binary_fraction: float,
+    launcher_fraction: float,
+    mean_size: int,
+    occurrences: int,
+    n_placeholders: int,
+    large_files: int,
+    large_size: int,
+    seed: int,
+) -> List[Tuple[str, str, str, bytes]]:
+    """ Random files and their records
+
+    Returns
+    --------
+    files: list of (path, placeholder, mode, data)
+    """
+    rng = random.Random(seed)
+    placeholders = [f"{PLACEHOLDER}{i}" for i in range(n_placeholders)]
+    # random bytes are slow to draw, so the binary files are cut from one block
+    block = bytes(rng.getrandbits(8) | 1 for _ in range(1024 * 1024))
+    files = []
+    for i in range(n_files + large_files):
+        placeholder = rng.choice(placeholders)
+        if i < n_files:
+            size = max(int(rng.lognormvariate(0, 1) * mean_size), 64)
+        else:
+            size = large_size
+        draw = rng.random()
+        if draw < launcher_fraction:
+            data = _launcher(placeholder, rng, 1024)
+            files.append((f"Scripts/tool{i}.exe", placeholder, "binary", data))
+        elif draw < launcher_fraction + binary_fraction:
+            string = placeholder.encode() + b"\\lib\0"
+            piece = size // occurrences
+            parts = []
+            for _ in range(occurrences):
+                start = rng.randrange(len(block) - piece) if piece < len(block) else 0
+                parts.append((block[start : start + piece] * (piece // len(block) + 1))[:piece])
+                parts.append(string)
+            files.append((f"Library/bin/lib{i}.dll", placeholder, "binary", b"".join(parts)))
+        else:
+            line = f"prefix = r'{placeholder}\\lib'\n".encode()
+            filler = b"# a line of a module, without the prefix\n"
+            filler = filler * max((size // occurrences - len(line)) // len(filler), 0)
+            data = (line + filler) * occurrences
+            path = f"Lib/site-packages/pkg{i % 100}/module{i}.py"
+            files.append((path, placeholder, "text", data))
+    return files
+
+
+def write_env(env_dir: Path, files: list) -> None:
+    for path, _, _, data in files:
+        (env_dir / path).write_bytes(data)
+
+
+def run_unpack(
+    env_dir: Path, on_win: bool, workers: Optional[int], profile: Optional[Path]
+) -> dict:
+    script = env_dir / "Scripts" / "condansis-unpack.py"
+    args = [sys.executable, "-c", DRIVER, str(script), "1" if on_win else "0"]
+    args.append("" if profile is None else str(profile))
+    if workers is not None:
+        args += ["--workers", str(workers)]
+    output = subprocess.run(args, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    if result["code"] != 0:
+        raise RuntimeError(f"The unpack script failed with on_win={on_win}")
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--files", type=int, default=5000, help="Number of files")
+    parser.add_argument(
+        "--binary-fraction", type=float, default=0.3, help="Fraction of binary files"
+    )
+    parser.add_argument(
+        "--launcher-fraction", type=float, default=0.02, help="Fraction of distlib launchers"
+    )
+    parser.add_argument("--mean-size", type=int, default=16384, help="Median file size in bytes")
+    parser.add_argument(
+        "--occurrences", type=int, default=1, help="Placeholders in each text or binary file"
+    )
+    parser.add_argument("--placeholders", type=int, default=2, help="Distinct placeholders")
+    parser.add_argument("--large-files", type=int, default=0, help="Additional large files")
+    parser.add_argument("--large-size", type=int, default=64, help="Size of large files in MB")
+    parser.add_argument("--workers", type=int, default=None, help="--workers of the script")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs, keeps the fastest")
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help="Directory to save cProfile stats of the fastest runs. cProfile only sees the main\n"
+        "thread, so the script then runs with --workers 1",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    files = make_files(
+        args.files,
+        args.binary_fraction,
+        args.launcher_fraction,
+        args.mean_size,
+        args.occurrences,
+        args.placeholders,
+        args.large_files,
+        args.large_size * 1024 ** 2,
+        args.seed,
+    )
+    total_bytes = sum(len(f[3]) for f in files)
+    records = [(path, placeholder, mode) for path, placeholder, mode, _ in files]
+    print(
+        f"{len(files)} files, {total_bytes / 1024 ** 2:.1f} MB, "
+        f"{sum(r[2] == 'binary' for r in records)} binary"
+    )
+    profile_dir = None if args.profile is None else Path(args.profile)
+    if profile_dir is not None:
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        args.workers = 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env_dir = Path(tmp_dir, "env")
+        for path in {Path(record[0]).parent for record in records}:
+            (env_dir / path).mkdir(parents=True, exist_ok=True)
+        (env_dir / "Scripts").mkdir(exist_ok=True)
+        script = env_dir / "Scripts" / "condansis-unpack.py"
+        shutil.copyfile(UNPACK_SCRIPT, script)
+        write_records_file(env_dir / "Scripts" / RECORDS_FILE_NAME, records)
+
+        for on_win, name in [(False, "posix"), (True, "win")]:
+            best = None
+            for _ in range(args.repeat):
+                write_env(env_dir, files)
+                profile = None
+                if profile_dir is not None:
+                    profile = profile_dir / f"unpack-{name}.prof.tmp"
+                result = run_unpack(env_dir, on_win, args.workers, profile)
+                if best is None or result["duration"] < best["duration"]:
+                    best = result
+                    if profile is not None:
+                        os.replace(profile, profile_dir / f"unpack-{name}.prof")
+            duration = max(best["duration"], 1e-9)
+            rss = "n/a" if best["rss"] is None else f"{best['rss'] / 1024 ** 2:.0f} MB"
+            print(
+                f"{name:6s} {duration:7.3f} s  {len(files) / duration:9.0f} files/s  "
+                f"{total_bytes / 1024 ** 2 / duration:8.1f} MB/s  peak RSS {rss}"
+            )
+    if profile_dir is not None:
+        for path in profile_dir.glob("*.prof.tmp"):
+            path.unlink()
+        print(f"cProfile stats saved to {profile_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
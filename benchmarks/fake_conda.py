@@ -0,0 +1,54 @@
+""" Stand-in for the conda executable, creating synthetic environments without network access
+
+Supports the commands run by condansis:
+
+    conda env create -p PREFIX -f ENV_FILE --force
+    conda create -p PREFIX --file ENV_FILE
+    conda env remove -y -p PREFIX
+
+The environment file must contain a line "# condansis-benchmark: {json}" with the arguments
+of :func:`synthetic_env.generate`
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_env  # noqa: E402
+
+SPEC_MARKER = "# condansis-benchmark:"
+
+
+def read_spec(env_file):
+    with open(env_file) as f:
+        for line in f:
+            if line.startswith(SPEC_MARKER):
+                return json.loads(line[len(SPEC_MARKER):])
+    raise ValueError(f"{env_file} has no '{SPEC_MARKER}' line")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="conda")
+    parser.add_argument("command", nargs="+")
+    parser.add_argument("-p", "--prefix", required=True)
+    parser.add_argument("-f", "--file", dest="env_file")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("-y", "--yes", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command in (["env", "create"], ["create"]):
+        if os.path.exists(args.prefix):
+            shutil.rmtree(args.prefix)
+        stats = synthetic_env.generate(args.prefix, **read_spec(args.env_file))
+        print(f"Created synthetic environment at {args.prefix}: {stats}")
+    elif args.command == ["env", "remove"]:
+        shutil.rmtree(args.prefix, ignore_errors=True)
+        shutil.rmtree(os.path.join(os.path.dirname(args.prefix), "pkgs"), ignore_errors=True)
+    else:
+        parser.error(f"Unsupported command: {' '.join(args.command)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
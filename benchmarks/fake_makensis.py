@@ -0,0 +1,84 @@
+""" Stand-in for makensis: compresses the files the script adds into the output file
+
+Files are read in the order of the File commands, honouring SetCompress off and /SOLID.
+Compression uses zlib at a low level, so the cost scales with the size of the payload like
+makensis does, without needing NSIS installed. With CONDANSIS_BENCH_FAITHFUL=1 the compressor
+named in the script is used instead, which is slower but compares payload layouts fairly
+"""
+import os
+import re
+import bz2
+import sys
+import zlib
+import lzma
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _Stored:
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+def _compressor(name, faithful):
+    if not faithful:
+        return zlib.compressobj(1)
+    if name == "zlib":
+        return zlib.compressobj(9)
+    if name == "bzip2":
+        return bz2.BZ2Compressor(9)
+    return lzma.LZMACompressor(format=lzma.FORMAT_RAW, filters=[{"id": lzma.FILTER_LZMA2}])
+
+
+def _payload(script, work_dir):
+    # Yields (file, compress) for each file added by the script, in order
+    compress = True
+    for line in script.splitlines():
+        line = line.strip()
+        if line.startswith("SetCompress "):
+            compress = line.split()[1] != "off"
+        match = re.match(r'File /r "(.*)\\\*\.\*"', line)
+        if match:
+            top = os.path.join(work_dir, match.group(1).replace("\\", os.sep))
+            for root, dir_names, file_names in os.walk(top):
+                dir_names.sort()
+                for name in sorted(file_names):
+                    yield os.path.join(root, name), compress
+            continue
+        match = re.match(r'File "(.*)"', line)
+        if match:
+            yield os.path.join(work_dir, match.group(1).replace("\\", os.sep)), compress
+
+
+def main(script_name):
+    with open(script_name) as f:
+        script = f.read()
+    installer_name = re.search(r'!define INSTALLER_NAME "(.*)"', script).group(1)
+    compressor_match = re.search(r'SetCompressor (/SOLID )?"(\w+)"', script)
+    solid = compressor_match.group(1) is not None
+    name = compressor_match.group(2)
+    faithful = os.environ.get("CONDANSIS_BENCH_FAITHFUL") == "1"
+    work_dir = os.path.dirname(os.path.abspath(script_name))
+
+    with open(installer_name, "wb") as out:
+        solid_compressor = _compressor(name, faithful)
+        for path, compress in _payload(script, work_dir):
+            if solid:
+                compressor = solid_compressor
+            elif compress:
+                compressor = _compressor(name, faithful)
+            else:
+                compressor = _Stored()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    out.write(compressor.compress(chunk))
+            if not solid:
+                out.write(compressor.flush())
+        out.write(solid_compressor.flush())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
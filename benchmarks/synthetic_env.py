@@ -0,0 +1,145 @@
+""" Generates synthetic conda environments for the benchmarks
+
+The environments mimic the layout of a Windows conda environment: packages in a package cache,
+hardlinked into the prefix, with conda-meta records that conda-pack can read. A fraction of the
+text files contains the prefix placeholder, so they end up in the prefix records.
+"""
+import os
+import json
+import math
+import random
+from pathlib import Path
+
+PLACEHOLDER = "C:\\ci\\benchmark_1600000000000\\_h_env_placehold_placehold_placehold_placehold"
+FILES_PER_PACKAGE = 50
+
+# extension, weight, binary, median size (bytes)
+FILE_KINDS = [
+    (".py", 40, False, 6 * 1024),
+    (".pyc", 20, True, 8 * 1024),
+    (".pyd", 4, True, 200 * 1024),
+    (".dll", 4, True, 400 * 1024),
+    (".json", 6, False, 2 * 1024),
+    (".txt", 6, False, 3 * 1024),
+    (".h", 5, False, 10 * 1024),
+    (".dat", 15, True, 16 * 1024),
+]
+MAX_FILE_SIZE = 64 * 1024 ** 2
+
+WORDS = (
+    "import def return class self None True False for in if else elif while with as "
+    "try except raise from lambda yield assert pass break continue global numpy data "
+    "array value index result path file prefix environment package module install"
+).split()
+
+
+def _text(rng: random.Random, size: int) -> bytes:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+        if rng.random() < 0.1:
+            words.append("\n")
+    return " ".join(words).encode()[:size]
+
+
+def _binary(rng: random.Random, size: int) -> bytes:
+    # half random, half repetitive, so it compresses like real binaries
+    n_random = size // 2
+    random_part = rng.getrandbits(8 * n_random).to_bytes(n_random, "little") if n_random else b""
+    return random_part + bytes(size - n_random)
+
+
+def generate(prefix, n_files: int, seed: int = 0, prefix_fraction: float = 0.05) -> dict:
+    """ Creates a synthetic environment at prefix, with its package cache next to it
+
+    Parameters
+    -----------
+    prefix: str or Path
+        Directory of the environment
+
+    n_files: int
+        Number of files in the environment
+
+    seed: int
+        Seed of the random generator. The same seed creates the same environment
+
+    prefix_fraction: float
+        Fraction of the text files containing the prefix placeholder
+
+    Returns
+    --------
+    stats: dict
+        Number of files, bytes and prefix records in the environment
+    """
+    rng = random.Random(seed)
+    prefix = Path(prefix)
+    pkgs_dir = prefix.parent / "pkgs"
+    (prefix / "conda-meta").mkdir(parents=True)
+    (prefix / "Lib" / "site-packages").mkdir(parents=True)
+    (prefix / "Scripts").mkdir()
+    weights = [kind[1] for kind in FILE_KINDS]
+
+    stats = {"files": 0, "bytes": 0, "prefix_records": 0}
+    files_left = n_files
+    index = 0
+    while files_left > 0:
+        # python needs to be installed for conda-pack to find site-packages
+        name, version = ("python", "3.10.0") if index == 0 else (f"package{index}", "1.0")
+        n_package_files = min(files_left, FILES_PER_PACKAGE if index else 5)
+        files_left -= n_package_files
+        index += 1
+        pkg = pkgs_dir / f"{name}-{version}-0"
+        paths = []
+        for i in range(n_package_files):
+            extension, _, binary, median = rng.choices(FILE_KINDS, weights)[0]
+            size = min(int(rng.lognormvariate(math.log(median), 1.0)), MAX_FILE_SIZE)
+            if extension in (".dll", ".pyd"):
+                directory = "Library/bin" if extension == ".dll" else f"Lib/site-packages/{name}"
+            elif extension == ".py" and i == 0:
+                directory = "Scripts"
+            elif extension == ".h":
+                directory = f"Library/include/{name}"
+            else:
+                directory = f"Lib/site-packages/{name}/sub{i % 5}"
+            path = f"{directory}/{name}_{i}{extension}"
+            record = {"_path": path, "path_type": "hardlink", "size_in_bytes": size}
+
+            data = _binary(rng, size) if binary else _text(rng, size)
+            has_prefix = not binary and rng.random() < prefix_fraction
+            if has_prefix:
+                data = PLACEHOLDER.encode() + b"\n" + data
+                record.update(prefix_placeholder=PLACEHOLDER, file_mode="text")
+                stats["prefix_records"] += 1
+            paths.append(record)
+
+            (pkg / directory).mkdir(parents=True, exist_ok=True)
+            (pkg / path).write_bytes(data)
+            (prefix / directory).mkdir(parents=True, exist_ok=True)
+            if has_prefix:
+                # conda writes the relocated file in the prefix
+                relocated = data.replace(PLACEHOLDER.encode(), str(prefix).encode())
+                (prefix / path).write_bytes(relocated)
+            else:
+                os.link(pkg / path, prefix / path)
+            stats["files"] += 1
+            stats["bytes"] += len(data)
+
+        (pkg / "info").mkdir(parents=True, exist_ok=True)
+        with open(pkg / "info" / "paths.json", "w") as f:
+            json.dump({"paths": paths, "paths_version": 1}, f)
+        with open(prefix / "conda-meta" / f"{name}-{version}-0.json", "w") as f:
+            json.dump(
+                {
+                    "name": name,
+                    "version": version,
+                    "build": "0",
+                    "url": f"https://example.invalid/{name}-{version}-0.tar.bz2",
+                    "link": {"source": str(pkg), "type": 1},
+                    "files": [p["_path"] for p in paths],
+                },
+                f,
+            )
+    return stats
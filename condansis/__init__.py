@@ -1,3 +1,6 @@
 import os
 from ._version import __version__
-from .installer import Installer
\ No newline at end of file
+from .installer import Installer
+from .env_cache import EnvCache
+from .batch import InstallerBatch
+from .tracing import BuildTrace
\ No newline at end of file
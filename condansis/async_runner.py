@@ -0,0 +1,209 @@
+""" Runs the subprocesses of a build on an asyncio event loop, streaming their output """
+from typing import Callable, IO, List, Optional, Set, Union
+from pathlib import Path
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+import threading
+import subprocess
+from dataclasses import dataclass, asdict
+
+from .scheduler import current_stage
+
+
+@dataclass
+class LogEvent:
+    """ A line of output of a subprocess, or a change in its status
+
+    Parameters
+    ------------
+    time: float
+        Time of the event, in seconds since the epoch
+
+    installer: str
+        Name of the package the installer is for
+
+    stage: str or None
+        Build stage running the subprocess
+
+    command: str
+        Name of the executable
+
+    stream: "stdout", "stderr" or "status"
+        Where the line comes from. Status lines tell when the process starts and exits
+
+    line: str
+        The line, without the line break
+    """
+
+    time: float
+    installer: str
+    stage: Optional[str]
+    command: str
+    stream: str
+    line: str
+
+
+LogSink = Callable[[LogEvent], None]
+
+
+def logging_sink(event: LogEvent) -> None:
+    """ Sends the events to the logging module """
+    logging.info(f"[{event.installer}:{event.stage or event.command}] {event.line}")
+
+
+class JsonLinesSink:
+    """ Writes the events to a file, one JSON object per line
+
+    Parameters
+    ------------
+    file: str, Path or file object
+        File to write to. Files given by name are opened for appending
+    """
+
+    def __init__(self, file: Union[str, Path, IO[str]]) -> None:
+        if isinstance(file, (str, Path)):
+            self._file = open(file, "a")
+            self._owned = True
+        else:
+            self._file = file
+            self._owned = False
+        self._lock = threading.Lock()
+
+    def __call__(self, event: LogEvent) -> None:
+        with self._lock:
+            self._file.write(json.dumps(asdict(event)) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._owned:
+            self._file.close()
+
+
+def kill_process_tree(pid: int) -> None:
+    """ Kills a process and all its children
+
+    In POSIX the process must lead its own process group, see
+    :code:`start_new_session` in :class:`subprocess.Popen`
+    """
+    if sys.platform == "win32":
+        subprocess.run(
+            ["taskkill", "/F", "/T", "/PID", str(pid)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    else:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class AsyncRunner:
+    """ Runs subprocesses on an event loop, on behalf of build stages running in other threads
+
+    Parameters
+    ------------
+    loop: asyncio.AbstractEventLoop
+        Running event loop
+
+    sink: callable (optional)
+        Called with a :class:`LogEvent` for each line of output. Default: :func:`logging_sink`
+
+    installer: str (optional)
+        Name of the installer, added to the events. Default: ""
+    """
+
+    def __init__(
+        self, loop: asyncio.AbstractEventLoop, sink: LogSink = None, installer: str = ""
+    ) -> None:
+        self.loop = loop
+        self.sink = sink or logging_sink
+        self.installer = installer
+        self.cancelled = False
+        self._processes: Set[asyncio.subprocess.Process] = set()
+        self._lock = threading.Lock()
+
+    def _emit(self, stage: Optional[str], command: str, stream: str, line: str) -> None:
+        self.sink(LogEvent(time.time(), self.installer, stage, command, stream, line))
+
+    async def _read(self, stream, stage, command, name) -> None:
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            self._emit(stage, command, name, line.decode(errors="replace").rstrip("\r\n"))
+
+    async def run_async(self, args: List[str], stage: str = None) -> None:
+        """ Runs a subprocess, streaming its output to the sink
+
+        Raises
+        -------
+        subprocess.CalledProcessError
+            If the process exits with an error
+        """
+        command = os.path.basename(args[0])
+        kwargs = {}
+        if sys.platform == "win32":
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            # so that the whole process tree can be killed
+            kwargs["start_new_session"] = True
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **kwargs
+        )
+        with self._lock:
+            self._processes.add(process)
+        if self.cancelled:
+            # cancel ran while the process was starting, and could not see it
+            kill_process_tree(process.pid)
+        try:
+            self._emit(stage, command, "status", f"started: {subprocess.list2cmdline(args)}")
+            await asyncio.gather(
+                self._read(process.stdout, stage, command, "stdout"),
+                self._read(process.stderr, stage, command, "stderr"),
+            )
+            returncode = await process.wait()
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        self._emit(stage, command, "status", f"exited with code {returncode}")
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args)
+
+    def run(self, args: List[Union[str, Path]]) -> None:
+        """ Runs a subprocess on the event loop and waits for it. Called from build stages
+
+        Raises
+        -------
+        subprocess.CalledProcessError
+            If the process exits with an error
+
+        asyncio.CancelledError
+            If the build was cancelled
+        """
+        if self.cancelled:
+            raise asyncio.CancelledError()
+        args = [str(arg) for arg in args]
+        future = asyncio.run_coroutine_threadsafe(
+            self.run_async(args, current_stage.get()), self.loop
+        )
+        try:
+            future.result()
+        except subprocess.CalledProcessError:
+            if self.cancelled:
+                raise asyncio.CancelledError()
+            raise
+
+    def cancel(self) -> None:
+        """ Kills the process trees of the running subprocesses, and stops new ones from starting """
+        self.cancelled = True
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            if process.returncode is None:
+                kill_process_tree(process.pid)
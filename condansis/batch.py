@@ -0,0 +1,222 @@
+""" Builds many installers, sharing the environments between them """
+from typing import Dict, List, Optional, Sequence, Tuple
+from pathlib import Path
+import os
+import time
+import tempfile
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from .env_cache import package_digest
+from .installer import Installer
+from .scheduler import StageScheduler
+
+
+@dataclass
+class BatchResult:
+    """ Outcome of building one installer in a batch
+
+    Parameters
+    ------------
+    installer: Installer
+        The installer
+
+    env_time: float
+        Wall time to build the environment, shared by all installers with the same environment
+
+    stage_times: dict
+        Wall time of each stage building the installer from the environment
+
+    total_time: float
+        Wall time from the start of the batch until the installer finished
+
+    error: Exception or None
+        Error raised while building the installer
+    """
+
+    installer: Installer
+    env_time: float = 0.0
+    stage_times: Dict[str, float] = field(default_factory=dict)
+    total_time: float = 0.0
+    error: Optional[BaseException] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+class InstallerBatch:
+    """ Builds many installers
+
+    Installers are grouped by packed environment (see :meth:`Installer.pack_key`).
+    Each distinct environment is created and packed once, and the installers using it
+    are staged and compiled by makensis concurrently
+
+    Parameters
+    ------------
+    installers: list of Installer (optional)
+        Installers to build
+
+    max_workers: int (optional)
+        Maximum number of installers being staged or compiled at the same time.
+        Default: the number of CPUs
+    """
+
+    def __init__(self, installers: Sequence[Installer] = (), max_workers: int = None) -> None:
+        self.installers: List[Installer] = list(installers)
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def add(self, installer: Installer) -> None:
+        """ Adds an installer to the batch """
+        self.installers.append(installer)
+
+    def groups(self) -> Dict[str, List[Installer]]:
+        """ Installers grouped by packed environment
+
+        Returns
+        --------
+        groups: dict
+            Installers sharing each packed environment, keyed on :meth:`Installer.pack_key`
+        """
+        return {key: installers for key, (_, installers) in self._groups().items()}
+
+    def _groups(self) -> Dict[str, Tuple[str, List[Installer]]]:
+        # The root packages are hashed once each, leaving out the outputs of the whole batch,
+        # so that the installer of one variant does not change the key of another
+        outputs = [path for installer in self.installers for path in installer.build_outputs()]
+        digests: Dict[Path, str] = {}
+        groups: Dict[str, Tuple[str, List[Installer]]] = {}
+        for installer in self.installers:
+            root_digest = None
+            if installer.install_root_package:
+                root = installer.package_root
+                if root not in digests:
+                    digests[root] = package_digest(root, outputs)
+                root_digest = digests[root]
+            env_key = installer.env_cache_key(root_digest)
+            key = installer.pack_key(env_key)
+            groups.setdefault(key, (env_key, []))[1].append(installer)
+        return groups
+
+    def create(self) -> List[BatchResult]:
+        """ Creates all installers
+
+        An installer failing does not stop the others from being built. Temporary directories
+        are all removed when this returns
+
+        Returns
+        --------
+        results: list of BatchResult
+            Result of each installer, in the order they were added
+        """
+        from .teardown import wait_for_removals
+
+        start = time.perf_counter()
+        results = {id(installer): BatchResult(installer) for installer in self.installers}
+        with tempfile.TemporaryDirectory() as batch_dir, ThreadPoolExecutor(
+            self.max_workers
+        ) as executor:
+            futures = []
+            # Environments are built one after another, as concurrent conda
+            # processes compete for the package cache
+            for i, (key, (env_key, installers)) in enumerate(self._groups().items()):
+                logging.info(f"Building environment {key[:12]} for {len(installers)} installers")
+                env_start = time.perf_counter()
+                try:
+                    packed_env = self._build_env(installers[0], Path(batch_dir, str(i)), env_key)
+                except Exception as e:
+                    logging.error(f"Could not build environment {key[:12]}: {e}")
+                    for installer in installers:
+                        results[id(installer)].error = e
+                    continue
+                env_time = time.perf_counter() - env_start
+                for installer in installers:
+                    result = results[id(installer)]
+                    result.env_time = env_time
+                    futures.append(
+                        executor.submit(self._build_installer, result, packed_env, start)
+                    )
+            for future in futures:
+                future.result()
+        wait_for_removals()
+        return [results[id(installer)] for installer in self.installers]
+
+    @staticmethod
+    def _build_env(installer: Installer, group_dir: Path, env_key: str) -> Path:
+        from .teardown import discard
+
+        env_dir = group_dir / "prefix"
+        env_dir.mkdir(parents=True)
+        try:
+            if installer.env_cache is None:
+                env_prefix = env_dir / installer.env_name
+                installer.create_temp_env(env_prefix)
+            else:
+                env_prefix = installer.create_cached_env(env_key)
+            installer.pack_temp_env(group_dir, env_prefix, remove_env=False)
+        finally:
+            discard(env_dir)
+        return group_dir / installer.env_name
+
+    @staticmethod
+    def _build_installer(result: BatchResult, packed_env: Path, start: float) -> None:
+        installer = result.installer
+        try:
+            with installer._work_dir() as work_dir:
+                staging = installer._staging(work_dir)
+
+                def stage_env():
+                    if staging is None:
+                        from .copier import CopyEngine
+
+                        engine = CopyEngine(installer.copy_methods)
+                        engine.copy_tree(packed_env, work_dir / installer.env_name)
+                    else:
+                        staging.sync_tree(packed_env, installer.env_name)
+
+                scheduler = StageScheduler(installer.max_workers)
+                scheduler.add("pack", stage_env)
+                installer._add_payload_stages(scheduler, work_dir, staging, after=["pack"])
+                try:
+                    installer._run_stages(scheduler, staging)
+                finally:
+                    result.stage_times = dict(scheduler.durations)
+            logging.info(f"Installer created at {installer.installer_name}")
+        except Exception as e:
+            logging.error(f"Could not create {installer.installer_name}: {e}")
+            result.error = e
+        result.total_time = time.perf_counter() - start
+
+    @staticmethod
+    def format_results(results: Sequence[BatchResult]) -> str:
+        """ Formats the results of a batch as a table
+
+        Parameters
+        -----------
+        results: list of BatchResult
+            Results of :meth:`InstallerBatch.create`
+
+        Returns
+        --------
+        table: str
+            One row per installer, with the status and the wall times in seconds
+        """
+        header = ("installer", "status", "env", "staging", "makensis", "total")
+        rows = [header]
+        for result in results:
+            makensis_time = result.stage_times.get("nsis", 0.0)
+            staging_time = sum(result.stage_times.values()) - makensis_time
+            rows.append(
+                (
+                    os.path.basename(result.installer.installer_name),
+                    "ok" if result.succeeded else f"failed: {type(result.error).__name__}",
+                    f"{result.env_time:.1f}",
+                    f"{staging_time:.1f}",
+                    f"{makensis_time:.1f}",
+                    f"{result.total_time:.1f}",
+                )
+            )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = ["  ".join(cell.ljust(w) for cell, w in zip(row, widths)) for row in rows]
+        return "\n".join(line.rstrip() for line in lines)
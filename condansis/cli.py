@@ -0,0 +1,230 @@
+r""" Command line interface, building installers from configuration files
+
+Examples
+---------
+Build an installer::
+
+    condansis build installer.toml
+
+Build several installers, creating each distinct environment once::
+
+    condansis build app.toml tools.toml --max-workers 4
+
+A configuration file holds the arguments of :class:`condansis.Installer`, and optionally a list
+of shortcuts with the arguments of :meth:`condansis.Installer.add_shortcut`. Relative paths
+are relative to the configuration file, which is also the default ``package_root``::
+
+    package_name = "snake-simulator"
+    package_version = "0.1"
+    include = ["snake.py"]
+    install_root_package = false
+
+    [[shortcuts]]
+    shortcut_name = '$INSTDIR\snake.lnk'
+    target_file = "$PYTHON"
+    parameters = '$INSTDIR\snake.py'
+
+JSON files with the same structure are accepted too. TOML files need Python 3.11, or tomli
+"""
+from typing import Any, Dict, Sequence, Union
+from pathlib import Path
+import sys
+import json
+import logging
+import argparse
+import subprocess
+
+# Arguments of Installer which are paths, resolved relative to the configuration file
+PATH_OPTIONS = (
+    "package_root",
+    "installer_name",
+    "icon",
+    "env_file",
+    "nsis_template",
+    "env_cache",
+    "staging_dir",
+)
+
+
+def load_config(file_name: Union[str, Path]) -> Dict[str, Any]:
+    """ Reads a configuration file, with relative paths resolved
+
+    Parameters
+    -----------
+    file_name: str or Path
+        JSON or TOML file
+
+    Returns
+    --------
+    config: dict
+        Arguments of :class:`condansis.Installer`, and "shortcuts"
+    """
+    file_name = Path(file_name)
+    if not file_name.is_file():
+        raise IOError(f"Could not find configuration file at {file_name}")
+    if file_name.suffix == ".json":
+        with open(file_name) as f:
+            config = json.load(f)
+    elif file_name.suffix == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("Reading TOML files needs Python 3.11 or the tomli package")
+        with open(file_name, "rb") as f:
+            config = tomllib.load(f)
+    else:
+        raise ValueError(f"Configuration files must be .json or .toml. Got: {file_name}")
+    if not isinstance(config, dict):
+        raise ValueError(f"The configuration in {file_name} must be a table of options")
+
+    base_dir = file_name.resolve().parent
+    config.setdefault("package_root", ".")
+    for option in PATH_OPTIONS:
+        if config.get(option) is not None:
+            config[option] = base_dir / config[option]
+    return config
+
+
+def installer_from_config(file_name: Union[str, Path], **overrides: Any):
+    """ Creates an installer from a configuration file
+
+    Parameters
+    -----------
+    file_name: str or Path
+        JSON or TOML file
+
+    **overrides:
+        Arguments of :class:`condansis.Installer` replacing the ones in the file
+
+    Returns
+    --------
+    installer: Installer
+        The installer, with the shortcuts added
+    """
+    from .installer import Installer
+
+    config = load_config(file_name)
+    config.update(overrides)
+    shortcuts = config.pop("shortcuts", [])
+    try:
+        installer = Installer(**config)
+        for shortcut in shortcuts:
+            installer.add_shortcut(**shortcut)
+    except TypeError as e:
+        raise ValueError(f"Invalid configuration in {file_name}: {e}")
+    return installer
+
+
+def _build(args: argparse.Namespace) -> int:
+    from .installer import configure_logging
+
+    configure_logging()
+    overrides = {}
+    if args.env_cache is not None:
+        overrides["env_cache"] = args.env_cache
+    trace = None
+    if args.trace is not None:
+        from .tracing import BuildTrace
+
+        trace = overrides["trace"] = BuildTrace()
+
+    if len(args.configs) == 1:
+        if args.max_workers is not None:
+            overrides["max_workers"] = args.max_workers
+        installer = installer_from_config(args.configs[0], **overrides)
+        try:
+            installer.create()
+            failed = False
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Could not create {installer.installer_name}: {e}")
+            failed = True
+    else:
+        from .batch import InstallerBatch
+
+        installers = [installer_from_config(config, **overrides) for config in args.configs]
+        results = InstallerBatch(installers, args.max_workers).create()
+        print(InstallerBatch.format_results(results))
+        failed = not all(result.succeeded for result in results)
+    if trace is not None:
+        trace.save_chrome_trace(args.trace)
+    from .teardown import wait_for_removals
+
+    # directories discarded in the background must be gone before the process exits
+    wait_for_removals()
+    return 1 if failed else 0
+
+
+def _cache(args: argparse.Namespace) -> int:
+    from .env_cache import EnvCache
+
+    cache = EnvCache(args.cache_dir)
+    if args.action == "list":
+        for entry in cache.entries():
+            print(f"{entry.key[:12]}  {entry.size / 1024 ** 2:10.1f} MB  {entry.prefix}")
+    else:
+        cache.purge(args.key)
+    return 0
+
+
+def _clean(args: argparse.Namespace) -> int:
+    from .teardown import clean_abandoned
+
+    for path in clean_abandoned(args.root, wait=True):
+        print(f"Removed {path}")
+    return 0
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="condansis", description="Creates installers for Python packages using NSIS and Conda"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="build installers from configuration files")
+    build.add_argument("configs", nargs="+", help="JSON or TOML configuration files")
+    build.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="maximum number of build stages, or installers, running at the same time",
+    )
+    build.add_argument("--env-cache", default=None, help="directory of the environment cache")
+    build.add_argument("--trace", default=None, help="save a Chrome trace of the build here")
+    build.set_defaults(func=_build)
+
+    cache = commands.add_parser("cache", help="inspect or empty the environment cache")
+    cache.add_argument("action", choices=["list", "purge"])
+    cache.add_argument("key", nargs="?", default=None, help="entry to purge. Default: all")
+    cache.add_argument("--cache-dir", default=None, help="directory of the environment cache")
+    cache.set_defaults(func=_cache)
+
+    clean = commands.add_parser(
+        "clean", help="remove temporary environments left by builds which crashed"
+    )
+    clean.add_argument("--root", default=None, help="directory to look in. Default: temp dir")
+    clean.set_defaults(func=_clean)
+    return parser
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """ Runs the command line interface
+
+    Parameters
+    -----------
+    argv: list of str (optional)
+        Arguments. Default: sys.argv[1:]
+
+    Returns
+    --------
+    exit_code: int
+        0 if the command succeeded
+    """
+    args = _parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (IOError, ValueError) as e:
+        print(f"condansis: error: {e}", file=sys.stderr)
+        return 2
@@ -0,0 +1,258 @@
+""" Compression settings of makensis, and a benchmark to choose between them """
+from typing import Iterable, List, Optional, Tuple, Union
+from pathlib import Path
+import os
+import bz2
+import time
+import zlib
+import lzma
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+COMPRESSORS = ("zlib", "bzip2", "lzma")
+GOALS = ("size", "build", "extract")
+# Bytes of the payload compressed with each candidate in the benchmark
+SAMPLE_SIZE = 16 * 1024 ** 2
+
+
+@dataclass(frozen=True)
+class CompressionSettings:
+    """ Compression settings of makensis
+
+    Parameters
+    ------------
+    compressor: 'zlib', 'bzip2', or 'lzma' (optional)
+        Compression algorithm. Default: lzma
+
+    solid: bool (optional)
+        Whether all files are compressed together as one block, which usually compresses better
+        and extracts faster, but cannot skip files. Default: False
+
+    dict_size: int (optional)
+        Dictionary size of lzma, in MB. Default: None (makensis's default, 8 MB)
+
+    datablock_optimize: bool (optional)
+        Whether makensis stores identical files only once. Default: True
+    """
+
+    compressor: str = "lzma"
+    solid: bool = False
+    dict_size: Optional[int] = None
+    datablock_optimize: bool = True
+
+    def __post_init__(self) -> None:
+        if self.compressor not in COMPRESSORS:
+            raise ValueError(
+                f"compressor must be 'zlib', 'bzip2' or 'lzma'. Got: {self.compressor}"
+            )
+        if self.dict_size is not None:
+            if self.compressor != "lzma":
+                raise ValueError("The dictionary size can only be set for lzma")
+            if self.dict_size < 1:
+                raise ValueError(f"dict_size must be at least 1 MB. Got: {self.dict_size}")
+
+    def __str__(self) -> str:
+        name = f"/SOLID {self.compressor}" if self.solid else self.compressor
+        if self.dict_size is not None:
+            name += f" {self.dict_size}MB"
+        return name
+
+    def compress(self, data: bytes) -> bytes:
+        """ Compresses data with the Python implementation of the algorithm """
+        if self.compressor == "zlib":
+            return zlib.compress(data, 9)
+        if self.compressor == "bzip2":
+            return bz2.compress(data, 9)
+        # a dictionary larger than the data compresses the same, but takes more memory
+        dict_size = min((self.dict_size or 8) * 1024 ** 2, max(len(data), 4096))
+        filters = [{"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": dict_size}]
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=filters)
+
+    def decompress(self, data: bytes) -> bytes:
+        """ Decompresses data compressed by :meth:`compress` """
+        if self.compressor == "zlib":
+            return zlib.decompress(data)
+        if self.compressor == "bzip2":
+            return bz2.decompress(data)
+        dict_size = (self.dict_size or 8) * 1024 ** 2
+        filters = [{"id": lzma.FILTER_LZMA2, "dict_size": dict_size}]
+        return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=filters)
+
+
+CANDIDATES = (
+    CompressionSettings("zlib"),
+    CompressionSettings("zlib", solid=True),
+    CompressionSettings("bzip2"),
+    CompressionSettings("bzip2", solid=True),
+    CompressionSettings("lzma"),
+    CompressionSettings("lzma", solid=True),
+    CompressionSettings("lzma", solid=True, dict_size=64),
+)
+
+
+@dataclass
+class CompressionResult:
+    """ Outcome of compressing the sample of the payload with some settings
+
+    Parameters
+    ------------
+    settings: CompressionSettings
+        The settings
+
+    sample_bytes: int
+        Size of the sample
+
+    compressed_bytes: int
+        Size of the compressed sample
+
+    compress_time: float
+        CPU time to compress the sample, in seconds
+
+    extract_time: float
+        CPU time to decompress the sample, in seconds
+    """
+
+    settings: CompressionSettings
+    sample_bytes: int
+    compressed_bytes: int
+    compress_time: float
+    extract_time: float
+
+    @property
+    def ratio(self) -> float:
+        return self.compressed_bytes / max(self.sample_bytes, 1)
+
+
+def sample_payload(
+    work_dir: Union[str, Path], paths: Iterable[Union[str, Path]], sample_size: int = SAMPLE_SIZE
+) -> List[Path]:
+    """ Picks files of the payload, spread evenly over it, adding up to about sample_size bytes
+
+    Parameters
+    -----------
+    work_dir: str or Path
+        Working directory
+
+    paths: list of str or Path
+        Files and directories in the payload, relative to work_dir
+
+    sample_size: int (optional)
+        Bytes to pick. Default: 16 MB
+
+    Returns
+    --------
+    files: list of Path
+        The picked files
+    """
+    files: List[Tuple[Path, int]] = []
+    for path in paths:
+        path = Path(work_dir, path)
+        if path.is_file():
+            files.append((path, path.stat().st_size))
+        for root, _, file_names in os.walk(path):
+            for name in sorted(file_names):
+                file_name = Path(root, name)
+                files.append((file_name, file_name.stat().st_size))
+    total = sum(size for _, size in files)
+    if total <= sample_size:
+        return [file_name for file_name, _ in files]
+    fraction = sample_size / total
+    sample = []
+    quota = 0.0
+    for file_name, size in sorted(files):
+        # take a file whenever the share of the bytes seen so far allows it
+        quota += size * fraction
+        if quota >= size:
+            sample.append(file_name)
+            quota -= size
+    return sample
+
+
+def _benchmark_one(settings: CompressionSettings, blocks: List[bytes]) -> CompressionResult:
+    start = time.thread_time()
+    compressed = [settings.compress(block) for block in blocks]
+    compress_time = time.thread_time() - start
+    start = time.thread_time()
+    for block in compressed:
+        settings.decompress(block)
+    extract_time = time.thread_time() - start
+    return CompressionResult(
+        settings,
+        sum(len(block) for block in blocks),
+        sum(len(block) for block in compressed),
+        compress_time,
+        extract_time,
+    )
+
+
+def benchmark(
+    files: Iterable[Union[str, Path]],
+    candidates: Iterable[CompressionSettings] = CANDIDATES,
+    max_workers: int = None,
+) -> List[CompressionResult]:
+    """ Compresses files with each candidate setting
+
+    Candidates run in parallel, and are timed by the CPU time of their thread
+
+    Parameters
+    -----------
+    files: list of str or Path
+        Files to compress
+
+    candidates: list of CompressionSettings (optional)
+        Settings to compare. Default: zlib, bzip2 and lzma, solid and not
+
+    max_workers: int (optional)
+        Number of candidates compressing at the same time. Default: chosen by
+        :class:`concurrent.futures.ThreadPoolExecutor`
+
+    Returns
+    --------
+    results: list of CompressionResult
+        Result of each candidate
+    """
+    blocks = [Path(file_name).read_bytes() for file_name in files]
+    solid_blocks = [b"".join(blocks)]
+
+    def run(settings):
+        return _benchmark_one(settings, solid_blocks if settings.solid else blocks)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, candidates))
+
+
+def choose(results: List[CompressionResult], goal: str) -> CompressionResult:
+    """ Best result for a goal
+
+    Parameters
+    -----------
+    results: list of CompressionResult
+        Benchmark results
+
+    goal: "size", "build" or "extract"
+        Smallest installer, fastest compression or fastest extraction
+
+    Returns
+    --------
+    result: CompressionResult
+        The best result. Ties are broken by size
+    """
+    if goal not in GOALS:
+        raise ValueError(f"goal must be 'size', 'build' or 'extract'. Got: {goal}")
+    if goal == "size":
+        return min(results, key=lambda r: (r.compressed_bytes, r.compress_time))
+    if goal == "build":
+        return min(results, key=lambda r: (r.compress_time, r.compressed_bytes))
+    return min(results, key=lambda r: (r.extract_time, r.compressed_bytes))
+
+
+def format_results(results: List[CompressionResult], chosen: CompressionResult = None) -> str:
+    """ Table with the benchmark results """
+    lines = [f"{'settings':24s} {'ratio':>6s} {'compress':>9s} {'extract':>9s}"]
+    for result in results:
+        marker = " *" if result is chosen else ""
+        lines.append(
+            f"{str(result.settings):24s} {result.ratio:6.3f} "
+            f"{result.compress_time:8.2f}s {result.extract_time:8.2f}s{marker}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,53 @@
+""" Restores the files which were left out of the installer because they duplicated other files
+
+Run by the installer with the Python of the environment, before condansis-unpack.py.
+The list of duplicates is in condansis-dedup.json, next to this script, with paths relative to
+the install directory
+"""
+import os
+import sys
+import json
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def copy_file(source, destination, mtime):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+    os.utime(destination, (mtime, mtime))
+
+
+def restore(install_dir, manifest_name):
+    with open(manifest_name, "r") as f:
+        manifest = json.load(f)
+    hardlink = manifest["mode"] == "hardlink"
+    for path, entry in manifest["files"].items():
+        destination = os.path.join(install_dir, path)
+        source = os.path.join(install_dir, entry["source"])
+        parent = os.path.dirname(destination)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        if os.path.lexists(destination):
+            # left by a previous installation
+            os.remove(destination)
+        if hardlink:
+            try:
+                os.link(source, destination)
+                continue
+            except OSError:
+                # not supported by the file system, or the files are in different drives
+                hardlink = False
+        copy_file(source, destination, entry["mtime"])
+    return len(manifest["files"])
+
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    # the script is in install_dir/env/Scripts
+    install_dir = os.path.dirname(os.path.dirname(script_dir))
+    n_files = restore(install_dir, os.path.join(script_dir, "condansis-dedup.json"))
+    sys.stdout.write("Restored %d duplicate files\n" % n_files)
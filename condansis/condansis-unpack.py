@@ -38,12 +38,28 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import hashlib
+import io
+import mmap
+import os
 import re
+import shutil
 import struct
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 on_win = sys.platform == 'win32'
 
+# Files at least this large are memory-mapped instead of read, and relocated by their own
+# workers. Set with --large-file-size
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+# Size of the pieces of large files copied when their length changes
+CHUNK_SIZE = 1024 * 1024
+LARGE_FILE_WORKERS = 2
+# Small files are handed to the workers in batches, to keep the scheduling overhead low
+BATCH_SIZE = 64
+
 # three capture groups: whole_shebang, executable, options
 SHEBANG_REGEX = (
         # pretty much the whole match string
@@ -65,6 +81,11 @@ def update_prefix(path, new_prefix, placeholder, mode='text'):
         # escape backslashes replace with unix-style path separators
         new_prefix = new_prefix.replace('\\', '/')
 
+    size = os.path.getsize(path)
+    if size and size >= LARGE_FILE_SIZE:
+        update_large_file(path, new_prefix, placeholder, mode)
+        return
+
     with open(path, 'rb+') as fh:
         original_data = fh.read()
         fh.seek(0)
@@ -77,6 +98,141 @@ def update_prefix(path, new_prefix, placeholder, mode='text'):
             fh.truncate()
 
 
+def update_large_file(path, new_prefix, placeholder, mode='text'):
+    """Same as update_prefix, without reading the whole file into memory.
+
+    The file is memory-mapped to find the placeholder. Replacements which keep the length of
+    the file are written in place, and otherwise the file is rewritten piece by piece."""
+    placeholder = placeholder.encode('utf-8')
+    new_prefix = new_prefix.encode('utf-8')
+    if mode not in ('text', 'binary'):
+        raise ValueError("Invalid mode: %r" % mode)
+    with open(path, 'rb+') as fh:
+        mm = mmap.mmap(fh.fileno(), 0)
+        try:
+            if mode == 'text':
+                if mm.find(placeholder) == -1:
+                    return
+                if len(placeholder) == len(new_prefix):
+                    pos = mm.find(placeholder)
+                    while pos != -1:
+                        mm[pos:pos + len(placeholder)] = new_prefix
+                        pos = mm.find(placeholder, pos + len(placeholder))
+                    mm.flush()
+                    return
+            elif on_win:
+                new_prefix = new_prefix.lower()
+                if mm.find(placeholder) == -1:
+                    placeholder = placeholder.lower()
+                    if mm.find(placeholder) == -1:
+                        return
+                shebang = _find_pyzzer_shebang(mm)
+                if shebang is None:
+                    return
+                start, end = shebang
+                new_shebang = mm[start:end].replace(placeholder, new_prefix)
+                if new_shebang == mm[start:end]:
+                    return
+                if len(new_shebang) == end - start:
+                    mm[start:end] = new_shebang
+                    mm.flush()
+                    return
+            else:
+                # the padded replacements keep the length of the file
+                _binary_replace_in_place(mm, placeholder, new_prefix)
+                mm.flush()
+                return
+        finally:
+            mm.close()
+
+    # the length changes: write a new file next to the old one
+    tmp_path = path + '.condansis-tmp'
+    try:
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            if mode == 'text':
+                _stream_replace(src, dst, placeholder, new_prefix)
+            else:
+                _copy_range(src, dst, 0, start)
+                dst.write(new_shebang)
+                _copy_range(src, dst, end, None)
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _stream_replace(src, dst, placeholder, new_prefix):
+    # the last len(placeholder) - 1 bytes of each piece are kept for the next one, in case
+    # a placeholder starts in them
+    keep = len(placeholder) - 1
+    tail = b''
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        data = tail + chunk
+        i = 0
+        pos = data.find(placeholder)
+        while pos != -1:
+            dst.write(data[i:pos])
+            dst.write(new_prefix)
+            i = pos + len(placeholder)
+            pos = data.find(placeholder, i)
+        safe = max(i, len(data) - keep)
+        dst.write(data[i:safe])
+        tail = data[safe:]
+    dst.write(tail)
+
+
+def _copy_range(src, dst, start, end):
+    # copies src[start:end] to dst, end None being the end of the file
+    src.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+        chunk = src.read(size)
+        if not chunk:
+            break
+        dst.write(chunk)
+        if remaining is not None:
+            remaining -= len(chunk)
+
+
+def _binary_replace_in_place(mm, placeholder, new_prefix):
+    # same as binary_replace in POSIX, writing into the memory map. Every match is checked
+    # before the first write, so that a prefix which does not fit leaves the file unchanged
+    pat = re.compile(re.escape(placeholder) + b'([^\0]*?)\0')
+    replacements = []
+    for match in pat.finditer(mm):
+        group = match.group()
+        occurances = group.count(placeholder)
+        padding = (len(placeholder) - len(new_prefix)) * occurances
+        if padding < 0:
+            raise ValueError("negative padding")
+        replacements.append(
+            (match.start(), match.end(), group.replace(placeholder, new_prefix) + b'\0' * padding))
+    for start, end, group in replacements:
+        mm[start:end] = group
+
+
+def _find_pyzzer_shebang(data):
+    # start and end of the shebang of a distlib launcher, as replace_pyzzer_entry_point_shebang
+    # finds it, or None
+    pos = data.rfind(b'PK\x05\x06')
+    if pos < 0:
+        return None
+    cdr_size, cdr_offset = struct.unpack('<LL', data[pos + 12:pos + 20])
+    arc_pos = pos - cdr_size - cdr_offset
+    if arc_pos <= 0 or arc_pos >= len(data):
+        return None
+    pos = data.rfind(b'#!', 0, arc_pos)
+    if pos <= 0:
+        return None
+    return pos, arc_pos
+
+
 def replace_prefix(data, mode, placeholder, new_prefix):
     if mode == 'text':
         data2 = text_replace(data, placeholder, new_prefix)
@@ -171,4 +327,382 @@ def replace_pyzzer_entry_point_shebang(all_data, placeholder, new_prefix):
                 new_prefix = new_prefix.encode('utf-8')
             shebang = shebang.replace(placeholder, new_prefix)
             all_data = b"".join([launcher, shebang, data])
-    return all_data
\ No newline at end of file
+    return all_data
+
+
+def default_workers():
+    # relocation is mostly waiting for the disk, so use more threads than CPUs
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class Matcher(object):
+    """A placeholder and its replacement, encoded and compiled once for all the files which
+    contain it. ``replace`` gives the same result as replace_prefix."""
+
+    def __init__(self, placeholder, new_prefix, mode):
+        if mode not in ('text', 'binary'):
+            raise ValueError("Invalid mode: %r" % mode)
+        self.mode = mode
+        self.text_placeholder = placeholder
+        self.text_prefix = new_prefix
+        if on_win and mode == 'text':
+            self.text_prefix = new_prefix.replace('\\', '/')
+        self.placeholder = placeholder.encode('utf-8')
+        self.new_prefix = self.text_prefix.encode('utf-8')
+        if mode == 'binary' and on_win:
+            self.new_prefix = self.new_prefix.lower()
+            self.lower_placeholder = self.placeholder.lower()
+        elif mode == 'binary':
+            self.pattern = re.compile(re.escape(self.placeholder) + b'([^\0]*?)\0')
+
+    def _pad(self, match):
+        group = match.group()
+        occurances = group.count(self.placeholder)
+        padding = (len(self.placeholder) - len(self.new_prefix)) * occurances
+        if padding < 0:
+            raise ValueError("negative padding")
+        return group.replace(self.placeholder, self.new_prefix) + b'\0' * padding
+
+    def replace(self, data):
+        if self.mode == 'text':
+            return data.replace(self.placeholder, self.new_prefix)
+        if on_win:
+            if self.placeholder in data:
+                placeholder = self.placeholder
+            elif self.lower_placeholder in data:
+                placeholder = self.lower_placeholder
+            else:
+                return data
+            return replace_pyzzer_entry_point_shebang(data, placeholder, self.new_prefix)
+        data2 = self.pattern.sub(self._pad, data)
+        if len(data2) != len(data):
+            raise ValueError("Found mismatched data length in binary file")
+        return data2
+
+
+class MultiMatcher(object):
+    """Text matchers of a file with several placeholders, replaced in a single pass."""
+
+    def __init__(self, matchers):
+        self.mode = 'text'
+        self.replacements = dict((m.placeholder, m.new_prefix) for m in matchers)
+        # longest first, so that a placeholder which starts another one does not cut it
+        placeholders = sorted(self.replacements, key=len, reverse=True)
+        self.pattern = re.compile(b'|'.join(re.escape(p) for p in placeholders))
+        self.matchers = matchers
+
+    def replace(self, data):
+        return self.pattern.sub(lambda match: self.replacements[match.group()], data)
+
+
+class RelocationPlan(object):
+    """The records grouped by file, with one matcher per distinct placeholder and mode.
+
+    ``files`` lists (index, path, matchers) in the order of the records, index being the
+    position of the first record of the file."""
+
+    def __init__(self, records, new_prefix):
+        self.new_prefix = new_prefix
+        self.matchers = {}
+        self.files = []
+        multi_matchers = {}
+        by_path = {}
+        for index, (path, placeholder, mode) in enumerate(records):
+            key = (placeholder, mode)
+            matcher = self.matchers.get(key)
+            if matcher is None:
+                matcher = self.matchers[key] = Matcher(placeholder, new_prefix, mode)
+            if path in by_path:
+                by_path[path][2].append(matcher)
+            else:
+                by_path[path] = (index, path, [matcher])
+                self.files.append(by_path[path])
+        for index, path, matchers in self.files:
+            text = [m for m in matchers if m.mode == 'text']
+            if len(text) > 1:
+                key = tuple(m.placeholder for m in text)
+                if key not in multi_matchers:
+                    multi_matchers[key] = MultiMatcher(text)
+                matchers[:] = [multi_matchers[key]] + [m for m in matchers if m.mode != 'text']
+
+    def relocate_file(self, path, matchers):
+        with open(path, 'rb+') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if not size or size < LARGE_FILE_SIZE:
+                original_data = fh.read()
+                data = original_data
+                for matcher in matchers:
+                    data = matcher.replace(data)
+                # If the before and after content is the same, skip writing
+                if data != original_data:
+                    fh.seek(0)
+                    fh.write(data)
+                    fh.truncate()
+                return
+        for matcher in matchers:
+            for m in getattr(matcher, 'matchers', [matcher]):
+                update_large_file(path, m.text_prefix, m.text_placeholder, m.mode)
+
+
+def _relocate_batch(plan, batch, journal=None):
+    failed = []
+    for index, path, matchers in batch:
+        full_path = os.path.join(plan.new_prefix, path)
+        try:
+            plan.relocate_file(full_path, matchers)
+            if journal is not None:
+                journal.add(index, full_path)
+        except Exception as e:
+            failed.append((index, path, e))
+    if journal is not None:
+        journal.flush()
+    return failed
+
+
+def records_digest(records, new_prefix):
+    """Digest of the records and of the prefix they are relocated to, identifying a journal."""
+    digest = hashlib.sha256(new_prefix.encode('utf-8'))
+    for path, placeholder, mode in records:
+        digest.update(('\n%s\t%s\t%s' % (path, placeholder, mode)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1000000000)
+    return st.st_size, mtime
+
+
+class Journal(object):
+    """The files already relocated, so that an interrupted relocation can be resumed.
+
+    The first line holds the digest of the records, and a journal of other records is ignored.
+    Each relocated file then adds a line "index size mtime", index being the position of its
+    first record, and size and mtime the ones of the file once relocated. A file is pending
+    if it has no line, or if it changed since."""
+
+    def __init__(self, file_name, digest):
+        self.file_name = file_name
+        self.header = ('%s %s\n' % (JOURNAL_HEADER, digest)).encode('ascii')
+        self.entries = {}
+        self.cut_short = False
+        self.lock = threading.Lock()
+        self.fh = None
+
+    def load(self):
+        """Reads the journal. Returns False if there is none, or if it is for other records."""
+        self.entries = {}
+        self.cut_short = False
+        try:
+            with open(self.file_name, 'rb') as f:
+                # tolerates \r\n, from a journal copied or edited as text on Windows
+                if f.readline().rstrip(b'\r\n') != self.header.rstrip(b'\n'):
+                    return False
+                for line in f:
+                    # the last line can be cut short by the interruption
+                    self.cut_short = not line.endswith(b'\n')
+                    parts = line.split()
+                    if len(parts) == 3 and not self.cut_short:
+                        self.entries[int(parts[0])] = (int(parts[1]), int(parts[2]))
+        except (IOError, OSError):
+            return False
+        return True
+
+    def is_pending(self, index, path):
+        stamp = self.entries.get(index)
+        if stamp is None:
+            return True
+        try:
+            return _file_stamp(path) != stamp
+        except OSError:
+            return True
+
+    def open(self, resume=False):
+        """Opens the journal for writing, keeping the lines read by load when resuming."""
+        if resume:
+            self.fh = open(self.file_name, 'ab')
+            if self.cut_short:
+                self.fh.write(b'\n')
+        else:
+            self.entries = {}
+            self.fh = open(self.file_name, 'wb')
+            self.fh.write(self.header)
+            self.fh.flush()
+
+    def add(self, index, path):
+        size, mtime = _file_stamp(path)
+        with self.lock:
+            self.fh.write(('%d %d %d\n' % (index, size, mtime)).encode('ascii'))
+
+    def flush(self):
+        with self.lock:
+            self.fh.flush()
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+
+def pending_files(plan, journal):
+    """Entries of ``plan.files`` which the journal does not list as relocated and unchanged."""
+    return [entry for entry in plan.files
+            if journal.is_pending(entry[0], os.path.join(plan.new_prefix, entry[1]))]
+
+
+def relocate(records, new_prefix, workers=None, journal=None, resume=False):
+    """Replaces the placeholders in the files of ``records`` with ``new_prefix``.
+
+    Small files are relocated in batches by a pool of ``workers`` threads, and large files by
+    a separate pool of LARGE_FILE_WORKERS threads. A failure does not stop the other files
+    from being relocated. Returns the failures as (index, path, error), in the order of the
+    records.
+
+    The relocated files are written to ``journal``, a Journal, if given. When resuming, the
+    files it lists as relocated and unchanged are skipped."""
+    if workers is None:
+        workers = default_workers()
+    plan = RelocationPlan(records, new_prefix)
+    files = plan.files
+    if journal is not None:
+        resume = resume and journal.load()
+        if resume:
+            files = pending_files(plan, journal)
+        journal.open(resume)
+    try:
+        errors = _relocate_files(plan, files, workers, journal)
+    finally:
+        if journal is not None:
+            journal.close()
+    return sorted(errors, key=lambda error: error[0])
+
+
+def _relocate_files(plan, files, workers, journal):
+    if workers <= 1:
+        errors = _relocate_batch(plan, files, journal)
+    else:
+        small = []
+        large = []
+        for entry in files:
+            try:
+                size = os.path.getsize(os.path.join(plan.new_prefix, entry[1]))
+            except OSError:
+                # reported when relocating
+                size = 0
+            (large if size >= LARGE_FILE_SIZE else small).append(entry)
+        with ThreadPoolExecutor(max_workers=LARGE_FILE_WORKERS) as large_pool, \
+                ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [large_pool.submit(_relocate_batch, plan, [entry], journal)
+                       for entry in large]
+            futures += [pool.submit(_relocate_batch, plan, small[i:i + BATCH_SIZE], journal)
+                        for i in range(0, len(small), BATCH_SIZE)]
+            errors = [error for future in futures for error in future.result()]
+    return errors
+
+
+# Written by condansis next to this script
+RECORDS_FILE_NAME = 'condansis-prefix-records.txt'
+RECORDS_FILE_HEADER = 'condansis-prefix-records 1'
+# Written by this script next to it
+JOURNAL_NAME = 'condansis-unpack.journal'
+JOURNAL_HEADER = 'condansis-unpack-journal 1'
+MODES = {'t': 'text', 'b': 'binary'}
+# Imported by sitecustomize.py at each start of Python, instead of looking for the directories
+DLL_DIRECTORIES_MODULE = 'condansis_dll_directories'
+LIBRARY_DIRECTORIES = [
+    ('Library', 'mingw-w64'),
+    ('Library', 'usr', 'bin'),
+    ('Library', 'bin'),
+]
+
+
+def load_records(file_name):
+    """Yields the (path, placeholder, mode) records of a records file, line by line.
+
+    Each placeholder is listed once as "p<TAB>placeholder", and the records refer to it by
+    index, as "t<TAB>index<TAB>path" for text mode and "b<TAB>index<TAB>path" for binary."""
+    placeholders = []
+    with io.open(file_name, 'r', encoding='utf-8', newline='\n') as f:
+        if f.readline().rstrip('\n') != RECORDS_FILE_HEADER:
+            raise ValueError('Unsupported prefix records file: %s' % file_name)
+        for line in f:
+            kind, value = line.rstrip('\n').split('\t', 1)
+            if kind == 'p':
+                placeholders.append(value)
+            else:
+                index, path = value.split('\t', 1)
+                yield path, placeholders[int(index)], MODES[kind]
+
+
+def write_dll_directories(prefix):
+    """Lists the DLL directories of the installed environment in a module next to its
+    sitecustomize.py, which imports it."""
+    site_packages = os.path.join(prefix, 'Lib', 'site-packages')
+    if not os.path.isfile(os.path.join(site_packages, 'sitecustomize.py')):
+        return
+    directories = [os.path.join(prefix, *parts) for parts in LIBRARY_DIRECTORIES]
+    directories = [directory for directory in directories if os.path.isdir(directory)]
+    file_name = os.path.join(site_packages, DLL_DIRECTORIES_MODULE + '.py')
+    with open(file_name + '.tmp', 'wb') as f:
+        f.write(('# Written by condansis-unpack.py when installing\n'
+                 'DLL_DIRECTORIES = %r\n' % (directories,)).encode('utf-8'))
+    os.replace(file_name + '.tmp', file_name)
+
+
+def main(argv=None):
+    global LARGE_FILE_SIZE
+    import argparse
+    parser = argparse.ArgumentParser(
+            prog='conda-unpack',
+            description=('Finish unpacking the environment after unarchiving.'
+                         'Cleans up absolute prefixes in any remaining files'))
+    parser.add_argument('--version',
+                        action='store_true',
+                        help='Show version then exit')
+    parser.add_argument('--large-file-size',
+                        type=int,
+                        default=None,
+                        help='Size in bytes from which files are memory-mapped. Default: %d'
+                             % LARGE_FILE_SIZE)
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help='Number of threads relocating files. Default: %d'
+                             % default_workers())
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Only relocate the files which the journal of a previous run '
+                             'does not list, or which changed since')
+    parser.add_argument('--verify',
+                        action='store_true',
+                        help='List the files which --resume would relocate, without '
+                             'changing them. Exits with 1 if there are any')
+    args = parser.parse_args(argv)
+    # Manually handle version printing to output to stdout in python < 3.4
+    if args.version:
+        print('conda-unpack 0.6.0')
+        return 0
+    if args.large_file_size is not None:
+        LARGE_FILE_SIZE = args.large_file_size
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    new_prefix = os.path.abspath(os.path.dirname(script_dir))
+    records = list(load_records(os.path.join(script_dir, RECORDS_FILE_NAME)))
+    journal = Journal(os.path.join(script_dir, JOURNAL_NAME),
+                      records_digest(records, new_prefix))
+    if args.verify:
+        plan = RelocationPlan(records, new_prefix)
+        pending = pending_files(plan, journal) if journal.load() else plan.files
+        for index, path, matchers in pending:
+            sys.stdout.write('%s\n' % path)
+        return 1 if pending else 0
+    errors = relocate(records, new_prefix, args.workers, journal, args.resume)
+    write_dll_directories(new_prefix)
+    for index, path, error in errors:
+        sys.stderr.write('Could not relocate %s: %s\n' % (path, error))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
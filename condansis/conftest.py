@@ -0,0 +1,68 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+import conda_pack
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+class MockConda:
+    """ Stands in for conda, pip, makensis and conda-pack
+
+    conda creates an empty environment, pip does nothing, makensis writes an empty installer
+    and conda-pack packs test_files/package_env
+
+    Parameters
+    ------------
+    commands: list
+        Arguments of each command run, in order
+
+    packs: list of (output, format)
+        Calls to conda-pack
+
+    fail: set of str
+        Names of the installers for which makensis fails, after writing part of the installer
+    """
+
+    def __init__(self) -> None:
+        self.commands = []
+        self.packs = []
+        self.fail = set()
+
+    def run(self, args, check):
+        self.commands.append(args)
+        if "create" in args:
+            os.makedirs(os.path.join(args[args.index("-p") + 1], "Lib", "site-packages"))
+        elif "makensis" in os.path.basename(str(args[0])):
+            with open(args[1]) as f:
+                script = f.read()
+            installer_name = script.split('!define INSTALLER_NAME "')[1].split('"')[0]
+            os.makedirs(os.path.dirname(installer_name), exist_ok=True)
+            open(installer_name, "w").close()
+            if os.path.basename(installer_name) in self.fail:
+                raise subprocess.CalledProcessError(1, args)
+
+    def count(self, command: str) -> int:
+        """ Number of commands run with this argument, such as "create" or "pip" """
+        return sum(command in map(str, args) for args in self.commands)
+
+    def from_prefix(self, *args, **kwargs):
+        return self
+
+    def pack(self, output, format="infer"):
+        self.packs.append((output, format))
+        package_env = os.path.join(TEST_FILES_DIR, "package_env")
+        if format == "no-archive":
+            shutil.copytree(package_env, output)
+        else:
+            shutil.make_archive(str(output)[: -len(".tar")], "tar", package_env, ".")
+
+
+@pytest.fixture
+def mock_conda(monkeypatch):
+    conda = MockConda()
+    monkeypatch.setattr(subprocess, "run", conda.run)
+    monkeypatch.setattr(conda_pack.CondaEnv, "from_prefix", conda.from_prefix)
+    return conda
@@ -0,0 +1,190 @@
+""" Copies files into the working directory, linking them where the file system allows it """
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+from pathlib import Path
+import os
+import errno
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+COPY_METHODS = ("hardlink", "clone", "copy")
+# ioctl request to clone a file in Linux, see "man ioctl_ficlone"
+FICLONE = 0x40049409
+
+
+def _hardlink(source: str, destination: str) -> None:
+    os.link(source, destination)
+
+
+def _clone(source: str, destination: str) -> None:
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Copy-on-write clones are not supported")
+    try:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        os.remove(destination)
+        raise
+    shutil.copystat(source, destination)
+
+
+def _copy(source: str, destination: str) -> None:
+    shutil.copy2(source, destination)
+
+
+_COPY_FUNCTIONS = {"hardlink": _hardlink, "clone": _clone, "copy": _copy}
+
+
+class CopyStats:
+    """ Number of files and bytes which went through each copy method """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.files: Dict[str, int] = {method: 0 for method in COPY_METHODS}
+        self.bytes: Dict[str, int] = {method: 0 for method in COPY_METHODS}
+
+    def add(self, method: str, size: int) -> None:
+        with self._lock:
+            self.files[method] += 1
+            self.bytes[method] += size
+
+    def report(self) -> str:
+        """ Summary of the copied files """
+        return ", ".join(
+            f"{method}: {self.files[method]} files ({self.bytes[method] / 1024 ** 2:.1f} MB)"
+            for method in COPY_METHODS
+        )
+
+
+class CopyEngine:
+    """ Copies files and directory trees
+
+    Each file is hardlinked, cloned or copied, trying the methods in the given order.
+    A method which fails between two drives is not tried there again.
+    Files must never be modified in place in the destination, as they can share data with the source.
+
+    Parameters
+    ------------
+    methods: list of "hardlink", "clone" or "copy" (optional)
+        Methods to try, in order. Clones are only supported in Linux file systems with
+        copy-on-write (Btrfs, XFS). Default: ("hardlink", "clone", "copy")
+
+    max_workers: int (optional)
+        Number of threads copying large directory trees. Default: chosen by
+        :class:`concurrent.futures.ThreadPoolExecutor`
+
+    parallel_threshold: int (optional)
+        Minimum number of files in a directory tree to copy it with multiple threads. Default: 64
+    """
+
+    def __init__(
+        self,
+        methods: Sequence[str] = COPY_METHODS,
+        max_workers: int = None,
+        parallel_threshold: int = 64,
+    ) -> None:
+        for method in methods:
+            if method not in COPY_METHODS:
+                raise ValueError(
+                    f"copy methods must be 'hardlink', 'clone' or 'copy'. Got: {method}"
+                )
+        if "copy" not in methods:
+            raise ValueError("copy methods must include 'copy'")
+        self.methods = tuple(methods)
+        self.max_workers = max_workers
+        self.parallel_threshold = parallel_threshold
+        self.stats = CopyStats()
+        self._failed = set()
+
+    def _copy_file(self, source: str, destination: str, devices: Tuple[int, int]) -> None:
+        size = os.stat(source).st_size
+        if os.path.lexists(destination):
+            if os.path.exists(destination) and os.path.samefile(source, destination):
+                self.stats.add("hardlink", size)
+                return
+            os.remove(destination)
+        for method in self.methods:
+            if (method, devices) in self._failed:
+                continue
+            try:
+                _COPY_FUNCTIONS[method](source, destination)
+            except OSError as e:
+                if method == "copy":
+                    raise
+                logging.debug(f"Could not {method} {source}: {e}")
+                self._failed.add((method, devices))
+            else:
+                self.stats.add(method, size)
+                return
+
+    def copy_file(self, source: Union[str, Path], destination: Union[str, Path]) -> None:
+        """ Copies a file, replacing the destination if it exists
+
+        Parameters
+        -----------
+        source: str or Path
+            File to copy
+
+        destination: str or Path
+            Destination file. Its parent directory must exist
+        """
+        devices = (os.stat(source).st_dev, os.stat(os.path.dirname(destination)).st_dev)
+        self._copy_file(str(source), str(destination), devices)
+
+    def map(self, function: Callable[[Any], Any], items: Sequence[Any]) -> List[Any]:
+        """ Calls a function on each item, in parallel from parallel_threshold items
+
+        Parameters
+        -----------
+        function: callable
+            Function taking one item, such as a pair of files to copy. Must be thread-safe
+
+        items: list
+            Items to process
+
+        Returns
+        --------
+        results: list
+            Result of the function for each item, in order
+        """
+        if len(items) < self.parallel_threshold:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(function, items))
+
+    def copy_tree(self, source: Union[str, Path], destination: Union[str, Path]) -> None:
+        """ Copies a directory tree, merging it into the destination if it exists
+
+        Parameters
+        -----------
+        source: str or Path
+            Directory to copy
+
+        destination: str or Path
+            Destination directory
+        """
+        source = str(source)
+        destination = str(destination)
+        os.makedirs(destination, exist_ok=True)
+        devices = (os.stat(source).st_dev, os.stat(destination).st_dev)
+
+        directories: List[Tuple[str, str]] = [(source, destination)]
+        files: List[Tuple[str, str]] = []
+        for root, dir_names, file_names in os.walk(source, followlinks=True):
+            target_root = os.path.join(destination, os.path.relpath(root, source))
+            for name in dir_names:
+                os.makedirs(os.path.join(target_root, name), exist_ok=True)
+                directories.append((os.path.join(root, name), os.path.join(target_root, name)))
+            for name in file_names:
+                files.append((os.path.join(root, name), os.path.join(target_root, name)))
+
+        self.map(lambda f: self._copy_file(*f, devices), files)
+
+        for src, dst in directories:
+            shutil.copystat(src, dst)
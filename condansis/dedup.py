@@ -0,0 +1,179 @@
+""" Finds byte-identical files in the installer payload, so that only one copy of each is shipped """
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Union
+from pathlib import Path
+import os
+import json
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from .staging import file_hash
+
+# Install-time script which restores the removed duplicates, and its list of duplicates
+RESTORE_SCRIPT = (Path(__file__).parent / "condansis-dedup.py").resolve()
+DEDUP_MANIFEST_NAME = "condansis-dedup.json"
+# Smaller files do not compress to less than what listing them costs
+MIN_SIZE = 1024
+RESTORE_MODES = ("hardlink", "copy")
+
+
+@dataclass
+class DedupStats:
+    """ Number of duplicate files and bytes removed from the payload """
+
+    files: int = 0
+    bytes: int = 0
+
+
+def needed_at_startup(path: str) -> bool:
+    """ Whether Python needs a file of the environment to start and restore the duplicates
+
+    Parameters
+    -----------
+    path: str
+        Path relative to the environment, with forward slashes
+    """
+    if "/" not in path:
+        # python.exe, python3x.dll and the other files in the root of the environment
+        return True
+    if path.startswith("DLLs/") or path.startswith("Scripts/condansis-"):
+        return True
+    # the standard library, but not the installed packages
+    return path.startswith("Lib/") and not path.startswith("Lib/site-packages/")
+
+
+def find_duplicates(
+    root: Union[str, Path],
+    directories: Iterable[str],
+    skip: Set[str] = frozenset(),
+    keep: Callable[[str], bool] = None,
+    min_size: int = MIN_SIZE,
+    max_workers: int = None,
+    hashes: Optional[Mapping[str, str]] = None,
+) -> Dict[str, str]:
+    """ Finds files with the same content
+
+    Files are first grouped by size, and only files sharing a size are hashed
+
+    Parameters
+    -----------
+    root: str or Path
+        Directory the paths are relative to
+
+    directories: list of str
+        Directories to search, relative to root
+
+    skip: set of str (optional)
+        Files which are neither removed nor used as the source of other files, relative to root
+
+    keep: callable (optional)
+        Called with each path relative to root. Files for which it returns True are never removed,
+        but can be the source of other files. Default: None (all files can be removed)
+
+    min_size: int (optional)
+        Smaller files are ignored. Default: 1024
+
+    max_workers: int (optional)
+        Number of threads hashing files. Default: chosen by
+        :class:`concurrent.futures.ThreadPoolExecutor`
+
+    hashes: dict (optional)
+        Known sha256 digests of some of the files, keyed by their path relative to root
+
+    Returns
+    --------
+    duplicates: dict
+        Path of each duplicate file, mapped to the path of the file with the same content
+        which is kept. Paths are relative to root, with forward slashes
+    """
+    root = Path(root)
+    by_size: Dict[int, List[str]] = defaultdict(list)
+    for directory in directories:
+        for dir_root, _, file_names in os.walk(root / directory):
+            relative_root = Path(dir_root).relative_to(root).as_posix()
+            for name in file_names:
+                path = f"{relative_root}/{name}"
+                if path in skip:
+                    continue
+                st = os.lstat(os.path.join(dir_root, name))
+                if st.st_size >= min_size:
+                    by_size[st.st_size].append(path)
+
+    candidates = [path for paths in by_size.values() if len(paths) > 1 for path in paths]
+    known = {} if hashes is None else hashes
+
+    def digest(path):
+        if path in known:
+            return known[path]
+        return file_hash(root / path)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        digests = dict(zip(candidates, executor.map(digest, candidates)))
+
+    groups: Dict[str, List[str]] = defaultdict(list)
+    for path in sorted(candidates):
+        groups[digests[path]].append(path)
+
+    duplicates = {}
+    for paths in groups.values():
+        if len(paths) < 2:
+            continue
+        kept = [path for path in paths if keep is not None and keep(path)]
+        source = kept[0] if kept else paths[0]
+        for path in paths:
+            if path != source and path not in kept:
+                duplicates[path] = source
+    return duplicates
+
+
+def remove_duplicates(
+    root: Union[str, Path],
+    duplicates: Mapping[str, str],
+    manifest_name: Union[str, Path],
+    restore_mode: str = "hardlink",
+) -> DedupStats:
+    """ Removes the duplicate files, and lists them so that they can be restored when installing
+
+    Parameters
+    -----------
+    root: str or Path
+        Directory the paths are relative to. The duplicates are restored relative to the
+        install directory
+
+    duplicates: dict
+        Path of each duplicate file, mapped to the path of the file with the same content
+
+    manifest_name: str or Path
+        File listing the duplicates, read by condansis-dedup.py
+
+    restore_mode: "hardlink" or "copy" (optional)
+        How the duplicates are restored. Hardlinks fall back to copies where not supported.
+        Default: "hardlink"
+
+    Returns
+    --------
+    stats: DedupStats
+        Number of files and bytes removed
+    """
+    if restore_mode not in RESTORE_MODES:
+        raise ValueError(f"restore mode must be 'hardlink' or 'copy'. Got: {restore_mode}")
+    root = Path(root)
+    stats = DedupStats()
+    entries = {}
+    for duplicate, source in sorted(duplicates.items()):
+        st = os.stat(root / duplicate)
+        entries[duplicate] = {"source": source, "mtime": st.st_mtime}
+        # the file may be a hardlink to a file outside the working directory, so it is only unlinked
+        os.remove(root / duplicate)
+        stats.files += 1
+        stats.bytes += st.st_size
+    tmp_name = f"{manifest_name}.tmp"
+    with open(tmp_name, "w") as f:
+        json.dump({"mode": restore_mode, "files": entries}, f, indent=0)
+    os.replace(tmp_name, manifest_name)
+    logging.info(
+        f"Deduplicated payload - {stats.files} files removed, "
+        f"{stats.bytes / 1024 ** 2:.1f} MB saved"
+    )
+    return stats
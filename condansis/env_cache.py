@@ -0,0 +1,380 @@
+""" On-disk cache of solved and built conda environments """
+from typing import Dict, List, Optional, Sequence, Union
+from pathlib import Path
+import os
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import hashlib
+import logging
+import platform
+import subprocess
+from dataclasses import dataclass
+
+# Bump this whenever the layout of a cached environment changes
+CACHE_FORMAT_VERSION = "1"
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+ENTRY_METADATA = "entry.json"
+ENTRY_PREFIX = "prefix"
+
+
+def _default_cache_dir() -> Path:
+    try:
+        return Path(os.environ["CONDANSIS_CACHE_DIR"])
+    except KeyError:
+        return Path.home() / ".condansis" / "env_cache"
+
+
+# Directories skipped when listing a package without git: caches and build outputs
+PACKAGE_SKIP_DIRS = ("__pycache__", "build", "dist")
+# Files never part of a package: installers, logs, traces and profiles of builds
+PACKAGE_SKIP_FILES = ("*.exe", "*.log", "*.trace.json", "*.prof")
+
+
+def _git_files(package_root: Path) -> Optional[Dict[str, Optional[str]]]:
+    # the files git tracks or would track, with the object id of the unmodified tracked ones
+    def git(*args):
+        try:
+            process = subprocess.Popen(
+                ["git", *args], cwd=package_root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            return None
+        output, _ = process.communicate()
+        if process.returncode != 0:
+            return None
+        return [entry for entry in output.decode("utf-8").split("\0") if entry]
+
+    tracked = git("ls-files", "-z", "--stage")
+    changed = git("ls-files", "-z", "--modified", "--others", "--exclude-standard")
+    if tracked is None or changed is None:
+        return None
+    files: Dict[str, Optional[str]] = {}
+    for entry in tracked:
+        # "mode object stage\tpath"
+        info, path = entry.split("\t", 1)
+        files[path] = info.split()[1]
+    for path in changed:
+        files[path] = None
+    return files
+
+
+def _walk_files(package_root: Path) -> Dict[str, Optional[str]]:
+    files: Dict[str, Optional[str]] = {}
+    for root, dir_names, file_names in os.walk(package_root):
+        dir_names[:] = [
+            name
+            for name in dir_names
+            if not name.startswith(".")
+            and name not in PACKAGE_SKIP_DIRS
+            and not name.endswith(".egg-info")
+        ]
+        for name in file_names:
+            files[Path(root, name).relative_to(package_root).as_posix()] = None
+    return files
+
+
+def package_digest(package_root: Union[str, Path], skip: Sequence[Union[str, Path]] = ()) -> str:
+    """ Digest of the files of a package which pip installs into the environment
+
+    In a git repository, these are the files git tracks, and the untracked ones it does not
+    ignore. The unmodified tracked files are hashed by git already, so only the others are read.
+    Otherwise, all the files are read, except in hidden directories, ``PACKAGE_SKIP_DIRS`` and
+    ``*.egg-info`` directories. Either way, files matching ``PACKAGE_SKIP_FILES`` are left out
+
+    Parameters
+    -----------
+    package_root: str or Path
+        Directory of the package
+
+    skip: list of str or Path (optional)
+        Other files or directories to leave out, such as the outputs of the build
+
+    Returns
+    --------
+    digest: str
+        Hex digest of the paths and contents of the files
+    """
+    package_root = Path(os.path.abspath(package_root))
+    files = _git_files(package_root)
+    if files is None:
+        files = _walk_files(package_root)
+    skipped = [os.path.normcase(os.path.abspath(path)) for path in skip]
+    digest = hashlib.sha256()
+    for relative, object_id in sorted(files.items()):
+        if any(fnmatch.fnmatch(relative.rsplit("/", 1)[-1], p) for p in PACKAGE_SKIP_FILES):
+            continue
+        path = os.path.normcase(os.path.join(package_root, relative))
+        if any(path == s or path.startswith(s + os.sep) for s in skipped):
+            continue
+        if object_id is None:
+            try:
+                content = hashlib.sha256()
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        content.update(chunk)
+            except OSError:
+                # deleted, or a directory such as a submodule
+                continue
+            object_id = content.hexdigest()
+        digest.update(f"{len(relative)} {relative} {object_id}\n".encode())
+    return digest.hexdigest()
+
+
+def _dir_size(path: Path) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+@dataclass
+class CacheEntry:
+    """ A cached environment """
+
+    key: str
+    prefix: Path
+    size: int
+    created: float
+    last_used: float
+
+
+class EnvCache:
+    """ Content-addressed cache of conda environments
+
+    Each entry is a complete conda prefix, keyed on a digest of everything that determines
+    its contents. Entries are evicted in least-recently-used order once the total size
+    of the cache exceeds ``max_size``.
+
+    Parameters
+    ------------
+    cache_dir: str or Path (optional)
+        Directory where the environments are stored.
+        Default: $CONDANSIS_CACHE_DIR, or :file:`~/.condansis/env_cache`
+
+    max_size: int (optional)
+        Maximum size of the cache in bytes. None disables eviction. Default: 10 GiB
+    """
+
+    def __init__(
+        self, cache_dir: Union[str, Path] = None, max_size: Optional[int] = DEFAULT_MAX_SIZE
+    ) -> None:
+        if cache_dir is None:
+            self.cache_dir = _default_cache_dir()
+        else:
+            self.cache_dir = Path(cache_dir)
+        self.cache_dir = self.cache_dir.resolve()
+
+        if max_size is not None and max_size < 0:
+            raise ValueError(f"max_size must be positive. Got: {max_size}")
+        self.max_size = max_size
+
+    @staticmethod
+    def compute_key(
+        env_file: Union[str, Path],
+        conda_command: str,
+        sitecustomize: Union[str, Path],
+        extra: str = "",
+    ) -> str:
+        """ Computes the cache key of an environment
+
+        Parameters
+        -----------
+        env_file: str or Path
+            File defining the environment
+
+        conda_command: str
+            Command used to create the environment
+
+        sitecustomize: str or Path
+            sitecustomize.py file copied into the environment
+
+        extra: str (optional)
+            Any other information that changes the contents of the environment
+
+        Returns
+        --------
+        key: str
+            Hex digest identifying the environment
+        """
+        digest = hashlib.sha256()
+        for part in (
+            CACHE_FORMAT_VERSION.encode(),
+            Path(env_file).read_bytes(),
+            conda_command.encode(),
+            Path(sitecustomize).read_bytes(),
+            f"{sys.platform}-{platform.machine()}".encode(),
+            extra.encode(),
+        ):
+            # length-prefix each part so that they can't run into each other
+            digest.update(len(part).to_bytes(8, "little"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def _read_entry(self, entry_dir: Path) -> Optional[CacheEntry]:
+        try:
+            with open(entry_dir / ENTRY_METADATA, "r") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(
+            key=entry_dir.name,
+            prefix=entry_dir / ENTRY_PREFIX,
+            size=metadata["size"],
+            created=metadata["created"],
+            last_used=metadata["last_used"],
+        )
+
+    def _write_entry(self, entry: CacheEntry) -> None:
+        metadata_file = self._entry_dir(entry.key) / ENTRY_METADATA
+        tmp_file = metadata_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(
+                {"size": entry.size, "created": entry.created, "last_used": entry.last_used}, f
+            )
+        os.replace(tmp_file, metadata_file)
+
+    def prefix(self, key: str) -> Path:
+        """ Reserves the prefix where the environment for ``key`` should be created
+
+        Leftovers from a build that did not finish are removed
+
+        Parameters
+        -----------
+        key: str
+            Cache key, see :meth:`compute_key`
+
+        Returns
+        --------
+        prefix: Path
+            Directory where the environment should be created
+        """
+        entry_dir = self._entry_dir(key)
+        if entry_dir.exists() and self._read_entry(entry_dir) is None:
+            logging.info(f"Removing incomplete cache entry {key[:12]}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        return entry_dir / ENTRY_PREFIX
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """ Looks up an environment in the cache
+
+        Parameters
+        -----------
+        key: str
+            Cache key, see :meth:`compute_key`
+
+        Returns
+        --------
+        prefix: Path or None
+            Prefix of the cached environment, or None if it is not in the cache
+        """
+        entry = self._read_entry(self._entry_dir(key))
+        if entry is None or not entry.prefix.is_dir():
+            return None
+        entry.last_used = time.time()
+        self._write_entry(entry)
+        return entry.prefix
+
+    def store(self, key: str) -> CacheEntry:
+        """ Registers the environment created in :meth:`prefix` and evicts old entries
+
+        Parameters
+        -----------
+        key: str
+            Cache key, see :meth:`compute_key`
+
+        Returns
+        --------
+        entry: CacheEntry
+            The new cache entry
+        """
+        prefix = self._entry_dir(key) / ENTRY_PREFIX
+        if not prefix.is_dir():
+            raise IOError(f"Could not find environment to cache at {prefix}")
+        now = time.time()
+        entry = CacheEntry(key, prefix, _dir_size(prefix), now, now)
+        self._write_entry(entry)
+        self.evict(keep=key)
+        return entry
+
+    def discard(self, key: str) -> None:
+        """ Removes an entry from the cache, complete or not
+
+        Parameters
+        -----------
+        key: str
+            Cache key, see :meth:`compute_key`
+        """
+        entry_dir = self._entry_dir(key)
+        # Remove the metadata first, so that a partially removed entry is never used
+        try:
+            (entry_dir / ENTRY_METADATA).unlink()
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        if entry_dir.exists():
+            logging.warning(f"Could not completely remove cache entry at {entry_dir}")
+
+    def entries(self) -> List[CacheEntry]:
+        """ Lists the complete entries in the cache, most recently used first """
+        if not self.cache_dir.is_dir():
+            return []
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            entry = self._read_entry(entry_dir)
+            if entry is not None:
+                entries.append(entry)
+        return sorted(entries, key=lambda e: e.last_used, reverse=True)
+
+    def purge(self, key: str = None) -> None:
+        """ Removes entries from the cache
+
+        Parameters
+        -----------
+        key: str (optional)
+            Entry to remove. Default: remove all entries, including incomplete ones
+        """
+        if key is not None:
+            self.discard(key)
+        elif self.cache_dir.is_dir():
+            for entry_dir in self.cache_dir.iterdir():
+                self.discard(entry_dir.name)
+
+    def evict(self, keep: str = None) -> List[CacheEntry]:
+        """ Removes least recently used entries until the cache fits in ``max_size``
+
+        Parameters
+        -----------
+        keep: str (optional)
+            Key of an entry which should never be evicted
+
+        Returns
+        --------
+        evicted: list of CacheEntry
+            Entries removed from the cache
+        """
+        if self.max_size is None:
+            return []
+        entries = self.entries()
+        total_size = sum(e.size for e in entries)
+        evicted = []
+        for entry in reversed(entries):
+            if total_size <= self.max_size:
+                break
+            if entry.key == keep:
+                continue
+            logging.info(f"Evicting cached environment {entry.key[:12]}")
+            self.discard(entry.key)
+            total_size -= entry.size
+            evicted.append(entry)
+        return evicted
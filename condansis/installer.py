@@ -1,22 +1,53 @@
-from typing import List, Sequence, Union
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional, Sequence, Union
 from pathlib import Path
 import os
+import sys
+import time
 import subprocess
 import shutil
+import hashlib
 import tempfile
 import logging
-from dataclasses import dataclass
-
-from jinja2 import Template
-import conda_pack
+import functools
+import contextlib
+from dataclasses import dataclass, asdict, replace
+
+from .env_cache import EnvCache, package_digest
+from .scheduler import StageScheduler
+from .tracing import BuildTrace, traced, path_usage
+
+# The stage modules are imported by the methods using them, so that importing condansis,
+# as the command line does for every command, does not load them
+if TYPE_CHECKING:
+    from .async_runner import AsyncRunner, LogSink
+    from .compression import CompressionResult, CompressionSettings
+    from .copier import CopyStats
+    from .dedup import DedupStats
+    from .payload import Payload, PayloadFile, StoreStats
+    from .pruning import PruneRule, PruneStats
+    from .record_check import RecordCheckStats
+    from .staging import StagingDir
 
 SITECUSTOMIZE = (Path(__file__).parent / "sitecustomize.py").resolve()
 NSIS_TEMPLATE = (Path(__file__).parent / "installer_template.nsi").resolve()
 CONDANSIS_UNPACK = (Path(__file__).parent / "condansis-unpack.py").resolve()
+# Directory inside a staging directory where the environment is packed before being synchronized
+PACK_DIR_NAME = ".condansis-pack"
+
 
-try:
-    CONDA_EXE = os.environ["CONDA_EXE"]
-except KeyError:
+@functools.lru_cache(maxsize=None)
+def find_conda_exe() -> Union[str, Path]:
+    """ Finds the conda executable, from $CONDA_EXE or the registry. Looked up once per process
+
+    Returns
+    --------
+    conda_exe: str or Path
+        Path to the conda executable, or "conda" to look for it in the PATH
+    """
+    try:
+        return os.environ["CONDA_EXE"]
+    except KeyError:
+        pass
     try:
         import winreg
 
@@ -26,14 +57,27 @@ except KeyError:
             conda_install_dir = winreg.QueryValue(
                 reg, os.path.join(winreg.EnumKey(reg, 0), "InstallPath")
             )
-            CONDA_EXE = Path(conda_install_dir, "Scripts", "conda.exe")
+            return Path(conda_install_dir, "Scripts", "conda.exe")
+    except (ImportError, OSError):
+        return "conda"
+
 
-    except (ImportError, WindowsError):
-        CONDA_EXE = "conda"
+def __getattr__(name: str):
+    # CONDA_EXE is only looked up when first used
+    if name == "CONDA_EXE":
+        return find_conda_exe()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-logging.basicConfig(
-    format="CondaNSIS - %(levelname)s: %(message)s ", level=logging.INFO,
-)
+
+def configure_logging() -> None:
+    """ Shows the progress of the build, unless logging was already configured
+
+    Called by the condansis command line. Applications using :class:`Installer` configure
+    logging themselves
+    """
+    logging.basicConfig(
+        format="CondaNSIS - %(levelname)s: %(message)s ", level=logging.INFO,
+    )
 
 
 @dataclass
@@ -46,6 +90,14 @@ class _shortcut:
     icon_file: Union[str, Path] = ""
 
 
+def _packed_env_usage(installer, result, work_dir, *args, **kwargs):
+    return path_usage(work_dir / installer.env_name)
+
+
+def _copy_usage(installer, stats, *args, **kwargs):
+    return sum(stats.files.values()), sum(stats.bytes.values())
+
+
 class Installer:
     r""" Defines an installer for a Python package and its environment 
 
@@ -100,9 +152,39 @@ class Installer:
     register_uninstaller: bool (optional)
         Whether to register the uninstaller to Windows' "add or remove programs". Default: True
 
-    compressor: 'zlib', 'bzip2', or 'lzma' (optional)
+    compressor: 'zlib', 'bzip2', 'lzma' or 'auto' (optional)
         Compression algorithm to use. Default: lzma
         `See here for more information <https://nsis.sourceforge.io/Reference/SetCompressor>`_
+        'auto' compresses a sample of the payload with several algorithms and settings, and picks
+        the best one for compression_goal. solid_compression and compressor_dict_size are then
+        ignored, and datablock_optimize applies to the chosen settings
+
+    solid_compression: bool (optional)
+        Whether to compress all files together as one block, which usually compresses better and
+        extracts faster. Default: False
+
+    compressor_dict_size: int (optional)
+        Dictionary size of lzma, in MB. Default: None (makensis's default, 8 MB)
+
+    datablock_optimize: bool (optional)
+        Whether makensis stores identical files only once. Default: True
+
+    compression_goal: "size", "build" or "extract" (optional)
+        What the 'auto' compressor optimizes for: the smallest installer, the fastest compression
+        or the fastest extraction. Default: "size"
+
+    store_incompressible: "extension" or "sample" (optional)
+        Whether to store already compressed files, such as wheels, archives and images, without
+        compressing them again. "extension" recognizes them by their extension, and "sample" also
+        by compressing a sample of each large file. Has no effect with solid compression.
+        Default: None (compress all files)
+
+    payload_order: "walk", "extension", "name", "type" or callable (optional)
+        Order in which the files of the environment and include directories are written to the
+        installer. Grouping similar files improves solid compression, and "type" (text files
+        first, grouped by extension) usually compresses best.
+        See :data:`condansis.payload.ORDERINGS` to add orderings.
+        Default: None (directory by directory)
 
     makensis_exe: str or Path (optional)
         Call to the makensis.exe executable. Defaults to "makensis"
@@ -111,6 +193,73 @@ class Installer:
         Command to install conda environment. Two options are supported:
             "conda-env": uses conda-env, with support for conda YML files (default)
             "conda": uses conda, with support for conda-lock and requirements.txt files
+
+    env_cache: EnvCache, str or Path (optional)
+        Cache of built environments, or the directory of one. When the environment file,
+        conda_command, sitecustomize.py and platform, and the files of the root package if it is
+        installed, did not change since a previous build, the cached environment is reused
+        instead of solving a new one. In a git repository, the files of the root package are the
+        ones git tracks or does not ignore, and otherwise all files except installers, logs,
+        traces, hidden directories and build outputs.
+        See :func:`condansis.env_cache.package_digest`. Default: None (no caching)
+
+    pack_mode: "direct" or "tar" (optional)
+        How conda-pack stages the environment. Two options are supported:
+            "direct": writes the packed files straight into the working directory, hardlinking
+            them from the environment when both are in the same drive (default)
+            "tar": packs the environment into a tar file, which is then extracted
+
+    max_workers: int (optional)
+        Maximum number of build stages to run at the same time. Default: None (no limit)
+
+    copy_methods: list of "hardlink", "clone" or "copy" (optional)
+        Ways to copy the include files to the working directory, tried in order.
+        Default: ("hardlink", "clone", "copy")
+
+    report_copy_stats: bool (optional)
+        Whether to log how many files and bytes were copied with each method. Default: False
+
+    staging_dir: str or Path (optional)
+        Persistent working directory. When set, rebuilds only copy the files which changed since the
+        previous build and delete the ones which no longer exist. Default: None (use a temporary directory)
+
+    trace: BuildTrace (optional)
+        Records the wall time, CPU time, files and bytes of each build stage and subprocess.
+        Default: None (no tracing)
+
+    prune: list of str or PruneRule (optional)
+        Rules selecting files to remove from the packed environment, such as debug symbols and
+        test suites. Accepts globs, regular expressions and the presets "strip-debug",
+        "strip-tests", "strip-headers", "strip-docs" and "strip-pycache".
+        See :class:`condansis.pruning.Pruner`. Default: None (keep all files)
+
+    precompile: bool (optional)
+        Whether to byte-compile the Python files, so that the first launch of the app does not
+        have to. The include directories are compiled when building the installer, and the
+        environment when installing, after it is relocated. Default: False
+
+    precompile_invalidation_mode: "timestamp", "checked-hash" or "unchecked-hash" (optional)
+        How Python checks that the compiled files are up to date.
+        `See here for more information <https://docs.python.org/3/library/py_compile.html#py_compile.PycInvalidationMode>`_
+        Default: "timestamp"
+
+    precompile_optimize: 0, 1 or 2 (optional)
+        Optimization level of the compiled files. Levels 1 and 2 are only used when running
+        Python with -O or -OO. Default: 0
+
+    dedup: bool (optional)
+        Whether to ship only one copy of byte-identical files in the environment and include
+        directories. The installer restores the duplicates before relocating the environment.
+        Default: False
+
+    dedup_restore: "hardlink" or "copy" (optional)
+        How the installer restores the duplicates. Hardlinks fall back to copies where the file
+        system does not support them. Default: "hardlink"
+
+    drop_noop_records: bool (optional)
+        Whether to check the prefix records against the packed files with the relocation rules of
+        Windows, and drop the records which would leave their file unchanged, such as most binary
+        files, so that the installer does not read these files. Default: False
     """
 
     def __init__(
@@ -131,9 +280,35 @@ class Installer:
         clean_instdir: bool = False,
         register_uninstaller: bool = True,
         compressor: str = "lzma",
+        solid_compression: bool = False,
+        compressor_dict_size: int = None,
+        datablock_optimize: bool = True,
+        compression_goal: str = "size",
+        store_incompressible: str = None,
+        payload_order: Union[
+            str, Callable[[List["PayloadFile"], Path], List["PayloadFile"]]
+        ] = None,
         makensis_exe: Union[str, Path] = "makensis",
-        conda_command: str = "conda-env"
+        conda_command: str = "conda-env",
+        env_cache: Union[EnvCache, str, Path] = None,
+        pack_mode: str = "direct",
+        max_workers: int = None,
+        copy_methods: Sequence[str] = None,
+        report_copy_stats: bool = False,
+        staging_dir: Union[str, Path] = None,
+        trace: BuildTrace = None,
+        prune: Sequence[Union[str, "PruneRule"]] = None,
+        precompile: bool = False,
+        precompile_invalidation_mode: str = "timestamp",
+        precompile_optimize: int = 0,
+        dedup: bool = False,
+        dedup_restore: str = "hardlink",
+        drop_noop_records: bool = False,
     ) -> None:
+        from .compression import GOALS, CompressionSettings
+        from .copier import COPY_METHODS, CopyEngine
+        from .dedup import RESTORE_MODES
+        from .payload import ORDERINGS, STORE_MODES
 
         self.package_name = package_name
         self.package_version = package_version
@@ -183,18 +358,99 @@ class Installer:
         else:
             self.nsis_template = nsis_template
 
-        if compressor not in ["zlib", "bzip2", "lzma"]:
-            raise ValueError(f"compressor must be 'zlib', 'bzip2' or 'lzma'. Got: {compressor}")
+        if compressor not in ["zlib", "bzip2", "lzma", "auto"]:
+            raise ValueError(
+                f"compressor must be 'zlib', 'bzip2', 'lzma' or 'auto'. Got: {compressor}"
+            )
+
+        if compression_goal not in GOALS:
+            raise ValueError(
+                f"compression_goal must be 'size', 'build' or 'extract'. Got: {compression_goal}"
+            )
+
+        if store_incompressible is not None and store_incompressible not in STORE_MODES:
+            raise ValueError(
+                "store_incompressible must be 'extension' or 'sample'. "
+                f"Got: {store_incompressible}"
+            )
+
+        if payload_order is not None and not callable(payload_order):
+            if payload_order not in ORDERINGS:
+                raise ValueError(
+                    f"payload_order must be one of {', '.join(sorted(ORDERINGS))}, "
+                    f"or a function. Got: {payload_order}"
+                )
+
+        if compressor == "auto":
+            self._compression = None
+        else:
+            self._compression = CompressionSettings(
+                compressor, solid_compression, compressor_dict_size, datablock_optimize
+            )
 
         if conda_command not in ["conda", "conda-env"]:
             raise ValueError(f"conda_command must be 'conda' or 'conda-env'. Got: {conda_command}")
 
+        if pack_mode not in ["direct", "tar"]:
+            raise ValueError(f"pack_mode must be 'direct' or 'tar'. Got: {pack_mode}")
+
+        if precompile_invalidation_mode not in ["timestamp", "checked-hash", "unchecked-hash"]:
+            raise ValueError(
+                "precompile_invalidation_mode must be 'timestamp', 'checked-hash' or "
+                f"'unchecked-hash'. Got: {precompile_invalidation_mode}"
+            )
+
+        if precompile_optimize not in [0, 1, 2]:
+            raise ValueError(f"precompile_optimize must be 0, 1 or 2. Got: {precompile_optimize}")
+
+        if dedup_restore not in RESTORE_MODES:
+            raise ValueError(f"dedup_restore must be 'hardlink' or 'copy'. Got: {dedup_restore}")
+
         self.compressor = compressor
+        self.solid_compression = solid_compression
+        self.compressor_dict_size = compressor_dict_size
+        self.datablock_optimize = datablock_optimize
+        self.compression_goal = compression_goal
+        self.compression_results: List["CompressionResult"] = []
+        self.store_incompressible = store_incompressible
+        self.payload_order = payload_order
+        # explicit listing of the payload in the NSIS script, None to add whole directories
+        self.payload: Optional["Payload"] = None
         self.install_root_package = install_root_package
         self._conda_command = conda_command
+        self.pack_mode = pack_mode
+        self.max_workers = max_workers
+        if copy_methods is None:
+            copy_methods = COPY_METHODS
+        # validates the methods
+        CopyEngine(copy_methods)
+        self.copy_methods = copy_methods
+        self.report_copy_stats = report_copy_stats
+        self.staging_dir = None if staging_dir is None else Path(staging_dir).resolve()
+        self.trace = trace
+        # runs the subprocesses on an event loop during create_async
+        self._runner: Optional["AsyncRunner"] = None
+        self.prune = prune
+        if prune:
+            from .pruning import Pruner
+
+            self._pruner = Pruner(prune)
+        else:
+            self._pruner = None
+        self.precompile = precompile
+        self.precompile_invalidation_mode = precompile_invalidation_mode
+        self.precompile_optimize = precompile_optimize
+        self.dedup = dedup
+        self.dedup_restore = dedup_restore
+        self.drop_noop_records = drop_noop_records
 
         self.makensis_exe = makensis_exe
 
+        if env_cache is None or isinstance(env_cache, EnvCache):
+            self.env_cache = env_cache
+        else:
+            self.env_cache = EnvCache(env_cache)
+
         self.clean_instdir = clean_instdir
         self.register_uninstaller = register_uninstaller
 
@@ -218,6 +474,84 @@ class Installer:
     def shortcuts(self) -> List[_shortcut]:
         return self._shortcuts
 
+    @property
+    def compression(self) -> "CompressionSettings":
+        """ Compression settings of makensis. With the 'auto' compressor, the ones chosen by
+        :meth:`choose_compression`
+        """
+        if self._compression is None:
+            raise ValueError("The compression settings were not chosen yet, see choose_compression")
+        return self._compression
+
+    @property
+    def compileall_options(self) -> str:
+        """ Options of :code:`python -m compileall` when byte-compiling at install time """
+        return " ".join(self._compileall_options(workers=0))
+
+    def _compileall_options(self, workers: int) -> List[str]:
+        options = ["-q", "-j", str(workers)]
+        options += ["--invalidation-mode", self.precompile_invalidation_mode]
+        if self.precompile_optimize:
+            # -o is only supported from Python 3.9
+            options += ["-o", str(self.precompile_optimize)]
+        return options
+
+    def build_outputs(self) -> List[Path]:
+        """ Files and directories written by the build, which are not part of the root package """
+        outputs = [Path(self.installer_name)]
+        if self.staging_dir is not None:
+            outputs.append(self.staging_dir)
+        if self.env_cache is not None:
+            outputs.append(self.env_cache.cache_dir)
+        return outputs
+
+    def env_cache_key(self, root_digest: str = None) -> str:
+        """ Key of the environment in the environment cache
+
+        Parameters
+        -----------
+        root_digest: str (optional)
+            Digest of the root package, see :func:`condansis.env_cache.package_digest`, when it
+            is computed once for several installers. Default: None (compute it)
+
+        Returns
+        --------
+        key: str
+            Digest of the environment file, conda_command, sitecustomize.py and platform, and
+            of the files of the root package when it is installed
+        """
+        extra = ""
+        if self.install_root_package:
+            # pip installs the root package together with its dependencies into the environment
+            if root_digest is None:
+                root_digest = package_digest(self.package_root, self.build_outputs())
+            extra = f"{self.package_root}\n{root_digest}"
+        return EnvCache.compute_key(self.env_file, self._conda_command, SITECUSTOMIZE, extra)
+
+    def pack_key(self, env_key: str = None) -> str:
+        """ Key of the packed environment
+
+        Installers with the same key can share the packed environment, see
+        :class:`condansis.batch.InstallerBatch`
+
+        Parameters
+        -----------
+        env_key: str (optional)
+            Key of the environment, from :meth:`env_cache_key`. Default: None (compute it)
+
+        Returns
+        --------
+        key: str
+            Digest of the environment key, the prune rules and drop_noop_records
+        """
+        if env_key is None:
+            env_key = self.env_cache_key()
+        rules = [] if self._pruner is None else self._pruner.rules
+        digest = hashlib.sha256(env_key.encode())
+        digest.update(repr((rules, self.drop_noop_records)).encode())
+        return digest.hexdigest()
+
+    @traced(lambda self, result, env_prefix, *args, **kwargs: path_usage(env_prefix))
     def create_temp_env(self, env_prefix: Path) -> None:
         """ Creates a temporary environment
         
@@ -228,15 +562,11 @@ class Installer:
         """
         # Create a temporary environment in a temp folder
         if self._conda_command == "conda-env":
-            subprocess.run(
-                [CONDA_EXE, "env", "create", "-p", env_prefix, "-f", self.env_file, "--force"],
-                check=True,
+            self._run(
+                [find_conda_exe(), "env", "create", "-p", env_prefix, "-f", self.env_file, "--force"]
             )
         elif self._conda_command == "conda":
-            subprocess.run(
-                [CONDA_EXE, "create", "-p", env_prefix, "--file", self.env_file],
-                check=True,
-            )
+            self._run([find_conda_exe(), "create", "-p", env_prefix, "--file", self.env_file])
         else:
             raise ValueError(f"Invalid value for conda_command: {self.conda_command}")
 
@@ -245,7 +575,7 @@ class Installer:
 
         if self.install_root_package:
             # run pip install on the root package directory
-            subprocess.run(
+            self._run(
                 [
                     str(env_prefix / "python.exe"),
                     "-m",
@@ -253,14 +583,49 @@ class Installer:
                     "install",
                     str(self.package_root),
                     "--no-warn-script-location",
-                ],
-                check=True,
+                ]
             )
 
+    @traced(lambda self, result, *args, **kwargs: path_usage(result))
+    def create_cached_env(self, key: str = None) -> Path:
+        """ Creates the environment in the environment cache, or reuses a cached one
+
+        Parameters
+        -----------
+        key: str (optional)
+            Key of the environment, from :meth:`env_cache_key`. Default: None (compute it)
+
+        Returns
+        --------
+        env_prefix: Path
+            Directory with the conda environment
+        """
+        if key is None:
+            key = self.env_cache_key()
+        env_prefix = self.env_cache.lookup(key)
+        if env_prefix is not None:
+            # entries are never modified, the key covers everything installed in them
+            logging.info(f"Reusing cached environment {key[:12]}")
+            return env_prefix
+        env_prefix = self.env_cache.prefix(key)
+        try:
+            self.create_temp_env(env_prefix)
+        except BaseException:
+            self.env_cache.discard(key)
+            raise
+        self.env_cache.store(key)
+        return env_prefix
+
+    @traced(_packed_env_usage)
     def pack_temp_env(
-        self, work_dir: Path, env_prefix: Path, ignore_missing_files: bool = True
+        self,
+        work_dir: Path,
+        env_prefix: Path,
+        ignore_missing_files: bool = True,
+        remove_env: bool = True,
+        staging: "StagingDir" = None,
     ) -> None:
-        """ Runs conda-pack to create the packaged environment and unpack it in the working directory
+        """ Runs conda-pack to create the packaged environment in the working directory
 
         Parameters
         -----------
@@ -273,59 +638,129 @@ class Installer:
         ignore_missing_files: bool
             Ignore that files are missing that should be present in the conda environment as specified by the conda metadata.
             Default: True
+
+        remove_env: bool
+            Remove the environment after packing it. Default: True
+
+        staging: StagingDir (optional)
+            Persistent working directory. Only updates the files which changed since the previous build.
+            Default: None
         """
+        from .prefix_records import RECORDS_FILE_NAME, read_script_records, write_records_file
+
         logging.info("Running conda-pack")
+        if staging is None:
+            pack_dir = work_dir
+        else:
+            pack_dir = work_dir / PACK_DIR_NAME
+            shutil.rmtree(pack_dir, ignore_errors=True)
+            pack_dir.mkdir()
         packed_env = env_prefix.with_suffix(".tar")
         try:
+            import conda_pack
+
             conda_env = conda_pack.CondaEnv.from_prefix(
                 env_prefix, ignore_missing_files=ignore_missing_files
             )
-            conda_env.pack(str(packed_env))
-        finally:
-            self.remove_temp_env(env_prefix)
-        try:
-            shutil.unpack_archive(
-                packed_env, work_dir / self.env_name,
-            )
+            if self.pack_mode == "direct":
+                # Files are hardlinked from the environment where possible,
+                # so they must never be modified in place in the working directory
+                conda_env.pack(output=str(pack_dir / self.env_name), format="no-archive")
+            else:
+                conda_env.pack(str(packed_env))
         finally:
-            packed_env.unlink()
+            if remove_env:
+                self.remove_temp_env(env_prefix)
+        if self.pack_mode == "tar":
+            try:
+                shutil.unpack_archive(
+                    packed_env, pack_dir / self.env_name,
+                )
+            finally:
+                packed_env.unlink()
 
         # this should be removed once the PR https://github.com/conda/conda-pack/pull/190 is merged
         # Create the unpack script
-        with open(CONDANSIS_UNPACK, "r") as f:
-            condansis_unpack = f.read()
-        with open(work_dir / self.env_name / "Scripts" / "conda-unpack-script.py", "r") as f:
-            conda_unpack = f.read()
-
-        # edit file
-        _prefix_record_starts = conda_unpack.find("_prefix_records")
-        if _prefix_record_starts == -1:
-            raise IOError("Invalid conda-pack-script.py")
-        condansis_unpack += "\n\n" + conda_unpack[_prefix_record_starts:]
-
-        # write out
-        with open(work_dir / self.env_name / "Scripts" / "condansis-unpack.py", "w") as f:
-            f.write(condansis_unpack)
-
-    def remove_temp_env(self, env_prefix: Path) -> None:
+        scripts_dir = pack_dir / self.env_name / "Scripts"
+        conda_unpack_script = scripts_dir / "conda-unpack-script.py"
+        # the records go to a compact file, which loads faster than the list in conda-pack's script
+        write_records_file(
+            scripts_dir / RECORDS_FILE_NAME, read_script_records(conda_unpack_script)
+        )
+        shutil.copyfile(CONDANSIS_UNPACK, scripts_dir / "condansis-unpack.py")
+
+        if self._pruner is not None:
+            self.prune_env(pack_dir / self.env_name)
+        if self.drop_noop_records:
+            self.check_prefix_records(pack_dir / self.env_name)
+
+        if staging is not None:
+            try:
+                staging.sync_tree(pack_dir / self.env_name, self.env_name)
+            finally:
+                shutil.rmtree(pack_dir, ignore_errors=True)
+
+    @traced()
+    def prune_env(self, env_dir: Path) -> "PruneStats":
+        """ Removes the files selected by the prune rules from the packed environment
+
+        Parameters
+        -----------
+        env_dir: Path
+            Directory with the packed environment
+
+        Returns
+        --------
+        stats: PruneStats
+            Number of files, bytes and prefix records removed
+        """
+        if self._pruner is None:
+            from .pruning import PruneStats
+
+            return PruneStats()
+        return self._pruner.prune(env_dir)
+
+    @traced(lambda self, stats, *args, **kwargs: (stats.files, stats.bytes))
+    def check_prefix_records(self, env_dir: Path) -> "RecordCheckStats":
+        """ Drops the prefix records which would not change their file when installing
+
+        Parameters
+        -----------
+        env_dir: Path
+            Directory with the packed environment
+
+        Returns
+        --------
+        stats: RecordCheckStats
+            Number of records dropped, and of files and bytes no longer read when installing
+        """
+        from .record_check import drop_noop_records
+
+        return drop_noop_records(env_dir, max_workers=self.max_workers)
+
+    @traced()
+    def remove_temp_env(self, env_prefix: Path, wait: bool = False) -> None:
         """ Removes the temporary environment
 
+        The directory is renamed aside at once and deleted in a background thread, retrying
+        while files are locked. Directories left behind if the process exits first are removed
+        by :func:`condansis.teardown.clean_abandoned` in a later build
+
         Parameters
         ------------
         env_prefix: Path
             Directory with the conda environment
-        
 
-        Warnings
-        ----------
-        Often times this function fails to remove some dlls. Investigate further
+        wait: bool (optional)
+            Whether to wait for the directory to be deleted. Default: False
         """
+        from .teardown import discard
+
         logging.info("Cleaning temporary env")
-        subprocess.run(
-            [CONDA_EXE, "env", "remove", "-y", "-p", env_prefix], check=True,
-        )
+        discard(env_prefix, wait=wait)
 
-    def create_app_dir(self, work_dir: Path) -> None:
+    @traced(_copy_usage)
+    def create_app_dir(self, work_dir: Path, staging: "StagingDir" = None) -> "CopyStats":
         """ Copies all include_files to the working directory
 
         Parameters
@@ -333,7 +768,18 @@ class Installer:
         work_dir: Path
             Working directory to create installer 
 
+        staging: StagingDir (optional)
+            Persistent working directory. Only copies the files which changed since the previous build.
+            Default: None
+
+        Returns
+        --------
+        stats: CopyStats
+            Number of files and bytes copied with each method
         """
+        from .copier import CopyEngine
+
+        engine = CopyEngine(self.copy_methods)
         if self.icon is None:
             include_files = self.include
         else:
@@ -341,14 +787,239 @@ class Installer:
         for file in include_files:
             source = self.package_root / file
             destination = work_dir / file
-            if source.is_dir():
-                shutil.copytree(source, destination, dirs_exist_ok=True)
+            if source.is_dir() and staging is not None:
+                staging.sync_tree(source, file)
+            elif source.is_file() and staging is not None:
+                staging.sync_file(source, file)
+            elif source.is_dir():
+                engine.copy_tree(source, destination)
             elif source.is_file():
                 destination.parent.mkdir(exist_ok=True)
-                shutil.copy2(source, destination)
+                engine.copy_file(source, destination)
             else:
                 raise IOError(f"Coud not find {source}")
+        if staging is not None:
+            engine = staging.engine
+        if self.report_copy_stats:
+            logging.info(f"Copied include files - {engine.stats.report()}")
+        return engine.stats
+
+    @traced()
+    def precompile_include_dirs(self, work_dir: Path, staging: "StagingDir" = None) -> float:
+        """ Byte-compiles the include directories in the working directory
+
+        Uses the Python of the packed environment, so that the compiled files match the Python
+        version which runs them
+
+        Parameters
+        -----------
+        work_dir: Path
+            Working directory to create installer
+
+        staging: StagingDir (optional)
+            Persistent working directory, where the compiled files are recorded, so that the ones
+            of removed modules are deleted. Default: None
+
+        Returns
+        --------
+        compile_time: float
+            Time taken, in seconds
+        """
+        directories = [str(work_dir / dir_name) for dir_name in self.include_dirs]
+        if not directories:
+            return 0.0
+        python = work_dir / self.env_name / "python.exe"
+        if not python.is_file():
+            logging.warning(
+                f"Could not find the environment's Python, byte-compiling with {sys.executable}"
+            )
+            python = sys.executable
+        workers = self.max_workers or 0
+        start = time.perf_counter()
+        try:
+            self._run(
+                [str(python), "-m", "compileall"]
+                + self._compileall_options(workers)
+                + directories
+            )
+        except subprocess.CalledProcessError:
+            # compileall already reported the files that could not be compiled
+            logging.warning("Some include files could not be byte-compiled")
+        if staging is not None:
+            for directory in directories:
+                for root, _, file_names in os.walk(directory):
+                    if os.path.basename(root) != "__pycache__":
+                        continue
+                    for name in file_names:
+                        # __pycache__/module.cpython-310.pyc is compiled from module.py
+                        source = Path(root).parent / (name.split(".")[0] + ".py")
+                        staging.add_derived(
+                            Path(root, name).relative_to(work_dir), source.relative_to(work_dir)
+                        )
+        compile_time = time.perf_counter() - start
+        logging.info(f"Byte-compiled include directories in {compile_time:.1f} s")
+        return compile_time
+
+    @traced(lambda self, stats, *args, **kwargs: (stats.files, stats.bytes))
+    def dedup_payload(self, work_dir: Path, staging: "StagingDir" = None) -> "DedupStats":
+        """ Removes byte-identical copies of files from the environment and include directories
+
+        The removed files are listed in Scripts/condansis-dedup.json in the environment, and
+        restored by Scripts/condansis-dedup.py when installing.
+        Files relocated by condansis-unpack.py are left untouched, and so are the files Python
+        needs to start
+
+        Parameters
+        -----------
+        work_dir: Path
+            Working directory to create installer
+
+        staging: StagingDir (optional)
+            Persistent working directory, whose manifest has the hashes of the staged files.
+            Default: None
+
+        Returns
+        --------
+        stats: DedupStats
+            Number of files and bytes removed
+        """
+        from .dedup import (
+            DEDUP_MANIFEST_NAME,
+            RESTORE_SCRIPT,
+            find_duplicates,
+            needed_at_startup,
+            remove_duplicates,
+        )
+        from .prefix_records import read_prefix_records, record_path
+
+        scripts_dir = work_dir / self.env_name / "Scripts"
+        skip = {
+            f"{self.env_name}/{record_path(record)}"
+            for record in read_prefix_records(scripts_dir / "condansis-unpack.py")
+        }
+        env_prefix = f"{self.env_name}/"
+
+        def keep(path):
+            return path.startswith(env_prefix) and needed_at_startup(path[len(env_prefix) :])
+
+        hashes = None
+        if staging is not None:
+            hashes = {
+                key: record["hash"] for key, record in staging.manifest.items() if "hash" in record
+            }
+        directories = [self.env_name] + [dir_name.as_posix() for dir_name in self.include_dirs]
+        duplicates = find_duplicates(
+            work_dir, directories, skip, keep, max_workers=self.max_workers, hashes=hashes
+        )
+        # NSIS fails on include directories without files, so one file is left in each
+        for dir_name in self.include_dirs:
+            files = [
+                Path(root, name)
+                for root, _, file_names in os.walk(work_dir / dir_name)
+                for name in file_names
+            ]
+            keys = [path.relative_to(work_dir).as_posix() for path in files]
+            if keys and all(key in duplicates for key in keys):
+                del duplicates[min(keys)]
+
+        shutil.copy(RESTORE_SCRIPT, scripts_dir / "condansis-dedup.py")
+        return remove_duplicates(
+            work_dir, duplicates, scripts_dir / DEDUP_MANIFEST_NAME, self.dedup_restore
+        )
+
+    @traced()
+    def choose_compression(self, work_dir: Path) -> "CompressionResult":
+        """ Compresses a sample of the payload with each candidate setting, and picks the best one
+        for compression_goal
+
+        Parameters
+        -----------
+        work_dir: Path
+            Working directory to create installer
+
+        Returns
+        --------
+        result: CompressionResult
+            Benchmark result of the chosen settings
+        """
+        from .compression import CANDIDATES, benchmark, choose, format_results, sample_payload
+
+        paths = [self.env_name] + list(self.include)
+        sample = sample_payload(work_dir, paths)
+        # the benchmark does not depend on datablock optimization, which is the user's choice
+        candidates = [
+            replace(settings, datablock_optimize=self.datablock_optimize) for settings in CANDIDATES
+        ]
+        self.compression_results = benchmark(sample, candidates, self.max_workers)
+        chosen = choose(self.compression_results, self.compression_goal)
+        self._compression = chosen.settings
+        logging.info(
+            f"Chose compression {chosen.settings} for goal '{self.compression_goal}' "
+            f"from {len(sample)} sample files:\n"
+            + format_results(self.compression_results, chosen)
+        )
+        if self.trace is not None:
+            self.trace.annotate(
+                "compression",
+                {
+                    "goal": self.compression_goal,
+                    "chosen": str(chosen.settings),
+                    "results": [
+                        {
+                            "settings": str(result.settings),
+                            "sample_bytes": result.sample_bytes,
+                            "compressed_bytes": result.compressed_bytes,
+                            "compress_time": result.compress_time,
+                            "extract_time": result.extract_time,
+                        }
+                        for result in self.compression_results
+                    ],
+                },
+            )
+        return chosen
+
+    @traced()
+    def plan_payload(self, work_dir: Path) -> "Payload":
+        """ Lists the files of the environment and include directories for the NSIS script,
+        separating the files to store without compression and sorting them by payload_order
 
+        Parameters
+        -----------
+        work_dir: Path
+            Working directory to create installer
+
+        Returns
+        --------
+        payload: Payload
+            The files, in the order they are written to the installer
+        """
+        from .payload import Payload
+
+        directories = [self.env_name] + [dir_name.as_posix() for dir_name in self.include_dirs]
+        payload = Payload.from_work_dir(work_dir, directories)
+        if self.store_incompressible is not None:
+            if self.compression.solid:
+                logging.warning("Files cannot be stored uncompressed with solid compression")
+            else:
+                payload.classify(self.store_incompressible, self.max_workers)
+                stats = payload.store_stats(self.compression)
+                self._report_store_stats(stats)
+        if self.payload_order is not None:
+            payload.order(self.payload_order)
+        self.payload = payload
+        return payload
+
+    def _report_store_stats(self, stats: "StoreStats") -> None:
+        change = "larger" if stats.size_change >= 0 else "smaller"
+        logging.info(
+            f"Storing {stats.files} files ({stats.bytes / 1024 ** 2:.1f} MB) uncompressed - "
+            f"about {stats.time_saved:.1f} s less compression, "
+            f"installer about {abs(stats.size_change) / 1024 ** 2:.1f} MB {change}"
+        )
+        if self.trace is not None:
+            self.trace.annotate("stored_files", asdict(stats))
+
+    @traced(lambda self, result, *args, **kwargs: path_usage(result))
     def create_nsis_script(self, work_dir: Path) -> Path:
         """ Creates the NSIS script based on the template
 
@@ -364,11 +1035,14 @@ class Installer:
         """
         script_name = work_dir / "installer.nsi"
         with open(self.nsis_template, "r") as f:
+            from jinja2 import Template
+
             install_script = Template(f.read()).render(installer=self)
         with open(script_name, "w") as f:
             f.write(install_script)
         return script_name
 
+    @traced(lambda self, result, *args, **kwargs: path_usage(self.installer_name))
     def run_nsis(self, script_name: Path) -> None:
         """ Runs makensis to create the installer
 
@@ -378,25 +1052,188 @@ class Installer:
             Path to processed NSIS script
         """
         logging.info("Running makensis")
-        subprocess.run(
-            [str(self.makensis_exe), str(script_name)], check=True,
-        )
+        self._run([str(self.makensis_exe), str(script_name)])
+
+    def _run(self, args: list) -> None:
+        # Runs a subprocess, timing it if the build is traced
+        run = self._runner.run if self._runner is not None else self._run_blocking
+        if self.trace is None:
+            run(args)
+            return
+        command = [str(arg) for arg in args]
+        with self.trace.span(os.path.basename(command[0]), "subprocess", command=command):
+            run(args)
+
+    @staticmethod
+    def _run_blocking(args: list) -> None:
+        subprocess.run(args, check=True)
 
     def create(self) -> None:
-        """ Creates the installer """
-        with tempfile.TemporaryDirectory() as work_dir:
-            work_dir_path = Path(work_dir)
-            env_dir = Path(tempfile.mkdtemp())
-            env_prefix = env_dir / self.env_name
-            self.create_temp_env(env_prefix)
-            self.pack_temp_env(work_dir_path, env_prefix)
-            shutil.rmtree(env_dir, ignore_errors=True)
-            if env_dir.is_dir():
-                logging.warning(f"Could not remove temporary directory: {env_dir}")
-            self.create_app_dir(work_dir_path)
-            nsis_script = self.create_nsis_script(work_dir_path)
-            self.run_nsis(nsis_script)
-            logging.info(f"Installer created at {self.installer_name}")
+        """ Creates the installer
+
+        Build stages which do not depend on each other run concurrently.
+        If a stage fails, the temporary environment and any partially written installer are removed.
+        Temporary directories are removed in the background while the build goes on, and are
+        all gone when this returns
+        """
+        from .teardown import wait_for_removals
+
+        try:
+            with self._work_dir() as work_dir_path:
+                staging = self._staging(work_dir_path)
+                scheduler = StageScheduler(self.max_workers)
+                self._add_env_stages(scheduler, work_dir_path, staging)
+                self._add_payload_stages(scheduler, work_dir_path, staging, after=["pack"])
+                self._run_stages(scheduler, staging)
+                logging.info(f"Installer created at {self.installer_name}")
+        finally:
+            # the removal threads are daemons, which would be killed when the interpreter exits
+            wait_for_removals()
+
+    async def create_async(self, log_sink: "LogSink" = None) -> None:
+        """ Creates the installer without blocking the event loop
+
+        conda, pip and makensis run as asyncio subprocesses. Their output is streamed line by
+        line to ``log_sink`` as :class:`condansis.async_runner.LogEvent`, tagged with the build
+        stage. Cancelling the task kills the running subprocesses and their children, then
+        cleans up like a failed build
+
+        Parameters
+        -----------
+        log_sink: callable (optional)
+            Called with each line of output of the subprocesses. See
+            :class:`condansis.async_runner.JsonLinesSink`. Default: log with the logging module
+        """
+        import asyncio
+        from .async_runner import AsyncRunner
+
+        if self._runner is not None:
+            raise RuntimeError("The installer is already being created")
+        loop = asyncio.get_running_loop()
+        self._runner = AsyncRunner(loop, log_sink, self.package_name)
+        try:
+            future = loop.run_in_executor(None, self.create)
+            try:
+                await asyncio.shield(future)
+            except asyncio.CancelledError:
+                self._runner.cancel()
+                # wait for the stages to stop and clean up
+                try:
+                    await future
+                except BaseException:
+                    pass
+                raise
+        finally:
+            self._runner = None
+
+    def _add_env_stages(
+        self, scheduler: StageScheduler, work_dir: Path, staging: Optional["StagingDir"]
+    ) -> None:
+        # Adds the "env", "pack" and "remove_env" stages
+        from .teardown import clean_abandoned, discard, make_temp_env_dir
+
+        results = scheduler.results
+        if self.env_cache is None:
+            # environments of builds which crashed
+            clean_abandoned()
+            env_dir = make_temp_env_dir()
+
+            def create_env():
+                env_prefix = env_dir / self.env_name
+                self.create_temp_env(env_prefix)
+                return env_prefix
+
+            def remove_env():
+                # the temporary directory only holds the environment
+                self.remove_temp_env(env_dir)
+
+            scheduler.add("env", create_env, cleanup=lambda: discard(env_dir))
+        else:
+            scheduler.add("env", self.create_cached_env)
+        scheduler.add(
+            "pack",
+            lambda: self.pack_temp_env(work_dir, results["env"], remove_env=False, staging=staging),
+            after=["env"],
+        )
+        if self.env_cache is None:
+            scheduler.add("remove_env", remove_env, after=["pack"])
+
+    def _add_payload_stages(
+        self,
+        scheduler: StageScheduler,
+        work_dir: Path,
+        staging: Optional["StagingDir"],
+        after: Sequence[str],
+    ) -> None:
+        # Adds the stages which complete the working directory and run makensis,
+        # once the stages in "after" staged the environment
+        results = scheduler.results
+        scheduler.add("app_dir", lambda: self.create_app_dir(work_dir, staging))
+        staged = list(after) + ["app_dir"]
+        if self.precompile:
+            scheduler.add(
+                "precompile",
+                lambda: self.precompile_include_dirs(work_dir, staging),
+                after=staged,
+            )
+            staged = ["precompile"]
+        if staging is not None:
+            scheduler.add("staging", staging.finish, after=staged)
+            staged = ["staging"]
+        if self.dedup:
+            scheduler.add("dedup", lambda: self.dedup_payload(work_dir, staging), after=staged)
+            staged = ["dedup"]
+        # stages the NSIS script depends on
+        script_after = []
+        if self.compressor == "auto":
+            scheduler.add(
+                "compression", lambda: self.choose_compression(work_dir), after=staged
+            )
+            script_after = ["compression"]
+        if self.store_incompressible is not None or self.payload_order is not None:
+            scheduler.add(
+                "payload", lambda: self.plan_payload(work_dir), after=script_after or staged
+            )
+            script_after = ["payload"]
+        scheduler.add(
+            "nsis_script", lambda: self.create_nsis_script(work_dir), after=script_after
+        )
+        scheduler.add(
+            "nsis",
+            lambda: self.run_nsis(results["nsis_script"]),
+            after=staged + ["nsis_script"],
+            cleanup=self._remove_installer,
+        )
+
+    def _run_stages(self, scheduler: StageScheduler, staging: Optional["StagingDir"]) -> None:
+        try:
+            scheduler.run()
+        finally:
+            if staging is not None:
+                # keep track of what was copied even if the build failed
+                staging.save()
+
+    def _staging(self, work_dir: Path) -> Optional["StagingDir"]:
+        if self.staging_dir is None:
+            return None
+        from .staging import StagingDir
+
+        return StagingDir(work_dir, self.copy_methods)
+
+    @contextlib.contextmanager
+    def _work_dir(self) -> Iterator[Path]:
+        if self.staging_dir is None:
+            with tempfile.TemporaryDirectory() as work_dir:
+                yield Path(work_dir)
+        else:
+            self.staging_dir.mkdir(parents=True, exist_ok=True)
+            yield self.staging_dir
+
+    def _remove_installer(self) -> None:
+        try:
+            os.remove(self.installer_name)
+        except FileNotFoundError:
+            pass
 
     def add_shortcut(
         self,
@@ -0,0 +1,332 @@
+""" Explicit listing of the files in the installer payload """
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+from pathlib import Path, PureWindowsPath
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from .compression import CompressionSettings
+
+# Formats which are already compressed
+STORED_EXTENSIONS = frozenset(
+    (
+        ".whl .zip .egg .jar .npz .gz .tgz .bz2 .xz .lzma .7z .zst "
+        ".png .jpg .jpeg .gif .webp .mp3 .mp4 .ogg .woff .woff2 .chm"
+    ).split()
+)
+STORE_MODES = ("extension", "sample")
+# Files smaller than this are always compressed, testing them costs more than it saves
+MIN_SAMPLED_SIZE = 64 * 1024
+SAMPLE_CHUNK = 16 * 1024
+# Files which do not get below this fraction of their size in the sample are stored
+STORE_RATIO = 0.9
+# Bytes of the stored files compressed to estimate the effect of storing them
+ESTIMATE_BYTES = 8 * 1024 ** 2
+# Formats which are text. Files with other extensions are checked for null bytes
+TEXT_EXTENSIONS = frozenset(
+    (
+        ".py .pyi .pyx .pxd .txt .json .h .hpp .c .cpp .cfg .ini .toml .yml .yaml .md .rst "
+        ".html .css .js .xml .csv .pth .bat .sh .ps1 .tcl .tk .pl .pc .cmake .sql .svg .typed"
+    ).split()
+)
+
+
+@dataclass
+class PayloadFile:
+    """ A file of the payload
+
+    Parameters
+    ------------
+    path: str
+        Path relative to the working directory and the install directory, with forward slashes
+
+    size: int
+        Size in bytes
+
+    stored: bool
+        Whether the file is stored without compression
+    """
+
+    path: str
+    size: int
+    stored: bool = False
+
+
+@dataclass
+class PayloadBlock:
+    """ Consecutive files of the payload with the same compression
+
+    Parameters
+    ------------
+    stored: bool
+        Whether the files are stored without compression
+
+    runs: list of (str, list of str)
+        Output directories, relative to the install directory, with the files written to them,
+        relative to the working directory. Windows paths
+    """
+
+    stored: bool
+    runs: List[Tuple[str, List[str]]] = field(default_factory=list)
+
+
+@dataclass
+class StoreStats:
+    """ Files stored without compression, and the estimated effect of storing them
+
+    Parameters
+    ------------
+    files: int
+        Number of stored files
+
+    bytes: int
+        Size of the stored files
+
+    time_saved: float
+        Estimated CPU time makensis saves, in seconds
+
+    size_change: int
+        Estimated change of the installer size, in bytes. Usually slightly positive
+    """
+
+    files: int = 0
+    bytes: int = 0
+    time_saved: float = 0.0
+    size_change: int = 0
+
+
+def _sample(path: Union[str, Path], size: int) -> bytes:
+    # chunks from the start, middle and end of the file
+    with open(path, "rb") as f:
+        if size <= 3 * SAMPLE_CHUNK:
+            return f.read()
+        chunks = []
+        for offset in (0, size // 2, max(size - SAMPLE_CHUNK, 0)):
+            f.seek(offset)
+            chunks.append(f.read(SAMPLE_CHUNK))
+    return b"".join(chunks)
+
+
+def is_incompressible(path: Union[str, Path], size: int = None) -> bool:
+    """ Whether a file is not worth compressing, judging from a quick compression of a sample
+
+    Parameters
+    -----------
+    path: str or Path
+        The file
+
+    size: int (optional)
+        Size of the file. Default: read from the file system
+    """
+    if size is None:
+        size = os.stat(path).st_size
+    if size < MIN_SAMPLED_SIZE:
+        return False
+    sample = _sample(path, size)
+    return len(zlib.compress(sample, 1)) > STORE_RATIO * len(sample)
+
+
+def _extension(file: PayloadFile) -> str:
+    return os.path.splitext(file.path)[1].lower()
+
+
+def _name(file: PayloadFile) -> str:
+    return file.path.rsplit("/", 1)[-1].lower()
+
+
+def _is_binary(work_dir: Path, file: PayloadFile) -> bool:
+    if _extension(file) in TEXT_EXTENSIONS:
+        return False
+    with open(work_dir / file.path, "rb") as f:
+        return b"\0" in f.read(1024)
+
+
+def order_by_walk(files: List[PayloadFile], work_dir: Path) -> List[PayloadFile]:
+    """ Directory by directory, as makensis adds them with File /r """
+    return list(files)
+
+
+def order_by_extension(files: List[PayloadFile], work_dir: Path) -> List[PayloadFile]:
+    """ Files with the same extension together """
+    return sorted(files, key=lambda f: (_extension(f), f.path))
+
+
+def order_by_name(files: List[PayloadFile], work_dir: Path) -> List[PayloadFile]:
+    """ Files with the same name together, such as the __init__.py and LICENSE files """
+    return sorted(files, key=lambda f: (_extension(f), _name(f), f.path))
+
+
+def order_by_type(files: List[PayloadFile], work_dir: Path) -> List[PayloadFile]:
+    """ Text files before binary files, each grouped by extension """
+    binary = {f.path: _is_binary(work_dir, f) for f in files}
+    return sorted(files, key=lambda f: (binary[f.path], _extension(f), _name(f), f.path))
+
+
+# Orderings of the payload. More can be added, as functions taking the list of files and the
+# working directory, and returning the files in a new order
+ORDERINGS: Dict[str, Callable[[List[PayloadFile], Path], List[PayloadFile]]] = {
+    "walk": order_by_walk,
+    "extension": order_by_extension,
+    "name": order_by_name,
+    "type": order_by_type,
+}
+
+
+class Payload:
+    """ Files of the payload, in the order they are written to the installer
+
+    Parameters
+    ------------
+    work_dir: str or Path
+        Working directory
+
+    files: list of PayloadFile
+        Files of the payload
+
+    directories: list of str
+        All directories of the payload, relative to the working directory, with forward slashes.
+        Listed so that empty directories are created too
+    """
+
+    def __init__(
+        self,
+        work_dir: Union[str, Path],
+        files: List[PayloadFile],
+        directories: List[str],
+    ) -> None:
+        self.work_dir = Path(work_dir)
+        self.files = files
+        self.directories = directories
+
+    @classmethod
+    def from_work_dir(cls, work_dir: Union[str, Path], paths: Iterable[str]) -> "Payload":
+        """ Lists the files under some directories of the working directory
+
+        Parameters
+        -----------
+        work_dir: str or Path
+            Working directory
+
+        paths: list of str
+            Directories to list, relative to work_dir
+        """
+        work_dir = Path(work_dir)
+        files = []
+        directories = []
+        for path in paths:
+            for root, dir_names, file_names in os.walk(work_dir / path):
+                dir_names.sort()
+                relative_root = Path(root).relative_to(work_dir).as_posix()
+                directories.append(relative_root)
+                for name in sorted(file_names):
+                    size = os.lstat(os.path.join(root, name)).st_size
+                    files.append(PayloadFile(f"{relative_root}/{name}", size))
+        return cls(work_dir, files, directories)
+
+    def classify(self, mode: str, max_workers: int = None) -> None:
+        """ Marks the files which should be stored without compression
+
+        Parameters
+        -----------
+        mode: "extension" or "sample"
+            "extension" stores files with extensions of compressed formats. "sample" also
+            compresses a sample of the other files, and stores the ones which barely shrink
+
+        max_workers: int (optional)
+            Number of threads testing files. Default: chosen by
+            :class:`concurrent.futures.ThreadPoolExecutor`
+        """
+        if mode not in STORE_MODES:
+            raise ValueError(f"mode must be 'extension' or 'sample'. Got: {mode}")
+        sampled = []
+        for file in self.files:
+            file.stored = os.path.splitext(file.path)[1].lower() in STORED_EXTENSIONS
+            if not file.stored and mode == "sample" and file.size >= MIN_SAMPLED_SIZE:
+                sampled.append(file)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda f: is_incompressible(self.work_dir / f.path, f.size), sampled
+            )
+            for file, stored in zip(sampled, results):
+                file.stored = stored
+        # the stored files go in a separate block, after the compressed ones
+        self.files.sort(key=lambda f: f.stored)
+
+    def order(
+        self, ordering: Union[str, Callable[[List[PayloadFile], Path], List[PayloadFile]]]
+    ) -> None:
+        """ Sorts the files, which changes how well solid compression works and the order in
+        which the files are written when installing
+
+        The compressed and stored files are sorted separately, so that they stay in two blocks
+
+        Parameters
+        -----------
+        ordering: str or callable
+            Name of an ordering in :data:`ORDERINGS` ("walk", "extension", "name" or "type"),
+            or a function taking the list of files and the working directory and returning
+            the files in a new order
+        """
+        if not callable(ordering):
+            if ordering not in ORDERINGS:
+                raise ValueError(
+                    f"Unknown ordering: {ordering}. Orderings: {', '.join(sorted(ORDERINGS))}"
+                )
+            ordering = ORDERINGS[ordering]
+        ordered = []
+        for stored in (False, True):
+            files = [file for file in self.files if file.stored == stored]
+            ordered += ordering(files, self.work_dir)
+        if sorted(f.path for f in ordered) != sorted(f.path for f in self.files):
+            raise ValueError("The ordering must return each file of the payload once")
+        self.files = ordered
+
+    def store_stats(self, settings: CompressionSettings) -> StoreStats:
+        """ Estimates the effect of storing the stored files, by compressing samples of them
+
+        Parameters
+        -----------
+        settings: CompressionSettings
+            Compression settings of makensis
+        """
+        stats = StoreStats()
+        samples = []
+        sample_bytes = 0
+        for file in self.files:
+            if not file.stored:
+                continue
+            stats.files += 1
+            stats.bytes += file.size
+            if sample_bytes < ESTIMATE_BYTES and file.size:
+                samples.append(_sample(self.work_dir / file.path, file.size))
+                sample_bytes += len(samples[-1])
+        if not sample_bytes:
+            return stats
+        start = time.thread_time()
+        compressed_bytes = sum(len(settings.compress(sample)) for sample in samples)
+        scale = stats.bytes / sample_bytes
+        stats.time_saved = (time.thread_time() - start) * scale
+        stats.size_change = int((sample_bytes - compressed_bytes) * scale)
+        return stats
+
+    def blocks(self) -> List[PayloadBlock]:
+        """ The payload as blocks of consecutive files with the same compression
+
+        Directories without files are output in the first block, so that they are created
+        """
+        blocks: List[PayloadBlock] = []
+        with_files = {os.path.dirname(file.path) for file in self.files}
+        empty = [d for d in self.directories if d not in with_files]
+        if empty:
+            blocks.append(PayloadBlock(False, [(str(PureWindowsPath(d)), []) for d in empty]))
+        for file in self.files:
+            if not blocks or blocks[-1].stored != file.stored:
+                blocks.append(PayloadBlock(file.stored))
+            runs = blocks[-1].runs
+            out_dir = str(PureWindowsPath(os.path.dirname(file.path)))
+            if not runs or runs[-1][0] != out_dir:
+                runs.append((out_dir, []))
+            runs[-1][1].append(str(PureWindowsPath(file.path)))
+        return blocks
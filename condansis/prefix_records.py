@@ -0,0 +1,143 @@
+""" Reads and writes the prefix records of the unpack script """
+from typing import Dict, List, Tuple, Union
+from pathlib import Path
+import os
+import ast
+import functools
+import importlib.util
+from types import ModuleType
+
+# (path, placeholder, mode) of a file which contains the build prefix
+PrefixRecord = Tuple[str, str, str]
+
+_RECORDS_START = "_prefix_records = ["
+# File next to the unpack script with the records. conda-pack's script has them in a list
+RECORDS_FILE_NAME = "condansis-prefix-records.txt"
+RECORDS_FILE_HEADER = "condansis-prefix-records 1"
+_MODE_CODES = {"text": "t", "binary": "b"}
+UNPACK_SCRIPT = (Path(__file__).parent / "condansis-unpack.py").resolve()
+
+
+def _records_span(script: str) -> Tuple[int, int]:
+    start = script.find(_RECORDS_START)
+    if start == -1:
+        raise IOError("Could not find _prefix_records in the unpack script")
+    end = script.find("\n]", start)
+    if end == -1:
+        raise IOError("Could not find the end of _prefix_records in the unpack script")
+    return start, end + 2
+
+
+def record_path(record: PrefixRecord) -> str:
+    """ Path of a prefix record, relative to the environment and with forward slashes """
+    return record[0].replace("\\", "/")
+
+
+def read_prefix_records(script_name: Union[str, Path]) -> List[PrefixRecord]:
+    """ Reads the prefix records of an unpack script, from the records file next to it
+
+    Parameters
+    -----------
+    script_name: str or Path
+        Path to the unpack script
+
+    Returns
+    --------
+    records: list of (path, placeholder, mode)
+        Files in which the build prefix is replaced at install time
+    """
+    return read_records_file(Path(script_name).parent / RECORDS_FILE_NAME)
+
+
+def read_script_records(script_name: Union[str, Path]) -> List[PrefixRecord]:
+    """ Reads the _prefix_records list of an unpack script, such as conda-pack's """
+    with open(script_name, "r") as f:
+        script = f.read()
+    start, end = _records_span(script)
+    return list(ast.literal_eval(script[start + len(_RECORDS_START) - 1 : end]))
+
+
+def read_records_file(file_name: Union[str, Path]) -> List[PrefixRecord]:
+    """ Reads prefix records from a records file, see :func:`write_records_file` """
+    placeholders: List[str] = []
+    records = []
+    modes = {code: mode for mode, code in _MODE_CODES.items()}
+    with open(file_name, "r", encoding="utf-8", newline="\n") as f:
+        if f.readline().rstrip("\n") != RECORDS_FILE_HEADER:
+            raise IOError(f"Unsupported prefix records file: {file_name}")
+        for line in f:
+            kind, value = line.rstrip("\n").split("\t", 1)
+            if kind == "p":
+                placeholders.append(value)
+            else:
+                index, path = value.split("\t", 1)
+                records.append((path, placeholders[int(index)], modes[kind]))
+    return records
+
+
+def write_records_file(file_name: Union[str, Path], records: List[PrefixRecord]) -> None:
+    """ Writes prefix records to a compact text file
+
+    Each distinct placeholder is written once, on a line "p<TAB>placeholder", and the records
+    refer to it by index, on lines "t<TAB>index<TAB>path" for text mode and "b<TAB>..." for
+    binary mode. The file is replaced rather than modified in place, as it can be a hardlink
+
+    Parameters
+    -----------
+    file_name: str or Path
+        Path to the records file
+
+    records: list of (path, placeholder, mode)
+        Files in which the build prefix is replaced at install time
+    """
+    placeholders: Dict[str, int] = {}
+    lines = [RECORDS_FILE_HEADER]
+    for path, placeholder, mode in records:
+        if "\n" in path or "\n" in placeholder:
+            raise ValueError(f"Line breaks are not supported in prefix records: {path!r}")
+        if mode not in _MODE_CODES:
+            raise ValueError(f"Invalid mode of prefix record {path!r}: {mode}")
+        if placeholder not in placeholders:
+            placeholders[placeholder] = len(placeholders)
+            lines.append(f"p\t{placeholder}")
+        lines.append(f"{_MODE_CODES[mode]}\t{placeholders[placeholder]}\t{path}")
+    tmp_name = f"{file_name}.tmp"
+    with open(tmp_name, "w", encoding="utf-8", newline="\n") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_name, file_name)
+
+
+def write_prefix_records(script_name: Union[str, Path], records: List[PrefixRecord]) -> None:
+    """ Replaces the prefix records of an unpack script, in the records file next to it
+
+    Parameters
+    -----------
+    script_name: str or Path
+        Path to the unpack script
+
+    records: list of (path, placeholder, mode)
+        Files in which the build prefix is replaced at install time
+    """
+    write_records_file(Path(script_name).parent / RECORDS_FILE_NAME, records)
+
+
+def _load_unpack_script(module_name: str) -> ModuleType:
+    spec = importlib.util.spec_from_file_location(module_name, UNPACK_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@functools.lru_cache(maxsize=None)
+def unpack_engine() -> ModuleType:
+    """ condansis-unpack.py loaded as a module, to use its relocation functions at build time """
+    return _load_unpack_script("condansis_unpack")
+
+
+@functools.lru_cache(maxsize=None)
+def windows_unpack_engine() -> ModuleType:
+    """ A separate copy of condansis-unpack.py which applies the Windows rules, as when
+    installing, whatever the platform of the build """
+    module = _load_unpack_script("condansis_unpack_win")
+    module.on_win = True
+    return module
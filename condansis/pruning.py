@@ -0,0 +1,215 @@
+""" Removes unneeded files from the packed environment """
+from typing import Dict, List, Pattern, Sequence, Tuple, Union
+from pathlib import Path
+import os
+import re
+import logging
+from dataclasses import dataclass
+
+from .prefix_records import (
+    RECORDS_FILE_NAME,
+    read_prefix_records,
+    record_path,
+    write_prefix_records,
+)
+
+PRESETS: Dict[str, Tuple[str, ...]] = {
+    "strip-debug": ("*.pdb",),
+    "strip-tests": ("Lib/test", "Lib/idlelib/idle_test", "Lib/site-packages/**/tests"),
+    "strip-headers": ("/include", "/Library/include"),
+    "strip-docs": ("share/doc", "share/man", "Library/share/doc", "Library/share/man"),
+    "strip-pycache": ("__pycache__",),
+}
+# Files the installer needs, which are never removed
+PROTECTED = ("Scripts/condansis-unpack.py", f"Scripts/{RECORDS_FILE_NAME}")
+
+
+def _glob_to_regex(pattern: str) -> Pattern:
+    # like in .gitignore, a leading slash anchors the pattern to the root of the environment
+    anchored = pattern.startswith("/")
+    pattern = pattern.strip("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    regex = "".join(parts)
+    if "/" not in pattern and not anchored:
+        # patterns without a slash match in any directory
+        regex = "(?:.*/)?" + regex
+    # matching a directory matches all the files in it
+    return re.compile(regex + "(?:/.*)?", re.IGNORECASE)
+
+
+@dataclass
+class PruneRule:
+    """ A rule selecting files of the environment
+
+    Parameters
+    ------------
+    pattern: str
+        Glob or regular expression, matched against paths relative to the environment,
+        with forward slashes
+
+    regex: bool (optional)
+        Whether pattern is a regular expression. Default: False (glob)
+
+    include: bool (optional)
+        Whether matching files are kept rather than removed. Default: False
+    """
+
+    pattern: str
+    regex: bool = False
+    include: bool = False
+
+    def __post_init__(self) -> None:
+        if self.regex:
+            self._matcher = re.compile(self.pattern)
+        else:
+            self._matcher = _glob_to_regex(self.pattern)
+
+    @classmethod
+    def parse(cls, spec: str) -> "PruneRule":
+        """ Creates a rule from a string
+
+        "!" in the start makes an include rule, and "re:" a regular expression rule.
+        For example, "!re:.*\\.pdb" keeps the files ending with ".pdb"
+        """
+        include = spec.startswith("!")
+        if include:
+            spec = spec[1:]
+        regex = spec.startswith("re:")
+        if regex:
+            spec = spec[3:]
+        return cls(spec, regex=regex, include=include)
+
+    def matches(self, path: str) -> bool:
+        """ Whether the rule applies to a file
+
+        Globs are case insensitive, as in Windows. A glob without a slash matches in any directory,
+        unless it starts with a slash, which anchors it to the root of the environment.
+        A glob matching a directory matches all the files in it.
+        Regular expressions must match the whole path
+        """
+        return self._matcher.fullmatch(path) is not None
+
+
+@dataclass
+class PruneStats:
+    """ Number of files, bytes and prefix records removed from the environment """
+
+    files: int = 0
+    bytes: int = 0
+    records: int = 0
+
+
+class Pruner:
+    """ Removes the files of an environment selected by a list of rules
+
+    Rules are applied in order, and the last rule matching a file decides whether it is removed.
+    Include rules can therefore keep files that earlier rules remove
+
+    Parameters
+    ------------
+    rules: list of str or PruneRule
+        Rules or names of presets. Strings are parsed with :meth:`PruneRule.parse`.
+        Presets: "strip-debug", "strip-tests", "strip-headers", "strip-docs" and "strip-pycache"
+
+    Examples
+    ---------
+    Remove debug symbols and test suites, but keep the tests of one package
+
+    >>> Pruner(["strip-debug", "strip-tests", "!Lib/site-packages/mypackage/tests"])
+    """
+
+    def __init__(self, rules: Sequence[Union[str, PruneRule]]) -> None:
+        self.rules: List[PruneRule] = []
+        for rule in rules:
+            if isinstance(rule, PruneRule):
+                self.rules.append(rule)
+            elif rule in PRESETS:
+                self.rules.extend(PruneRule(pattern) for pattern in PRESETS[rule])
+            elif isinstance(rule, str) and rule.startswith("strip-"):
+                raise ValueError(
+                    f"Unknown prune preset: {rule}. Presets: {', '.join(sorted(PRESETS))}"
+                )
+            else:
+                self.rules.append(PruneRule.parse(rule))
+
+    def is_pruned(self, path: str) -> bool:
+        """ Whether a file is removed
+
+        Parameters
+        -----------
+        path: str
+            Path relative to the environment, with forward slashes
+        """
+        if path in PROTECTED:
+            return False
+        pruned = False
+        for rule in self.rules:
+            if rule.matches(path):
+                pruned = not rule.include
+        return pruned
+
+    def prune(self, env_dir: Union[str, Path]) -> PruneStats:
+        """ Removes the selected files from a packed environment
+
+        The records of the removed files are dropped from the prefix records file of
+        Scripts/condansis-unpack.py, if the environment has it
+
+        Parameters
+        -----------
+        env_dir: str or Path
+            Directory with the packed environment
+
+        Returns
+        --------
+        stats: PruneStats
+            Number of files, bytes and prefix records removed
+        """
+        env_dir = Path(env_dir)
+        stats = PruneStats()
+        # directories from which something was removed
+        changed = set()
+        for root, _, file_names in os.walk(env_dir, topdown=False):
+            relative_root = Path(root).relative_to(env_dir).as_posix()
+            for name in file_names:
+                path = name if relative_root == "." else f"{relative_root}/{name}"
+                if self.is_pruned(path):
+                    full_path = os.path.join(root, name)
+                    stats.bytes += os.lstat(full_path).st_size
+                    os.remove(full_path)
+                    stats.files += 1
+                    changed.add(root)
+            # remove the directories left empty
+            if root in changed and relative_root != "." and not os.listdir(root):
+                os.rmdir(root)
+                changed.add(os.path.dirname(root))
+
+        unpack_script = env_dir / "Scripts" / "condansis-unpack.py"
+        if unpack_script.is_file():
+            records = read_prefix_records(unpack_script)
+            kept = [record for record in records if not self.is_pruned(record_path(record))]
+            stats.records = len(records) - len(kept)
+            if stats.records:
+                write_prefix_records(unpack_script, kept)
+
+        logging.info(
+            f"Pruned environment - {stats.files} files ({stats.bytes / 1024 ** 2:.1f} MB), "
+            f"{stats.records} prefix records removed"
+        )
+        return stats
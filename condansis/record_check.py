@@ -0,0 +1,145 @@
+""" Finds the prefix records which would not change their file when installing """
+from typing import List, Tuple, Union
+from pathlib import Path
+import os
+import logging
+import functools
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+from .prefix_records import (
+    PrefixRecord,
+    read_prefix_records,
+    record_path,
+    windows_unpack_engine,
+    write_prefix_records,
+)
+
+# Stands for the installation directory. "?" cannot be in a Windows path, so it never equals a
+# placeholder, and every replacement changes the file
+SENTINEL_PREFIX = "C:\\condansis?sentinel"
+
+
+@dataclass
+class RecordCheckStats:
+    """ Prefix records dropped because relocating their file would leave it unchanged
+
+    files and bytes count the files which are no longer read when installing, because all their
+    records were dropped
+    """
+
+    records: int = 0
+    files: int = 0
+    bytes: int = 0
+
+
+def changes_file(data: bytes, record: PrefixRecord) -> bool:
+    """ Whether relocating a file with a prefix record changes it when installing
+
+    Parameters
+    -----------
+    data: bytes
+        Contents of the file
+
+    record: (path, placeholder, mode)
+        Prefix record of the file
+
+    Returns
+    --------
+    changed: bool
+        False if condansis-unpack.py would leave the file as it is on Windows
+    """
+    _, placeholder, mode = record
+    return _matcher(placeholder, mode).replace(data) != data
+
+
+@functools.lru_cache(maxsize=None)
+def _matcher(placeholder: str, mode: str):
+    return windows_unpack_engine().Matcher(placeholder, SENTINEL_PREFIX, mode)
+
+
+def find_noop_records(
+    env_dir: Union[str, Path], records: List[PrefixRecord], max_workers: int = None
+) -> Tuple[List[PrefixRecord], RecordCheckStats]:
+    """ Checks each prefix record against the staged file, with the rules of the unpack script
+    on Windows
+
+    Binary records only change the shebang of distlib launchers on Windows, so the records of
+    other binary files are no-ops, and so are the records whose placeholder is not in the file.
+    Records of missing files are kept, so that the unpack script still reports them
+
+    Parameters
+    -----------
+    env_dir: str or Path
+        Directory with the packed environment
+
+    records: list of (path, placeholder, mode)
+        Prefix records of the environment
+
+    max_workers: int (optional)
+        Number of threads reading files. Default: chosen by
+        :class:`concurrent.futures.ThreadPoolExecutor`
+
+    Returns
+    --------
+    kept: list of (path, placeholder, mode)
+        The records which change their file, in their original order
+
+    stats: RecordCheckStats
+        Number of records dropped, and of files and bytes no longer read when installing
+    """
+    by_path = {}
+    for index, record in enumerate(records):
+        by_path.setdefault(record[0], []).append(index)
+
+    def check(path):
+        # the indices of the records to keep, and the size of the file
+        indices = by_path[path]
+        try:
+            with open(os.path.join(env_dir, record_path(records[indices[0]])), "rb") as f:
+                data = f.read()
+        except OSError:
+            return indices, 0
+        return [index for index in indices if changes_file(data, records[index])], len(data)
+
+    stats = RecordCheckStats()
+    kept_indices = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for indices, size in executor.map(check, list(by_path)):
+            kept_indices.update(indices)
+            if not indices:
+                stats.files += 1
+                stats.bytes += size
+    kept = [record for index, record in enumerate(records) if index in kept_indices]
+    stats.records = len(records) - len(kept)
+    return kept, stats
+
+
+def drop_noop_records(env_dir: Union[str, Path], max_workers: int = None) -> RecordCheckStats:
+    """ Removes the prefix records which would not change their file from the unpack script
+    of a packed environment
+
+    Parameters
+    -----------
+    env_dir: str or Path
+        Directory with the packed environment
+
+    max_workers: int (optional)
+        Number of threads reading files. Default: chosen by
+        :class:`concurrent.futures.ThreadPoolExecutor`
+
+    Returns
+    --------
+    stats: RecordCheckStats
+        Number of records dropped, and of files and bytes no longer read when installing
+    """
+    unpack_script = Path(env_dir) / "Scripts" / "condansis-unpack.py"
+    records = read_prefix_records(unpack_script)
+    kept, stats = find_noop_records(env_dir, records, max_workers)
+    if stats.records:
+        write_prefix_records(unpack_script, kept)
+    logging.info(
+        f"Dropped {stats.records} of {len(records)} prefix records which change nothing - "
+        f"{stats.files} files ({stats.bytes / 1024 ** 2:.1f} MB) no longer read when installing"
+    )
+    return stats
@@ -0,0 +1,144 @@
+""" Runs build stages concurrently, respecting the dependencies between them """
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import time
+import logging
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+
+# Name of the stage running in the current thread, used to tag the output of subprocesses
+current_stage: ContextVar[Optional[str]] = ContextVar("current_stage", default=None)
+
+
+@dataclass
+class Stage:
+    """ A build stage
+
+    Parameters
+    ------------
+    name: str
+        Name of the stage
+
+    func: callable
+        Function running the stage. Its return value is stored in :attr:`StageScheduler.results`
+
+    after: list of str
+        Stages which need to finish before this one starts
+
+    cleanup: callable (optional)
+        Function undoing the stage, called if the build fails after the stage started
+    """
+
+    name: str
+    func: Callable[[], Any]
+    after: Sequence[str] = ()
+    cleanup: Optional[Callable[[], None]] = None
+
+
+class StageScheduler:
+    """ Runs independent stages on a thread pool
+
+    Parameters
+    ------------
+    max_workers: int (optional)
+        Maximum number of stages running at the same time. Default: one thread per stage
+    """
+
+    def __init__(self, max_workers: int = None) -> None:
+        if max_workers is not None and max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1. Got: {max_workers}")
+        self.max_workers = max_workers
+        self.stages: Dict[str, Stage] = {}
+        self.results: Dict[str, Any] = {}
+        self.durations: Dict[str, float] = {}
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        after: Sequence[str] = (),
+        cleanup: Callable[[], None] = None,
+    ) -> None:
+        """ Adds a stage. Stages can only depend on stages added before them
+
+        Parameters
+        -----------
+        name: str
+            Name of the stage
+
+        func: callable
+            Function running the stage
+
+        after: list of str (optional)
+            Stages which need to finish before this one starts
+
+        cleanup: callable (optional)
+            Function undoing the stage, called if the build fails after the stage started
+        """
+        if name in self.stages:
+            raise ValueError(f"Duplicated stage: {name}")
+        for dependency in after:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self.stages[name] = Stage(name, func, tuple(after), cleanup)
+
+    def _run_stage(self, stage: Stage) -> Any:
+        start = time.perf_counter()
+        token = current_stage.set(stage.name)
+        try:
+            return stage.func()
+        finally:
+            current_stage.reset(token)
+            self.durations[stage.name] = time.perf_counter() - start
+
+    def run(self) -> Dict[str, Any]:
+        """ Runs all stages
+
+        If a stage fails, no new stages are started, the ones running are waited for,
+        the cleanup of every stage which started is called in reverse order and the
+        first error is raised. The wall time of each stage is stored in :attr:`durations`
+
+        Returns
+        --------
+        results: dict
+            Return value of each stage
+        """
+        pending = list(self.stages.values())
+        done = set()
+        started: List[Stage] = []
+        running = {}
+        error = None
+        max_workers = self.max_workers or max(len(pending), 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    for stage in [s for s in pending if done.issuperset(s.after)]:
+                        if len(running) >= max_workers:
+                            break
+                        pending.remove(stage)
+                        started.append(stage)
+                        running[executor.submit(self._run_stage, stage)] = stage
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    try:
+                        self.results[stage.name] = future.result()
+                    except BaseException as e:
+                        logging.error(f"Stage {stage.name} failed")
+                        if error is None:
+                            error = e
+                    else:
+                        done.add(stage.name)
+
+        if error is not None:
+            for stage in reversed(started):
+                if stage.cleanup is None:
+                    continue
+                try:
+                    stage.cleanup()
+                except Exception as e:
+                    logging.warning(f"Could not clean up stage {stage.name}: {e}")
+            raise error
+        return self.results
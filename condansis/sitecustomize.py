@@ -1,12 +1,54 @@
-''' This file is invoked at python startup to modify the environment PATH so that some DLLs can be found 
+''' This file is invoked at python startup so that the DLLs of the environment can be found
+
+The DLL directories are listed when installing, by condansis-unpack.py, in the module
+DLL_DIRECTORIES_MODULE next to this file, which is imported from its cached bytecode like any
+other module. They are registered with os.add_dll_directory, and added to PATH only if PATH
+does not have them yet, so that PATH does not grow in each subprocess. Subprocesses do not
+inherit the DLL directories, so they still need PATH
 '''
 import os
 
-prefix = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+DLL_DIRECTORIES_MODULE = 'condansis_dll_directories'
 #  Notice: this is where conda stores some DLLs. If that changes in the future, this here should also change
 # Based on https://github.com/conda/conda-pack/blob/master/conda_pack/scripts/windows/activate.bat
-os.environ["PATH"] = os.pathsep.join([
-    os.path.join(prefix, 'Library', 'mingw-w64'),
-    os.path.join(prefix, 'Library', 'usr', 'bin'),
-    os.path.join(prefix, 'Library', 'bin')
-]) + os.pathsep + os.environ["PATH"]
\ No newline at end of file
+LIBRARY_DIRECTORIES = [
+    ('Library', 'mingw-w64'),
+    ('Library', 'usr', 'bin'),
+    ('Library', 'bin'),
+]
+# Keeps the directories registered for the lifetime of the process
+_added_dll_directories = []
+
+
+def dll_directories():
+    try:
+        return __import__(DLL_DIRECTORIES_MODULE).DLL_DIRECTORIES
+    except ImportError:
+        # not installed yet, as when building the environment
+        prefix = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+        return [os.path.join(prefix, *parts) for parts in LIBRARY_DIRECTORIES]
+
+
+def _normalize(directory):
+    # PATH entries can differ in case and have trailing separators, as in C:\Env\Library\bin\
+    return os.path.normpath(os.path.normcase(directory.rstrip('\\/')))
+
+
+def register(directories):
+    add_dll_directory = getattr(os, 'add_dll_directory', None)
+    path = os.environ.get('PATH', '')
+    entries = set(_normalize(entry) for entry in path.split(os.pathsep) if entry)
+    missing = []
+    for directory in directories:
+        if add_dll_directory is not None:
+            try:
+                _added_dll_directories.append(add_dll_directory(directory))
+            except OSError:
+                pass
+        if _normalize(directory) not in entries:
+            missing.append(directory)
+    if missing:
+        os.environ['PATH'] = os.pathsep.join(missing + [path] if path else missing)
+
+
+register(dll_directories())
@@ -0,0 +1,203 @@
+""" Persistent working directory, updated incrementally between builds """
+from typing import Dict, Sequence, Set, Union
+from pathlib import Path
+import os
+import json
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+
+from .copier import CopyEngine, COPY_METHODS
+
+MANIFEST_NAME = ".condansis-manifest.json"
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    """ sha256 digest of a file """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass
+class SyncStats:
+    """ Number of files copied, left untouched and deleted when updating a staging directory """
+
+    copied: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+
+
+class StagingDir:
+    """ Working directory which is kept between builds
+
+    A manifest records the size, modification time and hash of the source of every staged file.
+    Files are only copied again when their source changed, and staged files without a
+    source in the current build are deleted in :meth:`finish`, as are files in the synchronized
+    directories which are not in the manifest. Files derived from staged files, such as
+    byte-compiled modules, are recorded with :meth:`add_derived`.
+    Staged files can be hardlinks to their sources and must never be modified in place.
+
+    Parameters
+    ------------
+    path: str or Path
+        Staging directory. Should not be used for anything else
+
+    copy_methods: list of "hardlink", "clone" or "copy" (optional)
+        Ways to copy files into the staging directory, see :class:`condansis.copier.CopyEngine`
+    """
+
+    def __init__(self, path: Union[str, Path], copy_methods: Sequence[str] = COPY_METHODS) -> None:
+        self.path = Path(path).resolve()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.engine = CopyEngine(copy_methods)
+        self.stats = SyncStats()
+        self._lock = threading.Lock()
+        self._seen: Set[str] = set()
+        # directories synchronized with sync_tree
+        self._roots: Set[str] = set()
+        self._derived: Set[str] = set()
+        try:
+            with open(self.path / MANIFEST_NAME, "r") as f:
+                self.manifest: Dict[str, dict] = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def sync_file(self, source: Union[str, Path], target: Union[str, Path]) -> bool:
+        """ Updates a staged file
+
+        Parameters
+        -----------
+        source: str or Path
+            Source file
+
+        target: str or Path
+            Path of the file, relative to the staging directory
+
+        Returns
+        --------
+        copied: bool
+            Whether the file was copied
+        """
+        key = Path(target).as_posix()
+        destination = self.path / target
+        st = os.stat(source)
+        with self._lock:
+            self._seen.add(key)
+            record = self.manifest.get(key)
+        staged = destination.is_file()
+        if record is None:
+            record = {}
+        if staged and record.get("size") == st.st_size and record.get("mtime") == st.st_mtime_ns:
+            copied = False
+        else:
+            digest = file_hash(source)
+            copied = not (staged and record.get("hash") == digest)
+            if copied:
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                self.engine.copy_file(source, destination)
+            record = {"size": st.st_size, "mtime": st.st_mtime_ns, "hash": digest}
+        with self._lock:
+            self.manifest[key] = record
+            if copied:
+                self.stats.copied += 1
+            else:
+                self.stats.unchanged += 1
+        return copied
+
+    def sync_tree(self, source: Union[str, Path], target: Union[str, Path]) -> None:
+        """ Updates a staged directory tree
+
+        Parameters
+        -----------
+        source: str or Path
+            Source directory
+
+        target: str or Path
+            Path of the directory, relative to the staging directory
+        """
+        (self.path / target).mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._roots.add(Path(target).as_posix())
+        files = []
+        for root, dir_names, file_names in os.walk(source, followlinks=True):
+            target_root = Path(target, os.path.relpath(root, source))
+            for name in dir_names:
+                (self.path / target_root / name).mkdir(exist_ok=True)
+            for name in file_names:
+                files.append((os.path.join(root, name), target_root / name))
+        # hashing and copying the files share the threads of the copy engine
+        self.engine.map(lambda f: self.sync_file(*f), files)
+
+    def add_derived(self, target: Union[str, Path], source: Union[str, Path]) -> None:
+        """ Records a file written into the staging directory from a staged file
+
+        Derived files are recorded again in every build. :meth:`finish` deletes the ones which were
+        not, or whose source was not synchronized
+
+        Parameters
+        -----------
+        target: str or Path
+            Path of the derived file, relative to the staging directory
+
+        source: str or Path
+            Path of the staged file it is derived from, relative to the staging directory
+        """
+        key = Path(target).as_posix()
+        with self._lock:
+            self._derived.add(key)
+            self.manifest[key] = {"source": Path(source).as_posix()}
+
+    def save(self) -> None:
+        """ Writes out the manifest """
+        manifest_file = self.path / MANIFEST_NAME
+        tmp_file = manifest_file.with_suffix(".tmp")
+        with self._lock:
+            with open(tmp_file, "w") as f:
+                json.dump(self.manifest, f)
+        os.replace(tmp_file, manifest_file)
+
+    def finish(self) -> SyncStats:
+        """ Deletes the staged files which were not synchronized in this build and the unknown
+        files in the synchronized directories, and saves the manifest
+
+        Returns
+        --------
+        stats: SyncStats
+            Number of files copied, left untouched and deleted
+        """
+        kept = set(self._seen)
+        kept.update(key for key in self._derived if self.manifest[key].get("source") in self._seen)
+        stale = set(self.manifest) - kept
+        # files left by earlier builds and not recorded, such as outputs of disabled stages
+        for target in self._roots:
+            for root, _, file_names in os.walk(self.path / target):
+                for name in file_names:
+                    key = Path(root, name).relative_to(self.path).as_posix()
+                    if key not in self.manifest:
+                        stale.add(key)
+        directories = set()
+        for key in stale:
+            path = self.path / key
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            directories.update(p for p in path.parents if self.path in p.parents)
+            self.manifest.pop(key, None)
+            self.stats.deleted += 1
+        # remove directories left empty, deepest first
+        for directory in sorted(directories, key=lambda p: len(p.parts), reverse=True):
+            try:
+                directory.rmdir()
+            except OSError:
+                pass
+        self.save()
+        logging.info(
+            f"Staging directory updated - {self.stats.copied} files copied, "
+            f"{self.stats.unchanged} unchanged, {self.stats.deleted} deleted"
+        )
+        return self.stats
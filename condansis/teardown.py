@@ -0,0 +1,223 @@
+""" Removal of temporary environments in the background, without the conda CLI """
+from typing import List, Optional, Union
+from pathlib import Path
+import os
+import sys
+import stat
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+
+# Prefix of the temporary directories with environments being built. The process id follows
+TEMP_ENV_PREFIX = "condansis-env-"
+# Prefix of the directories renamed aside to be removed. The process id follows
+TRASH_PREFIX = "condansis-trash-"
+RETRIES = 5
+RETRY_DELAY = 0.5
+
+_removals: List[threading.Thread] = []
+_removals_lock = threading.Lock()
+
+
+def make_temp_env_dir() -> Path:
+    """ Creates a temporary directory for an environment, which :func:`clean_abandoned` can
+    identify as abandoned if the build crashes
+    """
+    return Path(tempfile.mkdtemp(prefix=f"{TEMP_ENV_PREFIX}{os.getpid()}-"))
+
+
+def _make_writable(func, path, exc_info):
+    # rmtree error handler: read-only files cannot be deleted on Windows
+    if issubclass(exc_info[0], FileNotFoundError):
+        return
+    try:
+        os.chmod(path, stat.S_IWRITE | stat.S_IREAD | stat.S_IEXEC)
+        func(path)
+    except OSError:
+        pass
+
+
+def remove_tree(
+    path: Union[str, Path], retries: int = RETRIES, delay: float = RETRY_DELAY
+) -> bool:
+    """ Removes a directory, retrying while some files are locked
+
+    Files of a process which just exited, such as dlls, often stay locked for a moment on
+    Windows. The delay doubles after each attempt
+
+    Parameters
+    -----------
+    path: str or Path
+        Directory to remove
+
+    retries: int (optional)
+        Number of attempts after the first one. Default: 5
+
+    delay: float (optional)
+        Seconds to wait before the first retry. Default: 0.5
+
+    Returns
+    --------
+    removed: bool
+        Whether the directory no longer exists
+    """
+    for attempt in range(retries + 1):
+        shutil.rmtree(path, onerror=_make_writable)
+        if not os.path.lexists(path):
+            return True
+        if attempt < retries:
+            time.sleep(delay * 2 ** attempt)
+    logging.warning(f"Could not remove {path}")
+    return False
+
+
+def rename_aside(path: Union[str, Path]) -> Path:
+    """ Renames a directory to a trash name next to it, so that its name can be reused at once
+
+    Returns
+    --------
+    trash: Path
+        New name of the directory, or the original one if it could not be renamed
+    """
+    path = Path(path)
+    trash = path.parent / f"{TRASH_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:12]}"
+    try:
+        os.rename(path, trash)
+    except OSError:
+        # locked files can prevent renaming directories on Windows
+        return path
+    return trash
+
+
+def discard(path: Union[str, Path], wait: bool = False) -> Optional[threading.Thread]:
+    """ Renames a directory aside and removes it in a background thread
+
+    Directories which are not removed completely, for example because the process exits first,
+    are removed by :func:`clean_abandoned`
+
+    Parameters
+    -----------
+    path: str or Path
+        Directory to remove
+
+    wait: bool (optional)
+        Whether to remove the directory in the calling thread instead. Default: False
+
+    Returns
+    --------
+    thread: Thread or None
+        Thread removing the directory. None if it does not exist or wait is True
+    """
+    if not os.path.lexists(path):
+        return None
+    trash = rename_aside(path)
+    if wait:
+        remove_tree(trash)
+        return None
+    thread = threading.Thread(target=remove_tree, args=(trash,), name=f"discard {trash}")
+    thread.daemon = True
+    with _removals_lock:
+        _removals[:] = [t for t in _removals if t.is_alive()]
+        _removals.append(thread)
+    thread.start()
+    return thread
+
+
+def wait_for_removals(timeout: float = None) -> bool:
+    """ Waits for the directories discarded in the background to be removed
+
+    Parameters
+    -----------
+    timeout: float (optional)
+        Maximum time to wait, in seconds. Default: no limit
+
+    Returns
+    --------
+    done: bool
+        Whether all removals finished
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _removals_lock:
+        threads = list(_removals)
+    for thread in threads:
+        thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+    return not any(thread.is_alive() for thread in threads)
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if sys.platform == "win32":
+        import ctypes
+
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        try:
+            code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, owned by another user
+        return True
+    return True
+
+
+def _owner(name: str) -> Optional[int]:
+    for prefix in (TEMP_ENV_PREFIX, TRASH_PREFIX):
+        if name.startswith(prefix):
+            pid = name[len(prefix) :].split("-", 1)[0]
+            return int(pid) if pid.isdigit() else None
+    return None
+
+
+def clean_abandoned(root: Union[str, Path] = None, wait: bool = False) -> List[Path]:
+    """ Removes temporary environments and trash directories left by builds which crashed
+    or exited before removing them
+
+    A directory is abandoned when the process which created it is no longer running
+
+    Parameters
+    -----------
+    root: str or Path (optional)
+        Directory to look in. Default: the system temporary directory
+
+    wait: bool (optional)
+        Whether to wait for the directories to be removed. Default: False
+
+    Returns
+    --------
+    abandoned: list of Path
+        Directories being removed
+    """
+    root = Path(tempfile.gettempdir() if root is None else root)
+    abandoned = []
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return abandoned
+    for entry in entries:
+        pid = _owner(entry.name)
+        if pid is None or not entry.is_dir(follow_symlinks=False):
+            continue
+        if not _pid_alive(pid):
+            abandoned.append(Path(entry.path))
+    for path in abandoned:
+        logging.info(f"Removing abandoned temporary directory {path}")
+        if wait:
+            remove_tree(path, retries=0)
+        else:
+            discard(path)
+    return abandoned
@@ -0,0 +1,145 @@
+import os
+from pathlib import Path
+import sys
+import time
+import json
+import socket
+import asyncio
+import tempfile
+import subprocess
+
+import pytest
+
+from .async_runner import AsyncRunner, JsonLinesSink
+from .installer import Installer
+from .scheduler import StageScheduler
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+# the grandchild connects to the test, which sees the connection close once it is killed
+SLEEPER = """
+import subprocess, sys, time
+GRANDCHILD = (
+    "import socket, sys, time\\n"
+    "conn = socket.create_connection(('127.0.0.1', int(sys.argv[1])))\\n"
+    "conn.sendall(b'1')\\n"
+    "time.sleep(60)\\n"
+)
+child = subprocess.Popen([sys.executable, "-c", GRANDCHILD, sys.argv[1]])
+time.sleep(60)
+"""
+
+
+def _is_closed(conn, timeout):
+    # portable: os.kill(pid, 0) terminates the process on Windows
+    conn.settimeout(timeout)
+    try:
+        return conn.recv(1) == b""
+    except ConnectionResetError:
+        return True
+    except socket.timeout:
+        return False
+
+
+def _nsis_only(installer, script_name):
+    # replaces the build with a single "nsis" stage running the "makensis" executable
+    def create():
+        scheduler = StageScheduler()
+        scheduler.add("nsis", lambda: installer.run_nsis(script_name))
+        scheduler.run()
+
+    installer.create = create
+
+
+class TestAsyncRunner:
+    def test_stream(self):
+        events = []
+
+        async def run():
+            runner = AsyncRunner(asyncio.get_running_loop(), events.append, "package")
+            await runner.run_async(
+                [sys.executable, "-c", "import sys; print('out'); print('err', file=sys.stderr)"],
+                "stage",
+            )
+            with pytest.raises(subprocess.CalledProcessError):
+                await runner.run_async([sys.executable, "-c", "exit(3)"])
+
+        asyncio.run(run())
+        lines = {(e.stream, e.line) for e in events}
+        assert ("stdout", "out") in lines
+        assert ("stderr", "err") in lines
+        assert ("status", "exited with code 3") in lines
+        assert all(e.installer == "package" for e in events)
+        assert events[0].stage == "stage"
+        assert events[0].time <= events[-1].time
+
+    def test_cancel_while_starting(self, monkeypatch):
+        events = []
+        create_subprocess_exec = asyncio.create_subprocess_exec
+
+        async def run():
+            runner = AsyncRunner(asyncio.get_running_loop(), events.append)
+
+            async def cancelled_exec(*args, **kwargs):
+                # the build is cancelled after the process started, before it is registered
+                process = await create_subprocess_exec(*args, **kwargs)
+                runner.cancel()
+                return process
+
+            monkeypatch.setattr(asyncio, "create_subprocess_exec", cancelled_exec)
+            with pytest.raises(subprocess.CalledProcessError):
+                await runner.run_async([sys.executable, "-c", "import time; time.sleep(60)"])
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        assert time.perf_counter() - start < 30
+        assert not [e for e in events if e.stream != "status"]
+
+    def test_create_async(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            script = Path(tmp_dir, "script.py")
+            script.write_text("print('compressing')")
+            log = Path(tmp_dir, "log.jsonl")
+            installer = Installer("package", TEST_FILES_DIR, makensis_exe=sys.executable)
+            _nsis_only(installer, script)
+            sink = JsonLinesSink(log)
+            asyncio.run(installer.create_async(sink))
+            sink.close()
+            events = [json.loads(line) for line in log.read_text().splitlines()]
+            stdout = [e for e in events if e["stream"] == "stdout"]
+            assert [(e["stage"], e["line"]) for e in stdout] == [("nsis", "compressing")]
+            assert installer._runner is None
+
+    def test_cancel(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, socket.create_server(
+            ("127.0.0.1", 0)
+        ) as server:
+            script = Path(tmp_dir, "script.py")
+            script.write_text(SLEEPER)
+            port = str(server.getsockname()[1])
+            server.setblocking(False)
+            installer = Installer("package", TEST_FILES_DIR)
+
+            def create():
+                scheduler = StageScheduler()
+                scheduler.add("nsis", lambda: installer._run([sys.executable, script, port]))
+                scheduler.run()
+
+            installer.create = create
+
+            async def run():
+                loop = asyncio.get_running_loop()
+                task = asyncio.ensure_future(installer.create_async(lambda event: None))
+                conn, _ = await loop.sock_accept(server)
+                assert await loop.sock_recv(conn, 1) == b"1"
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+                return conn
+
+            start = time.perf_counter()
+            conn = asyncio.run(run())
+            with conn:
+                assert time.perf_counter() - start < 30
+                conn.setblocking(True)
+                assert _is_closed(conn, timeout=5)
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+from .batch import InstallerBatch
+from .installer import Installer
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+class TestInstallerBatch:
+    def test_create(self, mock_conda):
+        mock_conda.fail.add("fail.exe")
+        with tempfile.TemporaryDirectory() as out_dir:
+            installers = [
+                Installer(
+                    f"package{i}",
+                    TEST_FILES_DIR,
+                    include=["package_folder"],
+                    install_root_package=False,
+                    installer_name=os.path.join(out_dir, name),
+                )
+                for i, name in enumerate(["a.exe", "b.exe", "fail.exe"])
+            ]
+            batch = InstallerBatch(installers)
+            assert len(batch.groups()) == 1
+            results = batch.create()
+            # the environment is only created once
+            assert mock_conda.count("create") == 1
+            assert [r.succeeded for r in results] == [True, True, False]
+            assert os.path.isfile(os.path.join(out_dir, "a.exe"))
+            assert os.path.isfile(os.path.join(out_dir, "b.exe"))
+            assert not os.path.exists(os.path.join(out_dir, "fail.exe"))
+            table = InstallerBatch.format_results(results)
+            assert "failed: CalledProcessError" in table
+            assert len(table.splitlines()) == 4
+
+    def test_groups(self):
+        def make_installer(name, **kwargs):
+            return Installer(name, TEST_FILES_DIR, install_root_package=False, **kwargs)
+
+        installers = [
+            make_installer("a"),
+            make_installer("b", prune=["strip-debug"]),
+            make_installer("c", prune=["strip-debug"]),
+            make_installer("d", prune=["strip-debug", "!Library/bin/keep.pdb"]),
+            make_installer("e", prune=["strip-debug"], drop_noop_records=True),
+        ]
+        groups = InstallerBatch(installers).groups()
+        # the packed environment depends on the prune rules and drop_noop_records
+        assert [[i.package_name for i in group] for group in groups.values()] == [
+            ["a"],
+            ["b", "c"],
+            ["d"],
+            ["e"],
+        ]
+
+    def test_groups_root_package(self, mock_conda):
+        with tempfile.TemporaryDirectory() as package_root:
+            shutil.copy(os.path.join(TEST_FILES_DIR, "environment.yml"), package_root)
+            # outputs without the .exe suffix, which the root package digest always leaves out
+            installers = [
+                Installer(
+                    f"package{i}",
+                    package_root,
+                    installer_name=os.path.join(package_root, "out", f"variant-{i}.bin"),
+                )
+                for i in range(2)
+            ]
+            batch = InstallerBatch(installers)
+            # the installers built by the first run do not split the variants on the second
+            for run in range(2):
+                assert len(batch.groups()) == 1
+                results = batch.create()
+                assert [r.succeeded for r in results] == [True, True]
+                assert mock_conda.count("create") == run + 1
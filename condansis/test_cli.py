@@ -0,0 +1,114 @@
+import os
+from pathlib import Path
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+from .cli import load_config, installer_from_config, main
+from .env_cache import EnvCache
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+# Seconds `import condansis` may take, as a multiple of starting Python
+IMPORT_BUDGET = 8
+# modules which the build loads, but not `import condansis`
+STAGE_MODULES = [
+    "asyncio",
+    "jinja2",
+    "conda_pack",
+    "winreg",
+    "condansis.compression",
+    "condansis.copier",
+    "condansis.dedup",
+    "condansis.payload",
+    "condansis.prefix_records",
+    "condansis.pruning",
+    "condansis.record_check",
+    "condansis.staging",
+    "condansis.teardown",
+]
+
+
+def _write_config(config_dir: Path, **options) -> Path:
+    shutil.copy(os.path.join(TEST_FILES_DIR, "environment.yml"), config_dir)
+    config = {
+        "package_name": "package",
+        "include": ["app.py"],
+        "install_root_package": False,
+        "installer_name": "out/installer.exe",
+        "shortcuts": [{"shortcut_name": "$INSTDIR\\app.lnk", "target_file": "$PYTHON"}],
+    }
+    config.update(options)
+    (config_dir / "app.py").write_text("print('app')")
+    file_name = config_dir / "installer.json"
+    file_name.write_text(json.dumps(config))
+    return file_name
+
+
+class TestCli:
+    def test_load_config(self):
+        with tempfile.TemporaryDirectory() as config_dir:
+            config_dir = Path(config_dir).resolve()
+            file_name = _write_config(config_dir)
+            config = load_config(file_name)
+            assert config["package_root"] == config_dir
+            assert config["installer_name"] == config_dir / "out" / "installer.exe"
+            assert config["include"] == ["app.py"]
+
+            installer = installer_from_config(file_name, env_name="env")
+            assert installer.env_name == "env"
+            assert installer.env_file == config_dir / "environment.yml"
+            assert len(installer.shortcuts) == 1
+
+            with pytest.raises(ValueError):
+                installer_from_config(_write_config(config_dir, colour="red"))
+            with pytest.raises(ValueError):
+                load_config(TEST_FILES_DIR + "/environment.yml")
+
+    def test_build(self, mock_conda):
+        with tempfile.TemporaryDirectory() as config_dir:
+            config_dir = Path(config_dir)
+            installer_name = config_dir / "out" / "installer.exe"
+            trace = config_dir / "trace.json"
+            assert main(["build", str(_write_config(config_dir)), "--trace", str(trace)]) == 0
+            assert installer_name.is_file()
+            assert json.loads(trace.read_text())["traceEvents"]
+            assert main(["build", str(config_dir / "missing.json")]) == 2
+
+    def test_cache(self, capsys):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = EnvCache(cache_dir)
+            cache.prefix("0123456789abcdef").mkdir(parents=True)
+            cache.store("0123456789abcdef")
+            assert main(["cache", "list", "--cache-dir", cache_dir]) == 0
+            assert "0123456789ab" in capsys.readouterr().out
+            assert main(["cache", "purge", "--cache-dir", cache_dir]) == 0
+            assert cache.entries() == []
+
+    def test_import_time(self):
+        # stage modules and conda discovery wait until a build needs them
+        code = (
+            "import sys, time\n"
+            "start = time.perf_counter()\n"
+            "import condansis\n"
+            "duration = time.perf_counter() - start\n"
+            f"print([m for m in {STAGE_MODULES!r} if m in sys.modules], duration)\n"
+        )
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(__file__)))
+        env.pop("CONDA_EXE", None)
+        # fastest of a few runs of each, as the first ones also warm up the disk cache, and
+        # other tests can run at the same time
+        import_time = startup = float("inf")
+        for _ in range(5):
+            output = subprocess.check_output([sys.executable, "-c", code], env=env, text=True)
+            imported, duration = output.rsplit(" ", 1)
+            assert imported == "[]"
+            import_time = min(import_time, float(duration))
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "pass"], env=env, check=True)
+            startup = min(startup, time.perf_counter() - start)
+        assert import_time < IMPORT_BUDGET * startup
@@ -0,0 +1,88 @@
+import os
+from pathlib import Path
+import random
+import tempfile
+
+import pytest
+
+from .compression import CompressionResult, CompressionSettings, benchmark, choose, sample_payload
+from .installer import Installer
+from .tracing import BuildTrace
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+class TestCompression:
+    def test_settings(self):
+        with pytest.raises(ValueError):
+            CompressionSettings("zlib", dict_size=16)
+        with pytest.raises(ValueError):
+            CompressionSettings("zip")
+        data = b"some data " * 1000
+        for settings in [
+            CompressionSettings("zlib"),
+            CompressionSettings("bzip2"),
+            CompressionSettings("lzma", dict_size=16),
+        ]:
+            assert settings.decompress(settings.compress(data)) == data
+        assert str(CompressionSettings("lzma", solid=True, dict_size=16)) == "/SOLID lzma 16MB"
+
+    def test_choose(self):
+        results = [
+            CompressionResult(CompressionSettings("zlib"), 100, 50, 1.0, 0.1),
+            CompressionResult(CompressionSettings("lzma"), 100, 30, 3.0, 0.5),
+            CompressionResult(CompressionSettings("bzip2"), 100, 40, 2.0, 2.0),
+        ]
+        assert choose(results, "size").settings.compressor == "lzma"
+        assert choose(results, "build").settings.compressor == "zlib"
+        assert choose(results, "extract").settings.compressor == "zlib"
+        with pytest.raises(ValueError):
+            choose(results, "fun")
+
+    def test_sample_and_benchmark(self):
+        rng = random.Random(0)
+        with tempfile.TemporaryDirectory() as work_dir:
+            for i in range(50):
+                path = Path(work_dir, "env", f"dir{i % 5}", f"file{i}.txt")
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(bytes(rng.choice(b"abc") for _ in range(1000)))
+            assert len(sample_payload(work_dir, ["env"])) == 50
+            sample = sample_payload(work_dir, ["env"], sample_size=10000)
+            assert 8 <= len(sample) <= 12
+
+            results = benchmark(sample)
+            assert all(r.sample_bytes == 1000 * len(sample) for r in results)
+            assert all(r.compressed_bytes < r.sample_bytes for r in results)
+
+    def test_auto_compression(self):
+        installer = Installer(
+            "package",
+            TEST_FILES_DIR,
+            include=["package_folder"],
+            compressor="auto",
+            datablock_optimize=False,
+            trace=BuildTrace(),
+        )
+        with pytest.raises(ValueError):
+            installer.compression
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+            installer.create_app_dir(work_dir)
+            Path(work_dir, installer.env_name).mkdir()
+            Path(work_dir, installer.env_name, "data.txt").write_text("data " * 1000)
+            chosen = installer.choose_compression(work_dir)
+            assert installer.compression == chosen.settings
+            assert installer.trace.annotations["compression"]["chosen"] == str(chosen.settings)
+            script = installer.create_nsis_script(work_dir).read_text()
+            assert f'"{chosen.settings.compressor}"' in script
+            assert "SetDatablockOptimize off" in script
+
+    def test_nsis_settings(self):
+        installer = Installer(
+            "package", TEST_FILES_DIR, solid_compression=True, compressor_dict_size=64
+        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            script = installer.create_nsis_script(Path(work_dir)).read_text()
+            assert 'SetCompressor /SOLID "lzma"' in script
+            assert "SetCompressorDictSize 64" in script
+            assert "SetDatablockOptimize on" in script
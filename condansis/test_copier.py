@@ -0,0 +1,53 @@
+import os
+from pathlib import Path
+import tempfile
+
+import pytest
+
+from .copier import CopyEngine
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+def _make_tree(root, n_files):
+    for i in range(n_files):
+        path = Path(root, f"dir{i % 3}", f"file{i}.txt")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(str(i))
+
+
+class TestCopyEngine:
+    @pytest.mark.parametrize("n_files", [5, 100])
+    def test_copy_tree(self, n_files):
+        with tempfile.TemporaryDirectory() as root:
+            _make_tree(Path(root, "source"), n_files)
+            engine = CopyEngine(parallel_threshold=50)
+            engine.copy_tree(Path(root, "source"), Path(root, "destination"))
+            for i in range(n_files):
+                destination = Path(root, "destination", f"dir{i % 3}", f"file{i}.txt")
+                assert destination.read_text() == str(i)
+            assert sum(engine.stats.files.values()) == n_files
+
+    def test_fallback(self, monkeypatch):
+        def fail(*args):
+            raise OSError("not supported")
+
+        monkeypatch.setattr(os, "link", fail)
+        with tempfile.TemporaryDirectory() as root:
+            _make_tree(Path(root, "source"), 3)
+            engine = CopyEngine(["hardlink", "copy"])
+            engine.copy_tree(Path(root, "source"), Path(root, "destination"))
+            assert engine.stats.files == {"hardlink": 0, "clone": 0, "copy": 3}
+            assert engine.stats.bytes["copy"] == 3
+
+    def test_replace_existing(self):
+        with tempfile.TemporaryDirectory() as root:
+            Path(root, "source.txt").write_text("new")
+            Path(root, "destination.txt").write_text("old")
+            engine = CopyEngine()
+            engine.copy_file(Path(root, "source.txt"), Path(root, "destination.txt"))
+            assert Path(root, "destination.txt").read_text() == "new"
+
+    def test_invalid_method(self):
+        with pytest.raises(ValueError):
+            CopyEngine(["hardlink"])
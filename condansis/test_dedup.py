@@ -0,0 +1,94 @@
+import os
+from pathlib import Path
+import runpy
+import shutil
+import tempfile
+
+from .dedup import RESTORE_SCRIPT, find_duplicates, needed_at_startup, remove_duplicates
+from .installer import Installer
+from .prefix_records import (
+    RECORDS_FILE_NAME,
+    UNPACK_SCRIPT,
+    read_script_records,
+    write_records_file,
+)
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+def _write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+class TestDedup:
+    def test_find_duplicates(self):
+        with tempfile.TemporaryDirectory() as root:
+            root = Path(root)
+            _write(root / "env" / "python310.dll", b"a" * 2000)
+            _write(root / "env" / "Library" / "bin" / "python310.dll", b"a" * 2000)
+            _write(root / "env" / "Library" / "bin" / "other.dll", b"b" * 2000)
+            _write(root / "env" / "Lib" / "site-packages" / "x" / "LICENSE", b"c" * 2000)
+            _write(root / "env" / "Lib" / "site-packages" / "y" / "LICENSE", b"c" * 2000)
+            _write(root / "env" / "Lib" / "site-packages" / "z" / "LICENSE", b"c" * 2000)
+            _write(root / "env" / "small1", b"d")
+            _write(root / "env" / "small2", b"d")
+
+            duplicates = find_duplicates(
+                root, ["env"], keep=lambda path: needed_at_startup(path[len("env/") :])
+            )
+            assert duplicates == {
+                "env/Library/bin/python310.dll": "env/python310.dll",
+                "env/Lib/site-packages/y/LICENSE": "env/Lib/site-packages/x/LICENSE",
+                "env/Lib/site-packages/z/LICENSE": "env/Lib/site-packages/x/LICENSE",
+            }
+
+            skip = {"env/Library/bin/python310.dll"}
+            assert "env/Library/bin/python310.dll" not in find_duplicates(root, ["env"], skip)
+
+    def test_restore(self):
+        with tempfile.TemporaryDirectory() as root:
+            root = Path(root)
+            _write(root / "env" / "a" / "data.bin", b"a" * 2000)
+            _write(root / "app" / "data.bin", b"a" * 2000)
+            duplicates = find_duplicates(root, ["env", "app"])
+            assert duplicates == {"env/a/data.bin": "app/data.bin"}
+
+            for restore_mode in ["copy", "hardlink"]:
+                manifest_name = root / "env" / "Scripts" / "condansis-dedup.json"
+                manifest_name.parent.mkdir(exist_ok=True)
+                stats = remove_duplicates(root, duplicates, manifest_name, restore_mode)
+                assert (stats.files, stats.bytes) == (1, 2000)
+                assert not (root / "env" / "a" / "data.bin").exists()
+
+                restore = runpy.run_path(str(RESTORE_SCRIPT))["restore"]
+                assert restore(str(root), str(manifest_name)) == 1
+                assert (root / "env" / "a" / "data.bin").read_bytes() == b"a" * 2000
+
+    def test_dedup_payload(self):
+        installer = Installer(
+            "package", TEST_FILES_DIR, include=["package_folder"], dedup=True
+        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+            env_dir = work_dir / installer.env_name
+            shutil.copytree(os.path.join(TEST_FILES_DIR, "package_env"), env_dir)
+            shutil.copy(UNPACK_SCRIPT, env_dir / "Scripts" / "condansis-unpack.py")
+            write_records_file(
+                env_dir / "Scripts" / RECORDS_FILE_NAME,
+                read_script_records(env_dir / "Scripts" / "conda-unpack-script.py"),
+            )
+            # in the prefix records, so it must not be removed
+            _write(env_dir / "Scripts" / "wheel.exe", b"w" * 2000)
+            _write(env_dir / "Scripts" / "wheel2.exe", b"w" * 2000)
+            _write(env_dir / "Lib" / "site-packages" / "a.bin", b"a" * 2000)
+            _write(env_dir / "Lib" / "site-packages" / "b.bin", b"a" * 2000)
+            installer.create_app_dir(work_dir)
+
+            stats = installer.dedup_payload(work_dir)
+            assert stats.files == 1
+            assert not (env_dir / "Lib" / "site-packages" / "b.bin").exists()
+            assert (env_dir / "Scripts" / "wheel.exe").is_file()
+            assert (env_dir / "Scripts" / "wheel2.exe").is_file()
+            assert (env_dir / "Scripts" / "condansis-dedup.py").is_file()
+            assert (work_dir / "package_folder" / "package_file.py").is_file()
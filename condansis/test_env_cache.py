@@ -0,0 +1,130 @@
+import os
+from pathlib import Path
+import shutil
+import itertools
+import tempfile
+import subprocess
+
+import pytest
+
+from . import env_cache
+from .env_cache import EnvCache
+from .installer import Installer
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+def _fill_prefix(prefix, size):
+    prefix.mkdir(parents=True, exist_ok=True)
+    (prefix / "data.bin").write_bytes(b"0" * size)
+
+
+class TestEnvCache:
+    def test_compute_key(self):
+        env_file = os.path.join(TEST_FILES_DIR, "environment.yml")
+        sitecustomize = os.path.join(os.path.dirname(__file__), "sitecustomize.py")
+        key = EnvCache.compute_key(env_file, "conda-env", sitecustomize)
+        assert key == EnvCache.compute_key(env_file, "conda-env", sitecustomize)
+        assert key != EnvCache.compute_key(env_file, "conda", sitecustomize)
+        assert key != EnvCache.compute_key(env_file, "conda-env", sitecustomize, "package")
+
+    def test_store_lookup_purge(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = EnvCache(cache_dir)
+            assert cache.lookup("a") is None
+            prefix = cache.prefix("a")
+            # an entry is only used once it is stored
+            _fill_prefix(prefix, 10)
+            assert cache.lookup("a") is None
+            entry = cache.store("a")
+            assert entry.size == 10
+            assert cache.lookup("a") == prefix
+            assert [e.key for e in cache.entries()] == ["a"]
+            cache.purge()
+            assert cache.entries() == []
+            assert not prefix.exists()
+
+    def test_evict_lru(self, monkeypatch):
+        clock = itertools.count()
+
+        class MockTime:
+            @staticmethod
+            def time():
+                return next(clock)
+
+        monkeypatch.setattr(env_cache, "time", MockTime)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = EnvCache(cache_dir, max_size=25)
+            for key in ["a", "b"]:
+                _fill_prefix(cache.prefix(key), 10)
+                cache.store(key)
+            # "a" is now the most recently used
+            cache.lookup("a")
+            _fill_prefix(cache.prefix("c"), 10)
+            cache.store("c")
+            assert sorted(e.key for e in cache.entries()) == ["a", "c"]
+
+    def test_create_cached_env(self, mock_conda):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            installer = Installer(
+                "package", TEST_FILES_DIR, install_root_package=False, env_cache=cache_dir
+            )
+            env_prefix = installer.create_cached_env()
+            assert (env_prefix / "Lib" / "site-packages" / "sitecustomize.py").is_file()
+            assert installer.create_cached_env() == env_prefix
+            assert len(mock_conda.commands) == 1
+            assert Path(cache_dir).resolve() in env_prefix.parents
+
+    def test_create_cached_env_root_package(self, mock_conda):
+        calls = mock_conda.commands
+        with tempfile.TemporaryDirectory() as package_root:
+            Path(package_root, "environment.yml").write_text("dependencies:\n  - python\n")
+            Path(package_root, "setup.py").write_text("# version 1\n")
+            cache_dir = Path(package_root, ".cache")
+            installer = Installer(
+                "package",
+                package_root,
+                installer_name=os.path.join(package_root, "install_package.exe"),
+                env_cache=cache_dir,
+            )
+            env_prefix = installer.create_cached_env()
+            assert len(calls) == 2
+            # a cache hit leaves the entry untouched
+            entry = installer.env_cache.lookup(installer.env_cache_key())
+            assert installer.create_cached_env() == env_prefix == entry
+            assert len(calls) == 2
+
+            # installers, traces, the cache and build outputs are not part of the package
+            Path(installer.installer_name).write_bytes(b"installer")
+            Path(package_root, "install_variant.exe").write_bytes(b"other installer")
+            Path(package_root, "build.trace.json").write_text("{}")
+            Path(package_root, "build").mkdir()
+            Path(package_root, "build", "setup.py").write_text("# copy\n")
+            assert installer.create_cached_env() == env_prefix
+            assert len(calls) == 2
+
+            Path(package_root, "setup.py").write_text("# version 2\n")
+            assert installer.create_cached_env() != env_prefix
+            assert len(calls) == 4
+
+    @pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+    def test_package_digest_git(self):
+        with tempfile.TemporaryDirectory() as package_root:
+            root = Path(package_root)
+
+            def git(*args):
+                subprocess.run(["git", *args], cwd=root, check=True, capture_output=True)
+
+            git("init")
+            (root / ".gitignore").write_text("*.dat\n")
+            (root / "setup.py").write_text("# version 1\n")
+            git("add", ".gitignore", "setup.py")
+            digest = env_cache.package_digest(root)
+            # ignored files are not installed
+            (root / "data.dat").write_bytes(b"0" * 1000)
+            assert env_cache.package_digest(root) == digest
+            (root / "setup.py").write_text("# version 2\n")
+            modified = env_cache.package_digest(root)
+            assert modified != digest
+            (root / "module.py").write_text("# new\n")
+            assert env_cache.package_digest(root) not in (digest, modified)
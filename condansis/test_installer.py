@@ -1,13 +1,14 @@
 import os
 from pathlib import Path
+import time
 import subprocess
 import pytest
 import tempfile
-import shutil
-
-import conda_pack
 
+from . import teardown
 from .installer import Installer
+from .teardown import remove_tree
+from .prefix_records import read_prefix_records, read_script_records
 
 TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
 
@@ -49,11 +50,7 @@ class TestInstaller:
         assert installer.env_name == "package_env"
         assert os.path.isfile(installer.nsis_template)
 
-    def test_create_temp_env(self, monkeypatch):
-        def mock_run(args, check):
-            os.makedirs(os.path.join(args[args.index("-p") + 1], "Lib", "site-packages"))
-
-        monkeypatch.setattr(subprocess, "run", mock_run)
+    def test_create_temp_env(self, mock_conda):
         installer = Installer("package", ".", install_root_package=False)
         with tempfile.TemporaryDirectory() as env_prefix:
             env_prefix = Path(env_prefix)
@@ -62,22 +59,8 @@ class TestInstaller:
                 env_prefix / "Lib" / "site-packages" / "sitecustomize.py"
             ).is_file()
 
-    def test_pack_temp_env(self, monkeypatch):
-        class MockCondaEnv:
-            @staticmethod
-            def pack(packed_env):
-                shutil.make_archive(
-                    str(packed_env)[:-4],
-                    "tar",
-                    os.path.join(TEST_FILES_DIR, "package_env"),
-                    ".",
-                )
-
-        def mock_from_prefix(*args, **kwargs):
-            return MockCondaEnv()
-
-        monkeypatch.setattr(conda_pack.CondaEnv, "from_prefix", mock_from_prefix)
-        installer = Installer("package", ".")
+    def test_pack_temp_env(self, mock_conda):
+        installer = Installer("package", ".", pack_mode="tar")
         with tempfile.TemporaryDirectory() as work_dir:
             work_dir = Path(work_dir)
             with tempfile.TemporaryDirectory() as env_prefix:
@@ -86,6 +69,21 @@ class TestInstaller:
                 assert (work_dir / installer.env_name).is_dir()
                 assert not env_prefix.with_suffix(".tar").exists()
 
+    def test_pack_temp_env_direct(self, mock_conda):
+        installer = Installer("package", ".")
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+            with tempfile.TemporaryDirectory() as env_prefix:
+                env_prefix = Path(env_prefix)
+                installer.pack_temp_env(work_dir, env_prefix, remove_env=False)
+                assert [format for _, format in mock_conda.packs] == ["no-archive"]
+                scripts_dir = work_dir / installer.env_name / "Scripts"
+                assert (scripts_dir / "condansis-unpack.py").is_file()
+                assert read_prefix_records(scripts_dir / "condansis-unpack.py") == (
+                    read_script_records(scripts_dir / "conda-unpack-script.py")
+                )
+                assert not env_prefix.with_suffix(".tar").exists()
+
     def test_create_app_dir(self):
         installer = Installer(
             "package", TEST_FILES_DIR, include=["environment.yml", "package_folder"]
@@ -105,3 +103,59 @@ class TestInstaller:
             file_contents = open(script_name, "r").read()
             assert "package_folder" in file_contents
             assert "environment.yml" in file_contents
+
+    def test_create(self, mock_conda, monkeypatch):
+        removed = []
+
+        def slow_remove_tree(path):
+            time.sleep(0.2)
+            remove_tree(path)
+            removed.append(path)
+
+        monkeypatch.setattr(teardown, "remove_tree", slow_remove_tree)
+        with tempfile.TemporaryDirectory() as out_dir:
+            installer = Installer(
+                "package",
+                TEST_FILES_DIR,
+                include=["package_folder"],
+                install_root_package=False,
+                installer_name=os.path.join(out_dir, "installer.exe"),
+            )
+            installer.create()
+            assert os.path.isfile(installer.installer_name)
+            assert mock_conda.count("makensis") == 1
+            # the environment removed in the background is gone
+            assert removed and not any(os.path.exists(path) for path in removed)
+
+    def test_create_failure(self, mock_conda):
+        mock_conda.fail.add("installer.exe")
+        with tempfile.TemporaryDirectory() as out_dir:
+            installer = Installer(
+                "package",
+                TEST_FILES_DIR,
+                install_root_package=False,
+                installer_name=os.path.join(out_dir, "installer.exe"),
+            )
+            with pytest.raises(subprocess.CalledProcessError):
+                installer.create()
+            assert not os.path.exists(installer.installer_name)
+
+    def test_precompile_include_dirs(self):
+        installer = Installer(
+            "package", TEST_FILES_DIR, include=["package_folder"], precompile=True
+        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+            installer.create_app_dir(work_dir)
+            installer.precompile_include_dirs(work_dir)
+            assert list((work_dir / "package_folder" / "__pycache__").glob("package_file.*.pyc"))
+            assert not (Path(TEST_FILES_DIR) / "package_folder" / "__pycache__").exists()
+
+            script_name = installer.create_nsis_script(work_dir)
+            assert "-m compileall -q -j 0 --invalidation-mode timestamp" in script_name.read_text()
+
+    def test_precompile_options(self):
+        with pytest.raises(ValueError):
+            Installer("package", TEST_FILES_DIR, precompile_invalidation_mode="never")
+        with pytest.raises(ValueError):
+            Installer("package", TEST_FILES_DIR, precompile_optimize=3)
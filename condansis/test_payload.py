@@ -0,0 +1,93 @@
+import os
+from pathlib import Path
+import tempfile
+
+import pytest
+
+from .compression import CompressionSettings
+from .installer import Installer
+from .payload import Payload
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+def _make_work_dir(work_dir: Path) -> None:
+    (work_dir / "env" / "Lib" / "empty").mkdir(parents=True)
+    (work_dir / "env" / "Lib" / "module.py").write_bytes(b"import os\n" * 10000)
+    (work_dir / "env" / "Lib" / "package.whl").write_bytes(b"0" * 100)
+    (work_dir / "env" / "random.bin").write_bytes(os.urandom(200 * 1024))
+    (work_dir / "env" / "zeros.bin").write_bytes(bytes(200 * 1024))
+
+
+class TestPayload:
+    def test_classify(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+            _make_work_dir(work_dir)
+            payload = Payload.from_work_dir(work_dir, ["env"])
+            assert len(payload.files) == 4
+            assert not any(file.stored for file in payload.files)
+
+            payload.classify("extension")
+            assert [f.path for f in payload.files if f.stored] == ["env/Lib/package.whl"]
+
+            payload.classify("sample")
+            assert [f.path for f in payload.files if f.stored] == [
+                "env/random.bin",
+                "env/Lib/package.whl",
+            ]
+            stats = payload.store_stats(CompressionSettings("zlib"))
+            assert stats.files == 2
+            assert stats.bytes == 200 * 1024 + 100
+
+    def test_blocks(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+            _make_work_dir(work_dir)
+            payload = Payload.from_work_dir(work_dir, ["env"])
+            payload.classify("extension")
+            blocks = payload.blocks()
+            assert [block.stored for block in blocks] == [False, True]
+            assert blocks[0].runs == [
+                ("env\\Lib\\empty", []),
+                ("env", ["env\\random.bin", "env\\zeros.bin"]),
+                ("env\\Lib", ["env\\Lib\\module.py"]),
+            ]
+            assert blocks[1].runs == [("env\\Lib", ["env\\Lib\\package.whl"])]
+
+    def test_nsis_script(self):
+        installer = Installer(
+            "package", TEST_FILES_DIR, env_name="env", store_incompressible="extension"
+        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+            _make_work_dir(work_dir)
+            installer.plan_payload(work_dir)
+            script = installer.create_nsis_script(work_dir).read_text()
+            assert "SetCompress off" in script
+            assert 'File "env\\Lib\\package.whl"' in script
+            assert "File /r" not in script
+
+    def test_order(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+            _make_work_dir(work_dir)
+            (work_dir / "env" / "Lib" / "readme.txt").write_text("text")
+            (work_dir / "env" / "random.bin").write_bytes(bytes(1) + os.urandom(1000))
+            payload = Payload.from_work_dir(work_dir, ["env"])
+            payload.classify("extension")
+            payload.order("type")
+            assert [f.path for f in payload.files] == [
+                "env/Lib/module.py",
+                "env/Lib/readme.txt",
+                "env/random.bin",
+                "env/zeros.bin",
+                "env/Lib/package.whl",
+            ]
+            payload.order(lambda files, work_dir: sorted(files, key=lambda f: f.size))
+            assert payload.files[0].path == "env/Lib/readme.txt"
+            assert payload.files[-1].path == "env/Lib/package.whl"
+            with pytest.raises(ValueError):
+                payload.order(lambda files, work_dir: files[:1])
+            with pytest.raises(ValueError):
+                payload.order("random")
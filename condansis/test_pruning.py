@@ -0,0 +1,74 @@
+import os
+from pathlib import Path
+import shutil
+import tempfile
+
+import pytest
+
+from .prefix_records import (
+    RECORDS_FILE_NAME,
+    UNPACK_SCRIPT,
+    read_prefix_records,
+    read_script_records,
+    write_records_file,
+)
+from .pruning import Pruner, PruneRule
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+class TestPruner:
+    def test_rules(self):
+        pruner = Pruner(["strip-debug", "strip-tests", "!Lib/site-packages/keep/tests"])
+        assert pruner.is_pruned("python310.pdb")
+        assert pruner.is_pruned("Library/bin/LIBSSL.PDB")
+        assert pruner.is_pruned("Lib/site-packages/numpy/core/tests/test_a.py")
+        assert not pruner.is_pruned("Lib/site-packages/keep/tests/test_a.py")
+        assert not pruner.is_pruned("Lib/site-packages/numpy/testing/utils.py")
+        assert not pruner.is_pruned("Scripts/condansis-unpack.py")
+
+    def test_anchored_rules(self):
+        pruner = Pruner(["strip-headers", "/*.txt"])
+        assert pruner.is_pruned("include/Python.h")
+        assert pruner.is_pruned("Library/include/zlib.h")
+        assert pruner.is_pruned("LICENSE.txt")
+        # packages which read their own headers at run time keep them
+        assert not pruner.is_pruned("Lib/site-packages/pkg/include/x.h")
+        assert not pruner.is_pruned("Lib/site-packages/pkg/LICENSE.txt")
+        assert PruneRule("include").matches("Lib/site-packages/pkg/include/x.h")
+
+    def test_regex_rule(self):
+        pruner = Pruner([PruneRule(r"Library/bin/.*\.pdb", regex=True), "!re:.*/openssl\\.pdb"])
+        assert pruner.is_pruned("Library/bin/a.pdb")
+        assert not pruner.is_pruned("Library/bin/openssl.pdb")
+        assert not pruner.is_pruned("python.pdb")
+
+    def test_unknown_preset(self):
+        with pytest.raises(ValueError):
+            Pruner(["strip-everything"])
+
+    def test_prune(self):
+        with tempfile.TemporaryDirectory() as root:
+            env_dir = Path(root, "env")
+            shutil.copytree(os.path.join(TEST_FILES_DIR, "package_env"), env_dir)
+            shutil.copy(UNPACK_SCRIPT, env_dir / "Scripts" / "condansis-unpack.py")
+            write_records_file(
+                env_dir / "Scripts" / RECORDS_FILE_NAME,
+                read_script_records(env_dir / "Scripts" / "conda-unpack-script.py"),
+            )
+            (env_dir / "Library" / "bin").mkdir(parents=True)
+            (env_dir / "Library" / "bin" / "openssl.pdb").write_bytes(b"0" * 10)
+            (env_dir / "Library" / "bin" / "openssl.dll").write_bytes(b"0" * 10)
+            (env_dir / "Library" / "include").mkdir()
+            (env_dir / "Library" / "include" / "a.h").write_bytes(b"0" * 5)
+            n_records = len(read_prefix_records(env_dir / "Scripts" / "condansis-unpack.py"))
+
+            stats = Pruner(["strip-debug", "strip-headers"]).prune(env_dir)
+            assert (stats.files, stats.bytes) == (2, 15)
+            assert (env_dir / "Library" / "bin" / "openssl.dll").is_file()
+            assert not (env_dir / "Library" / "include").exists()
+
+            records = read_prefix_records(env_dir / "Scripts" / "condansis-unpack.py")
+            assert len(records) == n_records - stats.records
+            assert stats.records == 8
+            assert not any(path.endswith(".pdb") for path, _, _ in records)
@@ -0,0 +1,69 @@
+import io
+from pathlib import Path
+import zipfile
+import tempfile
+
+from .prefix_records import (
+    RECORDS_FILE_NAME,
+    UNPACK_SCRIPT,
+    read_prefix_records,
+    write_records_file,
+)
+from .record_check import RecordCheckStats, drop_noop_records, find_noop_records
+
+PLACEHOLDER = "C:\\ci\\openssl_1630592237340\\_h_env"
+# spelling of the placeholder in some records of conda-pack, which is not in the files
+ESCAPED = PLACEHOLDER.replace("\\", "\\\\")
+
+
+def _launcher(placeholder: str) -> bytes:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as f:
+        f.writestr("__main__.py", "print('entry point')")
+    return b"MZ launcher\0" + f"#!{placeholder}\\python.exe\r\n".encode() + archive.getvalue()
+
+
+def _make_env(env_dir: Path):
+    files = {
+        "Scripts/tool.exe": _launcher(PLACEHOLDER),
+        "Library/bin/libcrypto.dll": b"\1\2" + PLACEHOLDER.encode() + b"\\lib\0\3",
+        "Library/bin/openssl.pdb": b"\1\2" + PLACEHOLDER.lower().encode() + b"\0\3",
+        "Library/ssl/misc/CA.pl": f"my $dir = '{PLACEHOLDER}\\ssl';\n".encode(),
+        "Library/bin/c_rehash.pl": f"my $dir = '{PLACEHOLDER}\\ssl';\n".encode(),
+    }
+    for path, data in files.items():
+        (env_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (env_dir / path).write_bytes(data)
+    return [
+        ("Scripts/tool.exe", PLACEHOLDER, "binary"),
+        ("Library/bin/libcrypto.dll", PLACEHOLDER, "binary"),
+        ("Library/bin/openssl.pdb", PLACEHOLDER, "binary"),
+        ("Library/ssl/misc/CA.pl", PLACEHOLDER, "text"),
+        ("Library/bin/c_rehash.pl", ESCAPED, "text"),
+        ("Library/bin/c_rehash.pl", PLACEHOLDER, "text"),
+        ("Library/bin/missing.pl", PLACEHOLDER, "text"),
+    ]
+
+
+class TestRecordCheck:
+    def test_find_noop_records(self):
+        with tempfile.TemporaryDirectory() as env_dir:
+            env_dir = Path(env_dir)
+            records = _make_env(env_dir)
+            kept, stats = find_noop_records(env_dir, records, max_workers=2)
+            assert kept == [records[0], records[3], records[5], records[6]]
+            sizes = [(env_dir / r[0]).stat().st_size for r in records[1:3]]
+            assert stats == RecordCheckStats(records=3, files=2, bytes=sum(sizes))
+
+    def test_drop_noop_records(self):
+        with tempfile.TemporaryDirectory() as env_dir:
+            env_dir = Path(env_dir)
+            records = _make_env(env_dir)
+            (env_dir / "Scripts" / "condansis-unpack.py").write_text(UNPACK_SCRIPT.read_text())
+            write_records_file(env_dir / "Scripts" / RECORDS_FILE_NAME, records)
+            stats = drop_noop_records(env_dir)
+            assert stats.records == 3
+            kept = read_prefix_records(env_dir / "Scripts" / "condansis-unpack.py")
+            assert kept == [records[0], records[3], records[5], records[6]]
+            # nothing left to drop
+            assert drop_noop_records(env_dir) == RecordCheckStats()
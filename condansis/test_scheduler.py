@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from .scheduler import StageScheduler
+
+
+class TestStageScheduler:
+    def test_dependencies(self):
+        order = []
+        lock = threading.Lock()
+
+        def stage(name):
+            def func():
+                with lock:
+                    order.append(name)
+                return name
+
+            return func
+
+        scheduler = StageScheduler()
+        scheduler.add("a", stage("a"))
+        scheduler.add("b", stage("b"), after=["a"])
+        scheduler.add("c", stage("c"))
+        scheduler.add("d", stage("d"), after=["b", "c"])
+        results = scheduler.run()
+        assert results == {"a": "a", "b": "b", "c": "c", "d": "d"}
+        assert order.index("a") < order.index("b") < order.index("d")
+        assert order.index("c") < order.index("d")
+
+    def test_concurrent(self):
+        # both stages can only finish if they run at the same time
+        barrier = threading.Barrier(2, timeout=5)
+        scheduler = StageScheduler()
+        scheduler.add("a", barrier.wait)
+        scheduler.add("b", barrier.wait)
+        scheduler.run()
+
+    def test_unknown_dependency(self):
+        scheduler = StageScheduler()
+        with pytest.raises(ValueError):
+            scheduler.add("a", lambda: None, after=["b"])
+
+    def test_failure(self):
+        cleaned = []
+
+        def fail():
+            raise RuntimeError("failed")
+
+        scheduler = StageScheduler(max_workers=1)
+        scheduler.add("a", lambda: None, cleanup=lambda: cleaned.append("a"))
+        scheduler.add("b", fail, after=["a"], cleanup=lambda: cleaned.append("b"))
+        scheduler.add("c", lambda: None, after=["b"], cleanup=lambda: cleaned.append("c"))
+        with pytest.raises(RuntimeError):
+            scheduler.run()
+        assert cleaned == ["b", "a"]
+        assert "c" not in scheduler.results
@@ -0,0 +1,47 @@
+import os
+from pathlib import Path
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from .installer import SITECUSTOMIZE
+from .prefix_records import unpack_engine
+
+# prints PATH as seen by Python, and by a Python started from it
+PRINT_PATHS = (
+    "import os, subprocess, sys\n"
+    "print(os.environ['PATH'])\n"
+    "sys.stdout.flush()\n"
+    "subprocess.run([sys.executable, '-c', 'import os; print(os.environ[\"PATH\"])'])\n"
+)
+
+
+class TestSitecustomize:
+    def test_dll_directories(self):
+        with tempfile.TemporaryDirectory() as prefix:
+            site_packages = Path(prefix, "Lib", "site-packages")
+            site_packages.mkdir(parents=True)
+            Path(prefix, "Library", "bin").mkdir(parents=True)
+            unpack_engine().write_dll_directories(prefix)
+            # not an environment made by condansis
+            assert not (site_packages / "condansis_dll_directories.py").exists()
+
+            shutil.copy(SITECUSTOMIZE, site_packages)
+            unpack_engine().write_dll_directories(prefix)
+            dll_directories = os.path.join(prefix, "Library", "bin")
+            module = {}
+            exec((site_packages / "condansis_dll_directories.py").read_text(), module)
+            assert module["DLL_DIRECTORIES"] == [dll_directories]
+
+            env = dict(os.environ, PYTHONPATH=str(site_packages))
+            args = [sys.executable, "-c", PRINT_PATHS]
+            path, child_path = subprocess.check_output(args, env=env, text=True).splitlines()
+            assert path == os.pathsep.join([dll_directories, os.environ["PATH"]])
+            # already in PATH, so not added again
+            assert child_path == path
+
+            # nor when PATH has it with a trailing separator
+            env["PATH"] = os.pathsep.join([dll_directories + os.sep, os.environ["PATH"]])
+            path, _ = subprocess.check_output(args, env=env, text=True).splitlines()
+            assert path == env["PATH"]
@@ -0,0 +1,106 @@
+import os
+from pathlib import Path
+import tempfile
+
+from .installer import Installer
+from .staging import StagingDir
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+class TestStagingDir:
+    def test_incremental_sync(self):
+        with tempfile.TemporaryDirectory() as root:
+            source = Path(root, "source")
+            (source / "sub").mkdir(parents=True)
+            (source / "a.txt").write_text("a")
+            (source / "sub" / "b.txt").write_text("b")
+
+            staging = StagingDir(Path(root, "staging"))
+            staging.sync_tree(source, "app")
+            assert staging.finish().copied == 2
+
+            # nothing changed
+            staging = StagingDir(Path(root, "staging"))
+            staging.sync_tree(source, "app")
+            stats = staging.finish()
+            assert (stats.copied, stats.unchanged, stats.deleted) == (0, 2, 0)
+
+            # one file changed and one removed
+            (source / "a.txt").write_text("aa")
+            (source / "sub" / "b.txt").unlink()
+            staging = StagingDir(Path(root, "staging"))
+            staging.sync_tree(source, "app")
+            stats = staging.finish()
+            assert (stats.copied, stats.unchanged, stats.deleted) == (1, 0, 1)
+            assert Path(root, "staging", "app", "a.txt").read_text() == "aa"
+            assert not Path(root, "staging", "app", "sub").exists()
+
+    def test_touched_file(self):
+        with tempfile.TemporaryDirectory() as root:
+            Path(root, "a.txt").write_text("a")
+            staging = StagingDir(Path(root, "staging"))
+            assert staging.sync_file(Path(root, "a.txt"), "a.txt")
+            staging.finish()
+            # same contents, new modification time
+            os.utime(Path(root, "a.txt"), (0, 0))
+            staging = StagingDir(Path(root, "staging"))
+            assert not staging.sync_file(Path(root, "a.txt"), "a.txt")
+
+    def test_create_app_dir(self):
+        installer = Installer(
+            "package", TEST_FILES_DIR, include=["environment.yml", "package_folder"]
+        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            for copied in [2, 0]:
+                staging = StagingDir(work_dir)
+                installer.create_app_dir(Path(work_dir), staging)
+                assert staging.finish().copied == copied
+            assert os.path.exists(os.path.join(work_dir, "package_folder", "package_file.py"))
+
+    def test_derived_files(self):
+        with tempfile.TemporaryDirectory() as root:
+            package_root = Path(root, "package")
+            (package_root / "pkg").mkdir(parents=True)
+            (package_root / "pkg" / "a.py").write_text("a = 1")
+            (package_root / "pkg" / "b.py").write_text("b = 1")
+            installer = Installer(
+                "package",
+                package_root,
+                include=["pkg"],
+                env_file=os.path.join(TEST_FILES_DIR, "environment.yml"),
+                precompile=True,
+            )
+            work_dir = Path(root, "staging")
+            pycache = work_dir / "pkg" / "__pycache__"
+            for removed in [False, True]:
+                if removed:
+                    (package_root / "pkg" / "b.py").unlink()
+                    # written by a stage which is no longer enabled
+                    (work_dir / "pkg" / "condansis-dedup.json").write_text("{}")
+                staging = StagingDir(work_dir)
+                installer.create_app_dir(work_dir, staging)
+                installer.precompile_include_dirs(work_dir, staging)
+                staging.finish()
+            # the compiled file of the removed module is deleted with it
+            assert [path.name.split(".")[0] for path in pycache.iterdir()] == ["a"]
+            assert sorted(os.listdir(work_dir / "pkg")) == ["__pycache__", "a.py"]
+
+            # and so are the compiled files once precompile is disabled
+            staging = StagingDir(work_dir)
+            installer.create_app_dir(work_dir, staging)
+            staging.finish()
+            assert not pycache.exists()
+
+    def test_parallel_sync(self):
+        with tempfile.TemporaryDirectory() as root:
+            source = Path(root, "source")
+            source.mkdir()
+            for i in range(20):
+                (source / f"{i}.txt").write_text(str(i))
+            staging = StagingDir(Path(root, "staging"))
+            staging.engine.parallel_threshold = 4
+            staging.sync_tree(source, "app")
+            assert staging.finish().copied == 20
+            assert staging.engine.stats.files["hardlink"] + staging.engine.stats.files["copy"] == 20
+            assert Path(root, "staging", "app", "7.txt").read_text() == "7"
@@ -0,0 +1,52 @@
+import os
+from pathlib import Path
+import sys
+import stat
+import tempfile
+import subprocess
+
+from .teardown import TEMP_ENV_PREFIX, TRASH_PREFIX, clean_abandoned, discard, wait_for_removals
+
+
+def _make_tree(path: Path) -> None:
+    (path / "Lib").mkdir(parents=True)
+    (path / "Lib" / "module.py").write_text("import os")
+    (path / "python.dll").write_bytes(b"dll")
+    os.chmod(path / "python.dll", stat.S_IREAD)
+
+
+def _dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+class TestTeardown:
+    def test_discard(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            prefix = Path(tmp_dir, "env")
+            _make_tree(prefix)
+            thread = discard(prefix)
+            # the name can be reused at once
+            assert not prefix.exists()
+            prefix.mkdir()
+            assert wait_for_removals(timeout=10)
+            assert not thread.is_alive()
+            assert os.listdir(tmp_dir) == ["env"]
+            assert discard(Path(tmp_dir, "missing")) is None
+
+    def test_clean_abandoned(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dead = _dead_pid()
+            abandoned = [
+                Path(tmp_dir, f"{TEMP_ENV_PREFIX}{dead}-abc"),
+                Path(tmp_dir, f"{TRASH_PREFIX}{dead}-0123"),
+            ]
+            alive = [
+                Path(tmp_dir, f"{TEMP_ENV_PREFIX}{os.getpid()}-abc"),
+                Path(tmp_dir, "other"),
+            ]
+            for path in abandoned + alive:
+                _make_tree(path)
+            assert sorted(clean_abandoned(tmp_dir, wait=True)) == sorted(abandoned)
+            assert sorted(os.listdir(tmp_dir)) == sorted(path.name for path in alive)
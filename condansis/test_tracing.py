@@ -0,0 +1,53 @@
+import os
+import json
+import tempfile
+
+from .installer import Installer
+from .tracing import BuildTrace
+
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+class TestBuildTrace:
+    def test_span(self):
+        trace = BuildTrace()
+        with trace.span("stage") as span:
+            span.files, span.bytes = 2, 10
+        with trace.span("conda", "subprocess", command=["conda"]):
+            pass
+        data = trace.to_json()
+        assert [s["name"] for s in data["spans"]] == ["stage", "conda"]
+        assert data["spans"][0]["files"] == 2
+        events = trace.to_chrome_trace()["traceEvents"]
+        assert events[0]["ph"] == "X"
+        assert events[0]["args"]["bytes"] == 10
+        assert events[1]["args"]["command"] == ["conda"]
+
+    def test_installer_trace(self, mock_conda):
+        trace = BuildTrace()
+        with tempfile.TemporaryDirectory() as out_dir:
+            installer = Installer(
+                "package",
+                TEST_FILES_DIR,
+                include=["package_folder"],
+                install_root_package=False,
+                installer_name=os.path.join(out_dir, "installer.exe"),
+                trace=trace,
+            )
+            installer.create()
+            trace.save_chrome_trace(os.path.join(out_dir, "trace.json"))
+            with open(os.path.join(out_dir, "trace.json")) as f:
+                assert json.load(f)["traceEvents"]
+        stages = {s.name: s for s in trace.spans if s.category == "stage"}
+        assert set(stages) == {
+            "create_temp_env",
+            "pack_temp_env",
+            "remove_temp_env",
+            "create_app_dir",
+            "create_nsis_script",
+            "run_nsis",
+        }
+        assert stages["pack_temp_env"].files > 0
+        assert stages["create_app_dir"].files == 1
+        subprocesses = [s.name for s in trace.spans if s.category == "subprocess"]
+        assert sorted(subprocesses) == ["conda", "makensis"]
@@ -0,0 +1,252 @@
+import io
+import os
+from pathlib import Path
+import sys
+import zipfile
+import tempfile
+import subprocess
+
+import pytest
+
+from .prefix_records import (
+    RECORDS_FILE_NAME,
+    UNPACK_SCRIPT,
+    read_prefix_records,
+    unpack_engine,
+    write_prefix_records,
+    write_records_file,
+)
+
+# 41 characters
+PLACEHOLDER = "/opt/ci/placehold_placehold_placehold_env"
+TEST_FILES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_files"))
+
+
+def _make_env(env_dir: Path, n_files: int = 200):
+    records = []
+    for i in range(n_files):
+        path = Path("lib", f"dir{i % 7}", f"file{i}.py")
+        (env_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (env_dir / path).write_text(f"prefix = '{PLACEHOLDER}/lib'\n# file {i}\n")
+        records.append((path.as_posix(), PLACEHOLDER, "text"))
+    return records
+
+
+def _text_prefix(engine, prefix: Path) -> str:
+    # on Windows, the prefix is written to text files with forward slashes
+    return str(prefix).replace("\\", "/") if engine.on_win else str(prefix)
+
+
+class TestUnpack:
+    def test_relocate(self):
+        engine = unpack_engine()
+        with tempfile.TemporaryDirectory() as env_dir:
+            env_dir = Path(env_dir)
+            records = _make_env(env_dir)
+            records.insert(3, ("lib/missing.py", PLACEHOLDER, "text"))
+            records.append(("lib/also_missing.py", PLACEHOLDER, "text"))
+            errors = engine.relocate(records, str(env_dir), workers=4)
+            assert [(index, path) for index, path, _ in errors] == [
+                (3, "lib/missing.py"),
+                (len(records) - 1, "lib/also_missing.py"),
+            ]
+            for path, _, _ in records[:3] + records[4:-1]:
+                text = (env_dir / path).read_text()
+                assert PLACEHOLDER not in text
+                assert f"prefix = '{_text_prefix(engine, env_dir)}/lib'" in text
+
+    def test_large_files(self, monkeypatch):
+        engine = unpack_engine()
+        monkeypatch.setattr(engine, "LARGE_FILE_SIZE", 100)
+        with tempfile.TemporaryDirectory() as env_dir:
+            env_dir = Path(env_dir)
+            records = _make_env(env_dir, 10)
+            (env_dir / "lib" / "large.txt").write_text((PLACEHOLDER + "\n") * 100)
+            records.append(("lib/large.txt", PLACEHOLDER, "text"))
+            assert engine.relocate(records, str(env_dir)) == []
+            expected = f"{_text_prefix(engine, env_dir)}\n" * 100
+            assert (env_dir / "lib" / "large.txt").read_text() == expected
+
+    def test_large_file_paths(self, monkeypatch):
+        engine = unpack_engine()
+        monkeypatch.setattr(engine, "LARGE_FILE_SIZE", 1)
+        # pieces smaller than the placeholder, so that placeholders span several of them
+        monkeypatch.setattr(engine, "CHUNK_SIZE", 7)
+        placeholder = PLACEHOLDER.encode()
+        text = b"start " + placeholder + b"/bin\n" * 3 + placeholder + b" end " + placeholder
+        binary = b"\1\2" + placeholder + b"/lib\0\3" + placeholder + b"\0\4"
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as f:
+            f.writestr("__main__.py", "print('entry point')")
+        launcher = b"MZ launcher" + placeholder + b"\0" + b"#!" + placeholder + b"\\python.exe\r\n"
+        launcher += archive.getvalue()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "file")
+            cases = [
+                (text, "text", "/short", text.replace(placeholder, b"/short")),
+                (text, "text", "x" * len(PLACEHOLDER), text.replace(placeholder, b"x" * 41)),
+                (binary, "binary", "/short", engine.binary_replace(binary, placeholder, b"/short")),
+                (text, "text", PLACEHOLDER, text),
+            ]
+            for data, mode, new_prefix, expected in cases:
+                Path(path).write_bytes(data)
+                engine.update_prefix(path, new_prefix, PLACEHOLDER, mode)
+                assert Path(path).read_bytes() == expected
+            assert not os.path.exists(path + ".condansis-tmp")
+
+            # a prefix longer than the placeholder does not fit in a binary file
+            Path(path).write_bytes(binary)
+            with pytest.raises(ValueError):
+                engine.update_prefix(path, "/" + "l" * 60, PLACEHOLDER, "binary")
+            assert Path(path).read_bytes() == binary
+
+            monkeypatch.setattr(engine, "on_win", True)
+            for new_prefix in ["C:\\Short", "C:\\" + "L" * 60]:
+                Path(path).write_bytes(launcher)
+                engine.update_prefix(path, new_prefix, PLACEHOLDER, "binary")
+                expected = engine.replace_pyzzer_entry_point_shebang(
+                    launcher, placeholder, new_prefix.lower().encode()
+                )
+                assert Path(path).read_bytes() == expected
+                assert expected != launcher
+
+    def test_plan(self):
+        engine = unpack_engine()
+        other = PLACEHOLDER + "_longer"
+        records = [
+            ("a.py", PLACEHOLDER, "text"),
+            ("b.py", PLACEHOLDER, "text"),
+            ("a.py", other, "text"),
+            ("c.bin", PLACEHOLDER, "binary"),
+        ]
+        plan = engine.RelocationPlan(records, "/new")
+        assert len(plan.matchers) == 3
+        assert [(index, path) for index, path, _ in plan.files] == [
+            (0, "a.py"),
+            (1, "b.py"),
+            (3, "c.bin"),
+        ]
+        # both placeholders of a.py are replaced in one pass, the longest one first
+        [matcher] = plan.files[0][2]
+        data = f"{PLACEHOLDER}/x {other}/y".encode()
+        assert matcher.replace(data) == b"/new/x /new/y"
+
+        binary = b"\1" + PLACEHOLDER.encode() + b"/lib\0\2"
+        for (_, placeholder, mode), data in [(records[1], data), (records[3], binary)]:
+            expected = engine.replace_prefix(data, mode, placeholder, "/new")
+            assert plan.matchers[placeholder, mode].replace(data) == expected
+
+    def test_script(self):
+        with tempfile.TemporaryDirectory() as env_dir:
+            env_dir = Path(env_dir)
+            records = _make_env(env_dir, 20)
+            (env_dir / "Scripts").mkdir()
+            script = env_dir / "Scripts" / "condansis-unpack.py"
+            script.write_text(UNPACK_SCRIPT.read_text())
+            write_prefix_records(script, records)
+            subprocess.run([sys.executable, str(script), "--workers", "3"], check=True)
+            assert all(PLACEHOLDER not in (env_dir / r[0]).read_text() for r in records)
+
+            verify = [sys.executable, str(script), "--verify"]
+            assert subprocess.run(verify, capture_output=True).returncode == 0
+            (env_dir / records[4][0]).write_text(f"prefix = '{PLACEHOLDER}'")
+            result = subprocess.run(verify, capture_output=True, text=True)
+            assert (result.returncode, result.stdout) == (1, f"{records[4][0]}\n")
+            subprocess.run([sys.executable, str(script), "--resume"], check=True)
+            assert PLACEHOLDER not in (env_dir / records[4][0]).read_text()
+
+            (env_dir / records[5][0]).unlink()
+            result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True)
+            assert result.returncode == 1
+            assert records[5][0] in result.stderr
+
+    def test_records_file(self):
+        engine = unpack_engine()
+        records = [
+            ("Lib\\a.py", PLACEHOLDER, "text"),
+            ("Lib\\b c.pyc", PLACEHOLDER, "binary"),
+            ("Lib\\d.py", "C:\\other", "text"),
+        ]
+        with tempfile.TemporaryDirectory() as env_dir:
+            env_dir = Path(env_dir)
+            records_file = env_dir / RECORDS_FILE_NAME
+            write_records_file(records_file, records)
+            assert list(engine.load_records(str(records_file))) == records
+            # the records of a script are in the records file next to it
+            script = env_dir / "condansis-unpack.py"
+            script.write_text(UNPACK_SCRIPT.read_text())
+            assert read_prefix_records(script) == records
+            write_prefix_records(script, records[1:])
+            assert list(engine.load_records(str(records_file))) == records[1:]
+            assert script.read_text() == UNPACK_SCRIPT.read_text()
+            # each placeholder is written once
+            assert records_file.read_text().count(PLACEHOLDER) == 1
+
+            records = _make_env(env_dir, 20)
+            (env_dir / "Scripts").mkdir()
+            write_records_file(env_dir / "Scripts" / RECORDS_FILE_NAME, records)
+            (env_dir / "Scripts" / "condansis-unpack.py").write_text(UNPACK_SCRIPT.read_text())
+            subprocess.run(
+                [sys.executable, str(env_dir / "Scripts" / "condansis-unpack.py")], check=True
+            )
+            assert all(PLACEHOLDER not in (env_dir / r[0]).read_text() for r in records)
+
+    def test_journal(self, monkeypatch):
+        engine = unpack_engine()
+        relocated = []
+        relocate_file = engine.RelocationPlan.relocate_file
+
+        def record_relocation(plan, path, matchers):
+            relocated.append(Path(path).relative_to(plan.new_prefix).as_posix())
+            relocate_file(plan, path, matchers)
+
+        monkeypatch.setattr(engine.RelocationPlan, "relocate_file", record_relocation)
+        with tempfile.TemporaryDirectory() as env_dir:
+            env_dir = Path(env_dir)
+            records = _make_env(env_dir, 30)
+            originals = {r[0]: (env_dir / r[0]).read_bytes() for r in records}
+            journal_name = str(env_dir / "journal")
+
+            def journal():
+                return engine.Journal(journal_name, engine.records_digest(records, str(env_dir)))
+
+            assert engine.relocate(records, str(env_dir), 4, journal(), resume=True) == []
+            assert len(relocated) == 30
+            assert len(Path(journal_name).read_bytes().splitlines()) == 31
+
+            # a file put back by a reinstall, and a file whose line was not written
+            (env_dir / records[3][0]).write_bytes(originals[records[3][0]])
+            lines = Path(journal_name).read_bytes().splitlines(keepends=True)
+            line = [line for line in lines[1:] if line.split()[0] == b"7"][0]
+            Path(journal_name).write_bytes(b"".join(l for l in lines if l != line) + line[:-3])
+            plan = engine.RelocationPlan(records, str(env_dir))
+            resumed = journal()
+            assert resumed.load()
+            pending = engine.pending_files(plan, resumed)
+            assert [path for _, path, _ in pending] == [records[3][0], records[7][0]]
+
+            del relocated[:]
+            assert engine.relocate(records, str(env_dir), 4, journal(), resume=True) == []
+            assert sorted(relocated) == sorted([records[3][0], records[7][0]])
+            assert PLACEHOLDER not in (env_dir / records[3][0]).read_text()
+            resumed = journal()
+            assert resumed.load()
+            assert engine.pending_files(plan, resumed) == []
+            # a journal rewritten with Windows line endings
+            journal_bytes = Path(journal_name).read_bytes()
+            Path(journal_name).write_bytes(journal_bytes.replace(b"\n", b"\r\n"))
+            resumed = journal()
+            assert resumed.load()
+            assert engine.pending_files(plan, resumed) == []
+            Path(journal_name).write_bytes(journal_bytes)
+
+            # a journal of other records is ignored, and a fresh run starts it again
+            del relocated[:]
+            other = engine.Journal(journal_name, engine.records_digest(records[1:], str(env_dir)))
+            assert not other.load()
+            assert engine.relocate(records[1:], str(env_dir), 1, other, resume=True) == []
+            assert len(relocated) == 29
+            del relocated[:]
+            assert engine.relocate(records, str(env_dir), 1, journal()) == []
+            assert len(relocated) == 30
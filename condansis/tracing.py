@@ -0,0 +1,216 @@
+""" Timing and tracing of the build pipeline """
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from pathlib import Path
+import os
+import json
+import time
+import functools
+import threading
+import contextlib
+from dataclasses import dataclass, field, asdict
+
+
+def path_usage(path: Union[str, Path]) -> Tuple[int, int]:
+    """ Number of files and bytes in a file or directory tree """
+    path = Path(path)
+    if path.is_file():
+        return 1, path.stat().st_size
+    files = size = 0
+    for root, _, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+            files += 1
+    return files, size
+
+
+def _children_cpu_time() -> float:
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+@dataclass
+class Span:
+    """ A timed part of the build
+
+    Parameters
+    ------------
+    name: str
+        Name of the method or executable
+
+    category: "stage" or "subprocess"
+        What was timed
+
+    start: float
+        Start time in seconds, relative to the start of the trace
+
+    duration: float
+        Wall time in seconds
+
+    cpu_time: float
+        CPU time in seconds. For stages, the time of the thread running it. For subprocesses, the time
+        of all child processes finishing while it ran (not available in Windows)
+
+    thread: int
+        Index of the thread running the span
+
+    files: int or None
+        Number of files produced
+
+    bytes: int or None
+        Number of bytes produced
+
+    args: dict
+        Other information, such as the command line of subprocesses
+    """
+
+    name: str
+    category: str
+    start: float
+    duration: float = 0.0
+    cpu_time: float = 0.0
+    thread: int = 0
+    files: Optional[int] = None
+    bytes: Optional[int] = None
+    args: Dict[str, Any] = field(default_factory=dict)
+
+
+class BuildTrace:
+    """ Records the wall time, CPU time, files and bytes of each build stage and subprocess
+
+    Pass it to :class:`condansis.Installer` and export it after the build
+
+    Examples
+    ---------
+    >>> trace = BuildTrace()
+    >>> Installer("package", ".", trace=trace).create()
+    >>> trace.save_chrome_trace("build_trace.json")
+    """
+
+    def __init__(self) -> None:
+        self.spans: List[Span] = []
+        self.annotations: Dict[str, Any] = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._threads: Dict[int, int] = {}
+
+    def _thread_index(self) -> int:
+        with self._lock:
+            return self._threads.setdefault(threading.get_ident(), len(self._threads))
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = "stage", **args: Any) -> Iterator[Span]:
+        """ Times the enclosed block
+
+        Parameters
+        -----------
+        name: str
+            Name of the span
+
+        category: str (optional)
+            "stage" or "subprocess". Default: "stage"
+
+        args:
+            Other information to store in the span
+
+        Yields
+        -------
+        span: Span
+            The span, whose files and bytes can be set inside the block
+        """
+        span = Span(name, category, time.perf_counter() - self._origin, thread=self._thread_index())
+        span.args.update(args)
+        if category == "subprocess":
+            cpu_time = _children_cpu_time
+        else:
+            cpu_time = time.thread_time
+        cpu_start = cpu_time()
+        try:
+            yield span
+        finally:
+            span.cpu_time = cpu_time() - cpu_start
+            span.duration = time.perf_counter() - self._origin - span.start
+            with self._lock:
+                self.spans.append(span)
+
+    def annotate(self, key: str, value: Any) -> None:
+        """ Records a decision taken during the build, such as the chosen compression
+
+        Parameters
+        -----------
+        key: str
+            Name of the decision
+
+        value:
+            JSON-serializable description of the decision
+        """
+        with self._lock:
+            self.annotations[key] = value
+
+    def to_json(self) -> Dict[str, Any]:
+        """ The trace as a JSON-serializable dictionary """
+        return {
+            "spans": [asdict(span) for span in sorted(self.spans, key=lambda s: s.start)],
+            "annotations": self.annotations,
+        }
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """ The trace in Chrome's trace event format, for chrome://tracing or Perfetto """
+        events = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            args = dict(span.args, cpu_time=span.cpu_time)
+            if span.files is not None:
+                args.update(files=span.files, bytes=span.bytes)
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": span.start * 1e6,
+                    "dur": span.duration * 1e6,
+                    "pid": os.getpid(),
+                    "tid": span.thread,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.annotations}
+
+    def save_json(self, file_name: Union[str, Path]) -> None:
+        """ Writes the trace as JSON """
+        with open(file_name, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def save_chrome_trace(self, file_name: Union[str, Path]) -> None:
+        """ Writes the trace in Chrome's trace event format """
+        with open(file_name, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+def traced(measure: Callable[..., Optional[Tuple[int, int]]] = None) -> Callable:
+    """ Decorates an Installer method so that it is timed when the installer has a trace
+
+    Parameters
+    -----------
+    measure: callable (optional)
+        Called with the installer, the return value and the arguments of the method.
+        Returns the number of files and bytes the method produced
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.trace is None:
+                return method(self, *args, **kwargs)
+            with self.trace.span(method.__name__) as span:
+                result = method(self, *args, **kwargs)
+                if measure is not None:
+                    usage = measure(self, result, *args, **kwargs)
+                    if usage is not None:
+                        span.files, span.bytes = usage
+            return result
+
+        return wrapper
+
+    return decorator
@@ -1,7 +1,10 @@
 from pathlib import Path
+import logging
 import condansis
 
 if __name__ == "__main__":
+    # show the progress of the build
+    logging.basicConfig(level=logging.INFO)
     this_dir = Path(__file__).parent
 
     # instantiate Installer
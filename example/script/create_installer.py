@@ -1,7 +1,10 @@
 import os
+import logging
 import condansis
 
 if __name__ == "__main__":
+    # show the progress of the build
+    logging.basicConfig(level=logging.INFO)
     this_dir = os.path.dirname(__file__)
 
     # instantiate Installer
@@ -3,9 +3,12 @@ This example creates and environment based in a conda-lock file (https://github.
 """
 
 import os
+import logging
 import condansis
 
 if __name__ == "__main__":
+    # show the progress of the build
+    logging.basicConfig(level=logging.INFO)
     this_dir = os.path.dirname(__file__)
 
     # instantiate Installer
@@ -26,11 +26,14 @@ setup(
     keywords="packaging, installer, windows",
     packages=find_packages(),
     python_requires=">=3.8, <4",
-    install_requires=["conda-pack>=0.5", "jinja2"],
+    install_requires=["conda-pack>=0.7", "jinja2"],
     extras_require={
         "test": ["pytest"],
     },
     package_data={
         "condansis": ["*.nsi", "test_files/*"],
     },
+    entry_points={
+        "console_scripts": ["condansis=condansis.cli:main"],
+    },
 )